@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+'''
+Benchmarks the fetch path against the local stand-in server: throughput,
+latency percentiles, parse cost and memory per poll. Prints JSON so the
+results can be compared between versions.
+
+    python benchmarks/fetch.py --polls 200 > results.json
+
+--worker goes through Worker.get_data (needs PyQt5) instead of the Fetcher
+it uses.
+'''
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import standin  # noqa: E402
+from wf_sentient_tracker.snapshot import SECTIONS, keys  # noqa: E402
+from wf_sentient_tracker.worldstate import Fetcher, extract, extract_tmp  # noqa: E402
+
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return None
+
+    def pick(fraction):
+        return round(values[min(len(values) - 1, int(fraction * len(values)))] * 1000, 3)
+
+    return {"p50": pick(0.5), "p90": pick(0.9), "p99": pick(0.99),
+            "max": round(values[-1] * 1000, 3),
+            "mean": round(statistics.mean(values) * 1000, 3)}
+
+
+def make_poll(url, worker):
+    '''
+    Returns a function doing one poll of a platform
+    '''
+    if not worker:
+        fetcher = Fetcher()
+        fetcher.base_url = url
+        return fetcher.fetch, fetcher
+
+    from PyQt5.QtCore import QCoreApplication
+    from wf_sentient_tracker.main import Worker
+    make_poll.app = QCoreApplication.instance() or QCoreApplication(sys.argv[:1])
+    worker = Worker()
+    worker.fetcher.base_url = url
+    worker.start_worker()
+
+    # Every poll should reach the server
+    worker.coordinator.max_age = 0
+    worker.coordinator.shared = None
+    worker.coordinator.bucket.rate = worker.coordinator.bucket.burst = 1e9
+
+    def poll(name):
+        worker.current_platform = name
+        worker.get_data()
+        # get_data doesn't wait for the request
+        future = worker.coordinator.in_flight.get(name)
+        if future is not None:
+            future.result()
+    return poll, worker.fetcher
+
+
+def run_polls(poll, fetcher, polls, conditional):
+    latencies = []
+    errors = 0
+    start = time.perf_counter()
+    for i in range(polls):
+        name = ("PC", "PS4", "XB1")[i % 3]
+        if not conditional:
+            fetcher.forget(name)
+        begin = time.perf_counter()
+        try:
+            poll(name)
+        except Exception:
+            errors += 1
+        latencies.append(time.perf_counter() - begin)
+    elapsed = time.perf_counter() - start
+    return {"polls": polls,
+            "errors": errors,
+            "polls_per_second": round(polls / elapsed, 2),
+            "latency_ms": percentiles(latencies)}
+
+
+def parse_cost(body, repeat):
+    '''
+    Streaming extraction of the anomaly and of all the sections against the
+    full json parse on the same body
+    '''
+    chunks = [body[i:i + 16384] for i in range(0, len(body), 16384)]
+    every_key = keys(SECTIONS)
+    results = {}
+    for name, function in (("extract_tmp", lambda: extract_tmp(iter(chunks))),
+                           ("extract_sections", lambda: extract(iter(chunks), every_key)),
+                           ("json_loads", lambda: json.loads(body)["Tmp"])):
+        times = []
+        for _ in range(repeat):
+            begin = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - begin)
+        tracemalloc.start()
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[name] = {"latency_ms": percentiles(times), "peak_kib": round(peak / 1024, 1)}
+    return results
+
+
+def memory_per_poll(poll, fetcher, polls):
+    tracemalloc.start()
+    poll("PC")
+    base, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    for _ in range(polls):
+        fetcher.forget("PC")
+        poll("PC")
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"peak_kib": round((peak - base) / 1024, 1),
+            "retained_kib_per_poll": round((current - base) / 1024 / polls, 3)}
+
+
+def version():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"],
+                              cwd=Path(__file__).resolve().parent,
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              check=True).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="World state fetch benchmarks")
+    parser.add_argument("--polls", type=int, default=100)
+    parser.add_argument("--size", type=int, default=300000, help="payload size in bytes")
+    parser.add_argument("--delay", type=float, default=0.0,
+                        help="response delay of the stand-in in seconds")
+    parser.add_argument("--url", help="use a running stand-in instead of starting one")
+    parser.add_argument("--worker", action="store_true", help="poll through Worker.get_data")
+    parser.add_argument("--encoding", action="append", default=[],
+                        choices=("zstd", "br", "gzip", "deflate"),
+                        help="compressed responses from the stand-in")
+    args = parser.parse_args()
+
+    scenario = standin.Scenario(size=args.size, delay=args.delay, encodings=args.encoding)
+    if args.url:
+        url = args.url
+    else:
+        server, url = standin.start(scenario)
+
+    poll, fetcher = make_poll(url, args.worker)
+    body, _, _ = scenario.body("PC")
+
+    report = {"version": version(),
+              "python": platform.python_version(),
+              "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "payload_bytes": len(body),
+              "path": "Worker.get_data" if args.worker else "Fetcher.fetch",
+              "full": run_polls(poll, fetcher, args.polls, conditional=False),
+              "conditional": run_polls(poll, fetcher, args.polls, conditional=True),
+              "parse": parse_cost(body, max(10, args.polls // 10)),
+              "memory": memory_per_poll(poll, fetcher, max(10, args.polls // 10)),
+              "fetcher_stats": dict(fetcher.stats),
+              "bandwidth": dict(fetcher.bandwidth)}
+    print(json.dumps(report, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+'''
+Soak test of the GUI for memory growth. Runs the MainWindow and its worker
+through many polls back to back against the stand-in (in the process by
+default), samples the RSS, the Python heap and the object counts and fails
+when they grow more than the budget after the warm up. Every poll is a
+minute of the stand-in's spawn cycle, 200000 polls are four months of
+spawns and de-spawns.
+
+    python benchmarks/soak.py --polls 200000 --offscreen --csv soak.csv --plot soak.png
+
+Uses a temporary config directory. Prints a JSON report, exits with 1 if a
+budget was exceeded. --plot needs matplotlib.
+'''
+import argparse
+import gc
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import standin  # noqa: E402
+
+
+def rss_kib():
+    '''
+    Current resident set size, the peak where /proc isn't available
+    '''
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Bytes on macOS, KiB elsewhere
+        return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def object_types():
+    return Counter(type(item).__name__ for item in gc.get_objects())
+
+
+class Soak:
+    def __init__(self, window, polls, every, traced):
+        self.window = window
+        self.polls = polls
+        self.every = every
+        self.traced = traced
+        self.done = 0
+        # Requests of the current poll, None before the start
+        self.pending = None
+        self.errors = 0
+        # Changed results the window got
+        self.changes = 0
+        self.samples = []
+        self.started = time.perf_counter()
+
+    def sample(self):
+        gc.collect()
+        row = {"poll": self.done,
+               "seconds": round(time.perf_counter() - self.started, 2),
+               "rss_kib": rss_kib(),
+               "blocks": sys.getallocatedblocks(),
+               "objects": len(gc.get_objects())}
+        if self.traced:
+            row["traced_kib"] = tracemalloc.get_traced_memory()[0] // 1024
+        self.samples.append(row)
+
+    def poll(self):
+        self.pending = len(self.window.worker.platforms())
+        self.window.get_data_signal.emit()
+
+    def changed(self, platform, snapshot, received):
+        self.changes += 1
+
+    def fetched(self, platform, future, received):
+        # Called in the window's thread for every finished request
+        if self.pending is None:
+            return
+        if not future.cancelled() and future.exception() is not None:
+            self.errors += 1
+        self.done += 1
+        self.pending -= 1
+        if self.done % self.every == 0:
+            self.sample()
+        if self.pending > 0:
+            return
+        if self.done >= self.polls:
+            self.window.quit_save()
+        else:
+            self.poll()
+
+
+def growth(samples, warmup, name):
+    '''
+    Growth of a measurement from the end of the warm up to the end
+    '''
+    after = [row[name] for row in samples if row["poll"] >= warmup]
+    return after[-1] - after[0] if len(after) > 1 else 0
+
+
+def plot(samples, path):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    names = [name for name in samples[0] if name not in ("poll", "seconds")]
+    figure, axes = plt.subplots(len(names), 1, sharex=True, figsize=(8, 2.2 * len(names)))
+    polls = [row["poll"] for row in samples]
+    for axis, name in zip(axes, names):
+        axis.plot(polls, [row[name] for row in samples])
+        axis.set_ylabel(name)
+    axes[-1].set_xlabel("poll")
+    figure.tight_layout()
+    figure.savefig(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory soak test of the GUI")
+    parser.add_argument("--polls", type=int, default=200000)
+    parser.add_argument("--samples", type=int, default=100, help="measurements during the run")
+    parser.add_argument("--warmup", type=float, default=0.1,
+                        help="part of the polls before the growth is measured (default: 0.1)")
+    parser.add_argument("--size", type=int, default=50000, help="payload size in bytes")
+    parser.add_argument("--off", type=int, default=180,
+                        help="polls without an anomaly (default: 180)")
+    parser.add_argument("--on", type=int, default=30, help="polls with an anomaly (default: 30)")
+    parser.add_argument("--all-platforms", action="store_true")
+    parser.add_argument("--section", action="append", default=[],
+                        choices=("fissures", "alerts"), help="also track these sections")
+    parser.add_argument("--http", action="store_true",
+                        help="use the stand-in server instead of serving in the process")
+    parser.add_argument("--tracemalloc", action="store_true",
+                        help="also sample the traced Python memory (much slower)")
+    parser.add_argument("--rss-budget", type=float, default=16, metavar="MIB",
+                        help="allowed RSS growth after the warm up (default: 16)")
+    parser.add_argument("--blocks-budget", type=int, default=20000,
+                        help="allowed growth of the allocated Python blocks (default: 20000)")
+    parser.add_argument("--objects-budget", type=int, default=5000,
+                        help="allowed growth of the objects tracked by the gc (default: 5000)")
+    parser.add_argument("--csv", help="write the measurements to this file")
+    parser.add_argument("--plot", help="chart the measurements in this image (needs matplotlib)")
+    parser.add_argument("--offscreen", action="store_true",
+                        help="use the offscreen Qt platform (no display needed)")
+    args = parser.parse_args()
+
+    if args.offscreen:
+        os.environ["QT_QPA_PLATFORM"] = "offscreen"
+    # The history, caches and settings go to a temporary config directory
+    home = tempfile.TemporaryDirectory(prefix="sentient-soak-")
+    os.environ["HOME"] = home.name
+    os.makedirs(os.path.join(home.name, ".config", "sentient-tracker"))
+    settings = {"sounds": True, "messages": True, "all_platforms": args.all_platforms,
+                "sections": args.section, "cache_seconds": 0, "requests_per_minute": 1e9,
+                "burst": 1000000, "shared_cache_seconds": 0}
+    with open(os.path.join(home.name, ".config", "sentient-tracker", "settings.json"), "w") as f:
+        json.dump(settings, f)
+
+    from PyQt5.QtCore import QTimer
+    from PyQt5.QtWidgets import QApplication
+    import wf_sentient_tracker.main as tracker_main
+
+    scenario = standin.Scenario(size=args.size, off=args.off, on=args.on)
+    if args.http:
+        server, tracker_main.Fetcher.base_url = standin.start(scenario)
+
+    app = QApplication(sys.argv[:1])
+    window = tracker_main.MainWindow()
+    if not args.http:
+        window.worker.fetcher.session.mount(standin.IN_PROCESS_URL.split("/content")[0],
+                                            standin.Adapter(scenario))
+        window.worker.fetcher.base_url = standin.IN_PROCESS_URL
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    soak = Soak(window, args.polls, max(1, args.polls // args.samples), args.tracemalloc)
+    window.worker.fetched.connect(soak.fetched)
+    window.worker.result.connect(soak.changed)
+    types = {}
+
+    def start():
+        soak.sample()
+        types["start"] = object_types()
+        soak.poll()
+
+    # After the settings are loaded and the first check is done
+    QTimer.singleShot(1000, start)
+    app.exec_()
+    soak.sample()
+    types["end"] = object_types()
+
+    warmup = int(args.polls * args.warmup)
+    growths = {"rss_kib": growth(soak.samples, warmup, "rss_kib"),
+               "blocks": growth(soak.samples, warmup, "blocks"),
+               "objects": growth(soak.samples, warmup, "objects")}
+    budgets = {"rss_kib": args.rss_budget * 1024,
+               "blocks": args.blocks_budget,
+               "objects": args.objects_budget}
+    failures = [f"{name} grew by {growths[name]} (budget {budgets[name]:g})"
+                for name in growths if growths[name] > budgets[name]]
+    seconds = time.perf_counter() - soak.started
+    types["end"].subtract(types["start"])
+    report = {"polls": soak.done,
+              "errors": soak.errors,
+              "seconds": round(seconds, 1),
+              "polls_per_second": round(soak.done / seconds, 1),
+              "changes": soak.changes,
+              "start": soak.samples[0],
+              "end": soak.samples[-1],
+              "growth_after_warmup": growths,
+              "object_types_growth": dict(types["end"].most_common(15)),
+              "failures": failures}
+    print(json.dumps(report, indent=4))
+
+    if args.csv:
+        with open(args.csv, "w") as f:
+            names = list(soak.samples[0])
+            f.write(",".join(names) + "\n")
+            for row in soak.samples:
+                f.write(",".join(str(row.get(name, "")) for name in names) + "\n")
+    if args.plot:
+        plot(soak.samples, args.plot)
+    home.cleanup()
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+'''
+Local stand-in for the world state server. Serves synthetic or recorded
+world states on the same paths as content.warframe.com, so the tracker can
+be pointed at it with
+
+    SENTIENT_TRACKER_URL=http://127.0.0.1:8080/content{}/dynamic/worldState.php
+
+/content/... is PC, /content.ps4/... PS4 and /content.xb1/... XB1.
+
+The anomaly follows a spawn cycle measured in requests or seconds and the
+responses can be made slow, fail, be padded to any size or be compressed
+for clients that accept it. Adapter serves it in the process, without a
+socket.
+'''
+import argparse
+import gzip
+import hashlib
+import io
+import json
+import random
+import threading
+import time
+import zlib
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from requests.adapters import HTTPAdapter
+from urllib3.response import HTTPResponse
+
+
+PLATFORMS = {"/content/dynamic/worldState.php": "PC",
+             "/content.ps4/dynamic/worldState.php": "PS4",
+             "/content.xb1/dynamic/worldState.php": "XB1"}
+IN_PROCESS_URL = "http://standin/content{}/dynamic/worldState.php"
+NODES = (505, 510, 550, 551, 552, 553, 554, 555)
+
+
+def compress(body, encoding):
+    if encoding == "gzip":
+        return gzip.compress(body, 6)
+    elif encoding == "deflate":
+        return zlib.compress(body, 6)
+    elif encoding == "br":
+        import brotli
+        return brotli.compress(body, quality=5)
+    elif encoding == "zstd":
+        import zstandard
+        return zstandard.ZstdCompressor(level=3).compress(body)
+    raise ValueError(encoding)
+
+
+def filler(size):
+    '''
+    Alerts/fissures/invasions like sections to pad the payload to about
+    size bytes
+    '''
+    sections = {}
+    names = ("Events", "Alerts", "Sorties", "SyndicateMissions", "ActiveMissions",
+             "Invasions", "VoidTraders", "PrimeVaultTraders", "FlashSales", "VoidStorms")
+    count = max(1, size // 250)
+    for i, name in enumerate(names):
+        sections[name] = [{"_id": {"$oid": f"{i:04x}{n:020x}"},
+                           "Activation": {"$date": {"$numberLong": "1577836800000"}},
+                           "Expiry": {"$date": {"$numberLong": "1577840400000"}},
+                           "Node": f"SolNode{n % 200}",
+                           "MissionType": "MT_EXTERMINATION",
+                           "Modifier": f"VoidT{n % 4 + 1}",
+                           "Desc": "Lorem ipsum dolor sit amet"}
+                          for n in range(count // len(names) + 1)]
+    return sections
+
+
+class Scenario:
+    '''
+    What the stand-in serves. The anomaly is absent for `off` ticks, then
+    present for `on` ticks at a random node. A tick is a request per platform
+    or `tick` seconds if set.
+    '''
+
+    def __init__(self, size=300000, off=6, on=2, tick=None, delay=0.0,
+                 slow=0.0, slow_delay=5.0, errors=0.0, etag=True, recorded=None, seed=0,
+                 encodings=()):
+        self.off = off
+        self.on = on
+        self.tick = tick
+        self.delay = delay
+        self.slow = slow
+        self.slow_delay = slow_delay
+        self.errors = errors
+        self.etag = etag
+        # Offered in this order if the client accepts them
+        self.encodings = encodings
+        self.compressed = {}
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.requests = {platform: 0 for platform in PLATFORMS.values()}
+        self.nodes = {}
+        self.filler = filler(size)
+        self.recorded = [path.read_bytes() for path in sorted(Path(recorded).glob("*.json"))] \
+            if recorded else None
+
+    def next_tick(self, platform):
+        with self.lock:
+            count = self.requests[platform]
+            self.requests[platform] += 1
+            if self.tick:
+                return int((time.monotonic() - self.started) / self.tick)
+            return count
+
+    def tmp(self, platform, tick):
+        cycle, position = divmod(tick, self.off + self.on)
+        if position < self.off:
+            return "[]"
+        key = (platform, cycle)
+        if key not in self.nodes:
+            self.nodes[key] = self.random.choice(NODES)
+        return json.dumps({"sfn": self.nodes[key]})
+
+    def body(self, platform):
+        '''
+        Returns the body, the ETag and whether the response should fail
+        '''
+        tick = self.next_tick(platform)
+        if self.recorded:
+            body = self.recorded[tick % len(self.recorded)]
+        else:
+            # The filler is the same every time and Time only changes with
+            # the anomaly so unchanged ticks can get a 304
+            cycle, position = divmod(tick, self.off + self.on)
+            state = {"WorldSeed": "standin", "Version": 10, "BuildLabel": "standin",
+                     "Time": cycle * 2 + (position >= self.off)}
+            state.update(self.filler)
+            state["Tmp"] = self.tmp(platform, tick)
+            state["Conquests"] = []
+            body = json.dumps(state, separators=(",", ":")).encode()
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        return body, etag, self.random.random() < self.errors
+
+    def encode(self, body, etag, accepted):
+        '''
+        Returns the body, ETag and Content-Encoding for a client accepting
+        the encodings
+        '''
+        for encoding in self.encodings:
+            if encoding in accepted:
+                key = (etag, encoding)
+                with self.lock:
+                    if key not in self.compressed:
+                        # Only the latest bodies are kept
+                        if len(self.compressed) > 16:
+                            self.compressed.clear()
+                        self.compressed[key] = compress(body, encoding)
+                    return self.compressed[key], f'{etag[:-1]}-{encoding}"', encoding
+        return body, etag, None
+
+    def respond(self, platform, headers):
+        '''
+        Returns the status, headers and body of the response to a request
+        with headers, after the delay
+        '''
+        delay = self.delay
+        if self.slow and self.random.random() < self.slow:
+            delay += self.slow_delay
+        if delay:
+            time.sleep(delay)
+
+        body, etag, error = self.body(platform)
+        if error:
+            return 500, {}, b""
+        accepted = {value.split(";")[0].strip()
+                    for value in headers.get("Accept-Encoding", "").split(",")}
+        body, etag, encoding = self.encode(body, etag, accepted)
+        if self.etag and headers.get("If-None-Match") == etag:
+            return 304, {"ETag": etag}, b""
+
+        response = {"Content-Type": "application/json",
+                    "Content-Length": str(len(body)),
+                    "Last-Modified": formatdate(usegmt=True),
+                    "Vary": "Accept-Encoding"}
+        if encoding:
+            response["Content-Encoding"] = encoding
+        if self.etag:
+            response["ETag"] = etag
+        return 200, response, body
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        platform = PLATFORMS.get(self.path.split("?")[0])
+        if platform is None:
+            self.send_error(404)
+            return
+        status, headers, body = self.server.scenario.respond(platform, self.headers)
+        if status >= 400:
+            self.send_error(status)
+            return
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def start(scenario=None, host="127.0.0.1", port=0, verbose=False):
+    '''
+    Starts the stand-in in a daemon thread. Returns the server and the URL
+    template for SENTIENT_TRACKER_URL/Fetcher.base_url.
+    '''
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.scenario = scenario or Scenario()
+    server.verbose = verbose
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}/content{{}}/dynamic/worldState.php"
+
+
+class Adapter(HTTPAdapter):
+    '''
+    Serves the scenario in the process without a socket, for runs where the
+    server would be the bottleneck. Mount it on the Fetcher's session:
+
+        fetcher.session.mount(IN_PROCESS_URL.split("/content")[0], Adapter(scenario))
+        fetcher.base_url = IN_PROCESS_URL
+    '''
+
+    def __init__(self, scenario):
+        super().__init__()
+        self.scenario = scenario
+
+    def send(self, request, **kwargs):
+        platform = PLATFORMS.get(urlsplit(request.url).path)
+        if platform is None:
+            status, headers, body = 404, {}, b""
+        else:
+            status, headers, body = self.scenario.respond(platform, request.headers)
+        raw = HTTPResponse(body=io.BytesIO(body), headers=headers, status=status,
+                           preload_content=False, decode_content=False,
+                           request_method=request.method)
+        return self.build_response(request, raw)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local world state stand-in server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--size", type=int, default=300000, help="payload size in bytes")
+    parser.add_argument("--off", type=int, default=6, help="ticks without an anomaly")
+    parser.add_argument("--on", type=int, default=2, help="ticks with an anomaly")
+    parser.add_argument("--tick", type=float, help="seconds per tick instead of requests")
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--slow", type=float, default=0.0,
+                        help="chance of a response being slow")
+    parser.add_argument("--slow-delay", type=float, default=5.0)
+    parser.add_argument("--errors", type=float, default=0.0, help="chance of a 500 response")
+    parser.add_argument("--no-etag", action="store_true")
+    parser.add_argument("--encoding", action="append", default=[],
+                        choices=("zstd", "br", "gzip", "deflate"),
+                        help="compress responses for clients accepting it, can be used "
+                             "multiple times, the first accepted one is used")
+    parser.add_argument("--recorded", help="directory of *.json world states to replay in order")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    scenario = Scenario(size=args.size, off=args.off, on=args.on, tick=args.tick,
+                        delay=args.delay, slow=args.slow, slow_delay=args.slow_delay,
+                        errors=args.errors, etag=not args.no_etag, recorded=args.recorded,
+                        encodings=args.encoding)
+    server, url = start(scenario, args.host, args.port, args.verbose)
+    print(f"SENTIENT_TRACKER_URL={url}", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
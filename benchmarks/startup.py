@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+'''
+Measures the start up of the GUI: the import time of the main module, the
+time until the window is shown and the time until the first status from the
+worker. Every run is a new process so imports are cold (for Python at least).
+
+    python benchmarks/startup.py --runs 5 --offscreen
+
+Prints a JSON object with the median/min/max of every measurement in ms.
+Every run gets a new temporary config directory, the real settings, history
+and caches aren't touched.
+'''
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def child(url, timeout):
+    start = time.perf_counter()
+    import wf_sentient_tracker.main as tracker_main
+    imported = time.perf_counter()
+
+    from PyQt5.QtWidgets import QApplication
+    from PyQt5.QtCore import QTimer
+
+    if url:
+        tracker_main.Fetcher.base_url = url
+    times = {"import": imported - start}
+
+    app = QApplication(sys.argv[:1])
+    window = tracker_main.MainWindow()
+    window.show()
+
+    def shown():
+        times["window"] = time.perf_counter() - start
+
+    def status(*args):
+        if "status" not in times:
+            times["status"] = time.perf_counter() - start
+            window.quit_save()
+
+    # A failed or rate limited first check is a status too
+    window.worker.result.connect(status)
+    window.worker.retrying.connect(status)
+    QTimer.singleShot(0, shown)
+    QTimer.singleShot(int(timeout * 1000), window.quit_save)
+    app.exec_()
+    window.worker_thread.wait(1000)
+    print(json.dumps({name: value * 1000 for name, value in times.items()}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--url", help="world state URL template, for the stand-in server")
+    parser.add_argument("--timeout", type=float, default=15,
+                        help="seconds to wait for the first status")
+    parser.add_argument("--offscreen", action="store_true",
+                        help="use the offscreen Qt platform (no display needed)")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.url, args.timeout)
+        return
+
+    env = dict(os.environ)
+    if args.offscreen:
+        env["QT_QPA_PLATFORM"] = "offscreen"
+    command = [sys.executable, __file__, "--child", "--timeout", str(args.timeout)]
+    if args.url:
+        command += ["--url", args.url]
+
+    # The first status comes from a check, not from the shared cache
+    settings = {"cache_seconds": 0, "shared_cache_seconds": 0}
+    runs = []
+    for _ in range(args.runs):
+        with tempfile.TemporaryDirectory(prefix="sentient-startup-") as home:
+            env["HOME"] = home
+            os.makedirs(os.path.join(home, ".config", "sentient-tracker"))
+            with open(os.path.join(home, ".config", "sentient-tracker", "settings.json"),
+                      "w") as f:
+                json.dump(settings, f)
+            output = subprocess.run(command, env=env, stdout=subprocess.PIPE, check=True)
+        runs.append(json.loads(output.stdout.decode().strip().splitlines()[-1]))
+
+    report = {"runs": len(runs)}
+    for name in ("import", "window", "status"):
+        values = [run[name] for run in runs if name in run]
+        if values:
+            report[name] = {"median": round(statistics.median(values), 2),
+                            "min": round(min(values), 2),
+                            "max": round(max(values), 2)}
+    print(json.dumps(report, indent=4))
+
+
+if __name__ == "__main__":
+    main()
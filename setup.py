@@ -21,16 +21,21 @@ setuptools.setup(
     long_description_content_type="text/markdown",
     packages=setuptools.find_packages(),
     install_requires=required,
+    extras_require={"predict": ["numpy"],
+                    "compression": ["brotli", "zstandard"]},
     package_data={"wf_sentient_tracker": ["resources/*"]},
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: GNU General Public License v3 (GPLv3)",
         "Environment :: X11 Applications :: Qt"
     ],
-    python_requires=">=3",
+    python_requires=">=3.9",
     entry_points={
         "gui_scripts": [
             "sentient-tracker=wf_sentient_tracker.main:main"
+        ],
+        "console_scripts": [
+            "sentient-tracker-headless=wf_sentient_tracker.headless:main"
         ]
     }
 )
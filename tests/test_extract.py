@@ -0,0 +1,70 @@
+'''
+extract() against json.loads on generated world states cut into random
+chunks
+
+    python -m unittest discover tests
+'''
+import json
+import random
+import unittest
+from wf_sentient_tracker.worldstate import extract
+
+KEYS = ("Tmp", "Alerts", "ActiveMissions", "VoidStorms")
+
+
+def value(rng, depth=0):
+    roll = rng.random()
+    if depth > 3 or roll < 0.3:
+        # Strings that look like JSON or like the keys
+        return rng.choice([1, -2.5e3, True, None, "s", 'a"{[b', "ü€😀", "\\", "Tmp", '"Tmp":'])
+    if roll < 0.6:
+        return [value(rng, depth + 1) for _ in range(rng.randint(0, 4))]
+    return {rng.choice(KEYS + ("x",)): value(rng, depth + 1) for _ in range(rng.randint(0, 4))}
+
+
+class ExtractTest(unittest.TestCase):
+    def test_generated(self):
+        rng = random.Random(0)
+        for sequence in range(5000):
+            document = {rng.choice(KEYS + ("x", "Goals")): value(rng, 1)
+                        for _ in range(rng.randint(0, 6))}
+            text = json.dumps(document, ensure_ascii=rng.random() < 0.5,
+                              indent=rng.choice([None, 1])).encode()
+            cuts = sorted(rng.sample(range(len(text) + 1), min(len(text) + 1, rng.randint(0, 8))))
+            chunks = [text[start:end] for start, end in zip([0] + cuts, cuts + [len(text)])]
+            keys = tuple(rng.sample(KEYS, rng.randint(1, len(KEYS))))
+            with self.subTest(sequence=sequence):
+                self.assertEqual(extract(iter(chunks), keys),
+                                 {key: document[key] for key in keys if key in document})
+
+    def test_nested(self):
+        self.assertEqual(extract([b'{"Goals":[{"Tmp":"x"}]}']), {})
+        self.assertEqual(extract([b'{"Goals":[{"Tmp":"x"}],', b'"Tmp":"y"}']), {"Tmp": "y"})
+
+    def test_reordered(self):
+        self.assertEqual(extract([b'{"Tmp":"y","Goals":[{"Tmp":"x"}]}']), {"Tmp": "y"})
+        self.assertEqual(extract([b'{"Tmp":"y",', b'"Alerts":[{"Tmp":"x"}]}'], ("Alerts", "Tmp")),
+                         {"Tmp": "y", "Alerts": [{"Tmp": "x"}]})
+        # The rest isn't read once the values are complete
+        chunks = iter([b'{"Tmp":"y",', b'"Goals":[]}'])
+        extract(chunks)
+        self.assertEqual(list(chunks), [b'"Goals":[]}'])
+
+    def test_full_parse(self):
+        # A byte order mark isn't known to the scan
+        self.assertEqual(extract([b'\xef\xbb\xbf{"Goals":[{"Tmp":"x"}],', b'"Tmp":"y"}']),
+                         {"Tmp": "y"})
+        self.assertEqual(extract([b'{"Goals":[],', b'"Alerts":[]}'], ("Tmp", "Alerts")),
+                         {"Alerts": []})
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            extract([b'{"Tmp":"[', b"]"])
+        with self.assertRaises(ValueError):
+            extract([b"<html>"])
+        with self.assertRaises(ValueError):
+            extract([b'[{"Tmp":"x"}]'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+'''
+replay() has its own copy of the Tracker.update rules, this checks that
+both give the same events for generated checks
+
+    python -m unittest discover tests
+'''
+import random
+import unittest
+from datetime import datetime
+from wf_sentient_tracker import replay
+from wf_sentient_tracker.tracker import NODES, Tracker
+
+
+def generate(rng, count):
+    '''
+    Check times (whole seconds so the durations are exact) and node codes,
+    in runs like the real world state with some failed checks
+    '''
+    times = []
+    nodes = []
+    now = 1600000000
+    node = replay.NONE
+    for _ in range(count):
+        now += rng.randint(1, 120)
+        roll = rng.random()
+        if roll < 0.1:
+            code = replay.ERROR
+        else:
+            if roll < 0.3:
+                # The anomaly changes, sometimes moving to another node
+                node = rng.choice([replay.NONE] + list(NODES))
+            code = node
+        times.append(now)
+        nodes.append(code)
+    return times, nodes
+
+
+def tracker_events(times, nodes):
+    tracker = Tracker(["PC"])
+    events = []
+    for when, code in zip(times, nodes):
+        if code == replay.ERROR:
+            tracker.reset("PC")
+            continue
+        event = tracker.update("PC", None if code == replay.NONE else code,
+                               datetime.fromtimestamp(when))
+        if event is not None:
+            events.append(event)
+    return events
+
+
+@unittest.skipUnless(replay.available(), "needs numpy")
+class ReplayTest(unittest.TestCase):
+    def check(self, times, nodes):
+        expected = tracker_events(times, nodes)
+        got = list(replay.to_events("PC", replay.replay(times, nodes)))
+        self.assertEqual(got, expected)
+
+    def test_generated(self):
+        rng = random.Random(0)
+        for sequence in range(3000):
+            with self.subTest(sequence=sequence):
+                self.check(*generate(rng, rng.randint(0, 60)))
+
+    def test_edges(self):
+        NONE, ERROR = replay.NONE, replay.ERROR
+        for nodes in ([],
+                      [ERROR],
+                      [ERROR, ERROR, NONE],
+                      [505],
+                      [NONE, 505, 510, NONE],
+                      [505, ERROR, NONE, 505, NONE],
+                      [NONE, 505, ERROR, 505, NONE],
+                      [NONE, ERROR, NONE, 505, ERROR, ERROR, NONE]):
+            with self.subTest(nodes=nodes):
+                self.check(list(range(1600000000, 1600000000 + 60 * len(nodes), 60)), nodes)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+'''
+Archive of the raw world state responses for debugging missed spawns and
+for replays. Consecutive world states are nearly identical so every
+response is cut into content-defined chunks (boundaries depend only on the
+bytes around them, an edit doesn't shift the following chunks) and every
+chunk is stored once, compressed, by its hash. A response is the list of
+its chunk hashes, a check is a (platform, time, response) row. Unchanged
+responses only cost that row.
+
+Old checks are removed after `days`, checks older than a day are thinned
+to the ones where the response changed and the oldest checks are removed
+while the archive is bigger than `max_bytes`.
+
+    python -m wf_sentient_tracker.archive --stats
+    python -m wf_sentient_tracker.archive -p XB1 --at "2026-10-17 14:32" > worldstate.json
+    python -m wf_sentient_tracker.archive -p PC --start "2026-10-17" --snapshots checks.jsonl
+'''
+import argparse
+import hashlib
+import json
+import re
+import sqlite3
+import sys
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+from .dbwriter import Writer, connect
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS chunks (
+    hash BLOB PRIMARY KEY,
+    data BLOB NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS payloads (
+    hash BLOB PRIMARY KEY,
+    chunks BLOB NOT NULL,
+    size INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS checks (
+    id INTEGER PRIMARY KEY,
+    platform TEXT NOT NULL,
+    time REAL NOT NULL,
+    payload BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS checks_time ON checks (platform, time);
+CREATE INDEX IF NOT EXISTS checks_payload ON checks (payload);
+'''
+
+HASH_SIZE = 16
+# Chunks end after an item of a list when the hash of the item matches,
+# about every CHUNK_ITEMS items
+BOUNDARY = re.compile(rb'\},\{|\],"')
+CHUNK_ITEMS = 16
+MAX_CHUNK = 65536
+# Checks older than this are only kept if the response changed
+THIN_AFTER = 86400
+# Compaction runs after this many seconds of writes
+COMPACT_EVERY = 3600
+
+
+def digest(data):
+    return hashlib.blake2b(data, digest_size=HASH_SIZE).digest()
+
+
+def split(body):
+    '''
+    Cuts the body into content-defined chunks
+    '''
+    chunks = []
+    start = 0
+    item = 0
+    for match in BOUNDARY.finditer(body):
+        end = match.start() + 1
+        if zlib.crc32(body[item:end]) % CHUNK_ITEMS == 0 or end - start > MAX_CHUNK:
+            chunks.append(body[start:end])
+            start = end
+        item = end
+    chunks.append(body[start:])
+    return chunks
+
+
+def timestamp(text):
+    '''
+    Seconds since the epoch of a "YYYY-MM-DD[ HH:MM[:SS]]" local time
+    '''
+    return datetime.fromisoformat(text).timestamp()
+
+
+class Archive:
+    '''
+    SQLite archive of the responses. put() only queues them, a background
+    thread chunks, compresses and writes them. Reads can be done from any
+    thread.
+    '''
+
+    def __init__(self, path, days=7, max_bytes=None, maintain=True):
+        self.path = str(path)
+        self.days = days
+        self.max_bytes = max_bytes
+        # Hash of the last response of every platform, for 304 responses
+        self.last = {}
+        # The first write applies the retention
+        self.compacted = -COMPACT_EVERY
+        conn = sqlite3.connect(self.path, timeout=10)
+        # Space of deleted chunks is given back by compact(), only works if
+        # it's set before the tables are created
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.executescript(SCHEMA)
+        conn.close()
+        # Readers like the command line only compact when asked to
+        self.writer = Writer(self.path, self.write_all, "archive",
+                             self.maintain if maintain else None)
+
+    def connect(self):
+        return connect(self.path)
+
+    def put(self, platform, body, when=None):
+        '''
+        Queues a response to be archived, body None is the same response as
+        the last one (304 Not Modified)
+        '''
+        self.writer.put((platform, when or time.time(), body))
+
+    def close(self, timeout=2):
+        self.writer.close(timeout)
+
+    def write_all(self, conn, items):
+        for platform, when, body in items:
+            self.write(conn, platform, when, body)
+
+    def maintain(self, conn):
+        if time.monotonic() - self.compacted > COMPACT_EVERY:
+            self.compact(conn)
+
+    def write(self, conn, platform, when, body):
+        if body is None:
+            payload = self.last.get(platform)
+            if payload is None:
+                payload = self.last[platform] = self.latest(conn, platform)
+            if payload is None:
+                return
+        else:
+            payload = digest(body)
+            if conn.execute("SELECT 1 FROM payloads WHERE hash = ?", (payload,)).fetchone() is None:
+                hashes = []
+                for chunk in split(body):
+                    key = digest(chunk)
+                    hashes.append(key)
+                    # Most chunks are already there, only new ones are compressed
+                    if conn.execute("SELECT 1 FROM chunks WHERE hash = ?", (key,)).fetchone():
+                        continue
+                    conn.execute("INSERT OR IGNORE INTO chunks (hash, data) VALUES (?, ?)",
+                                 (key, zlib.compress(chunk, 6)))
+                conn.execute("INSERT INTO payloads (hash, chunks, size) VALUES (?, ?, ?)",
+                             (payload, b"".join(hashes), len(body)))
+            self.last[platform] = payload
+        conn.execute("INSERT INTO checks (platform, time, payload) VALUES (?, ?, ?)",
+                     (platform, when, payload))
+
+    def latest(self, conn, platform):
+        row = conn.execute("SELECT payload FROM checks WHERE platform = ? "
+                           "ORDER BY time DESC LIMIT 1", (platform,)).fetchone()
+        return row and row[0]
+
+    def compact(self, conn=None):
+        '''
+        Applies the retention, thins the old checks, drops the responses and
+        chunks nothing refers to anymore and gives the space back. Returns
+        the size afterwards.
+        '''
+        own = conn is None
+        conn = conn or self.connect()
+        now = time.time()
+        try:
+            with conn:
+                if self.days:
+                    conn.execute("DELETE FROM checks WHERE time < ?", (now - self.days * 86400,))
+                conn.execute('''
+                    DELETE FROM checks WHERE id IN (
+                        SELECT id FROM (
+                            SELECT id, time, payload,
+                                   LAG(payload) OVER (PARTITION BY platform ORDER BY time) AS previous
+                            FROM checks)
+                        WHERE time < ? AND payload = previous)''', (now - THIN_AFTER,))
+                self.collect(conn)
+            size = self.size(conn)
+            while self.max_bytes and size > self.max_bytes:
+                # Drops the oldest tenth of the checks until it fits
+                with conn:
+                    count = conn.execute("SELECT COUNT(*) FROM checks").fetchone()[0]
+                    if not count:
+                        break
+                    conn.execute("DELETE FROM checks WHERE id IN (SELECT id FROM checks "
+                                 "ORDER BY time LIMIT ?)", (max(1, count // 10),))
+                    self.collect(conn)
+                size = self.size(conn)
+            conn.execute("PRAGMA incremental_vacuum").fetchall()
+            self.compacted = time.monotonic()
+            return size
+        finally:
+            if own:
+                conn.close()
+
+    def collect(self, conn):
+        '''
+        Deletes the responses and chunks without checks
+        '''
+        conn.execute("DELETE FROM payloads WHERE hash NOT IN (SELECT payload FROM checks)")
+        used = set()
+        for (hashes,) in conn.execute("SELECT chunks FROM payloads"):
+            used.update(hashes[i:i + HASH_SIZE] for i in range(0, len(hashes), HASH_SIZE))
+        unused = [(key,) for (key,) in conn.execute("SELECT hash FROM chunks")
+                  if key not in used]
+        conn.executemany("DELETE FROM chunks WHERE hash = ?", unused)
+        self.last.clear()
+
+    def size(self, conn):
+        return conn.execute("SELECT COALESCE(SUM(LENGTH(data)), 0) FROM chunks").fetchone()[0]
+
+    def stats(self):
+        conn = self.connect()
+        try:
+            checks, payloads = conn.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT payload) FROM checks").fetchone()
+            raw = conn.execute("SELECT COALESCE(SUM(size), 0) FROM checks "
+                               "JOIN payloads ON payload = hash").fetchone()[0]
+            chunks = conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+            first, last = conn.execute("SELECT MIN(time), MAX(time) FROM checks").fetchone()
+            stored = self.size(conn)
+        finally:
+            conn.close()
+        return {"checks": checks,
+                "responses": payloads,
+                "chunks": chunks,
+                "raw_bytes": raw,
+                "stored_bytes": stored,
+                "ratio": round(raw / stored, 1) if stored else None,
+                "first": first and datetime.fromtimestamp(first).isoformat(timespec="seconds"),
+                "last": last and datetime.fromtimestamp(last).isoformat(timespec="seconds")}
+
+    def assemble(self, conn, payload, cache):
+        '''
+        The body of the response, cache keeps decompressed chunks since
+        consecutive responses share most of them
+        '''
+        hashes = conn.execute("SELECT chunks FROM payloads WHERE hash = ?",
+                              (payload,)).fetchone()[0]
+        parts = []
+        for i in range(0, len(hashes), HASH_SIZE):
+            key = hashes[i:i + HASH_SIZE]
+            chunk = cache.get(key)
+            if chunk is None:
+                data = conn.execute("SELECT data FROM chunks WHERE hash = ?", (key,)).fetchone()[0]
+                chunk = cache[key] = zlib.decompress(data)
+                if len(cache) > 1024:
+                    cache.popitem(last=False)
+            else:
+                cache.move_to_end(key)
+            parts.append(chunk)
+        return b"".join(parts)
+
+    def at(self, platform, when):
+        '''
+        (time, body) of the last check of the platform at or before when
+        (seconds since the epoch) or None
+        '''
+        conn = self.connect()
+        try:
+            row = conn.execute("SELECT time, payload FROM checks WHERE platform = ? AND time <= ? "
+                               "ORDER BY time DESC LIMIT 1", (platform, when)).fetchone()
+            if row is None:
+                return None
+            return row[0], self.assemble(conn, row[1], OrderedDict())
+        finally:
+            conn.close()
+
+    def checks(self, platform, start=None, end=None, changed=False, batch=256):
+        '''
+        Yields (time, body) of the checks of the platform from start to end,
+        reading batch checks at a time. changed skips checks with the same
+        response as the one before.
+        '''
+        conn = self.connect()
+        cache = OrderedDict()
+        after = -1
+        since = start if start is not None else float("-inf")
+        until = end if end is not None else float("inf")
+        previous = None
+        try:
+            while True:
+                rows = conn.execute("SELECT id, time, payload FROM checks WHERE platform = ? "
+                                    "AND time >= ? AND time < ? AND (time > ? OR id > ?) "
+                                    "ORDER BY time, id LIMIT ?",
+                                    (platform, since, until, since, after, batch)).fetchall()
+                if not rows:
+                    return
+                for _, when, payload in rows:
+                    if changed and payload == previous:
+                        continue
+                    previous = payload
+                    yield when, self.assemble(conn, payload, cache)
+                after, since, _ = rows[-1]
+        finally:
+            conn.close()
+
+
+def main(args=None):
+    from .config import base_path
+    from .tracker import PLATFORMS
+    parser = argparse.ArgumentParser(
+        prog="python -m wf_sentient_tracker.archive",
+        description="Read the archive of raw world state responses")
+    parser.add_argument("--archive", help="archive file (default: archive.sqlite3 in the config "
+                                          "directory)")
+    parser.add_argument("-p", "--platform", choices=PLATFORMS, default="PC")
+    parser.add_argument("--at", help="print the response of the check at this local time "
+                                     "(YYYY-MM-DD HH:MM)")
+    parser.add_argument("--start", help="first check to export (local time)")
+    parser.add_argument("--end", help="end of the checks to export (local time)")
+    parser.add_argument("--snapshots", help="export the checks from start to end as JSON lines "
+                                            "for python -m wf_sentient_tracker.replay")
+    parser.add_argument("--stats", action="store_true", help="print the size of the archive")
+    parser.add_argument("--compact", action="store_true", help="apply the retention now")
+    parser.add_argument("--days", type=float, default=7, help="retention for --compact")
+    args = parser.parse_args(args)
+
+    archive = Archive(args.archive or base_path() / "archive.sqlite3", args.days, maintain=False)
+    try:
+        if args.compact:
+            archive.compact()
+        if args.at:
+            found = archive.at(args.platform, timestamp(args.at))
+            if found is None:
+                parser.exit(1, "No check at that time\n")
+            when, body = found
+            print(f"Checked at {datetime.fromtimestamp(when)}", file=sys.stderr)
+            sys.stdout.buffer.write(body)
+        if args.snapshots:
+            from .worldstate import extract
+            start = args.start and timestamp(args.start)
+            end = args.end and timestamp(args.end)
+            with open(args.snapshots, "w") as f:
+                for when, body in archive.checks(args.platform, start, end):
+                    tmp = extract([body])["Tmp"]
+                    f.write(json.dumps({"time": when, "platform": args.platform,
+                                        "tmp": tmp}) + "\n")
+        if args.stats or args.compact:
+            print(json.dumps(archive.stats(), indent=4))
+    finally:
+        archive.close()
+
+
+if __name__ == "__main__":
+    main()
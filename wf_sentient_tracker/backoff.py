@@ -0,0 +1,138 @@
+'''
+Failure policy for the world state requests. A failing platform is retried
+after an exponentially growing delay with jitter, so many trackers hitting
+the same outage don't retry in lockstep. After `threshold` failures in a row
+the circuit opens and nothing is sent for the cooldown, then a single probe
+request decides whether it closes again.
+'''
+import random
+import threading
+import time
+from .metrics import metrics
+from .worldstate import FetchError
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class RetryLater(FetchError):
+    '''
+    The platform failed or is backed off, retry_in is the seconds until the
+    next request is allowed
+    '''
+
+    def __init__(self, platform, retry_in, circuit_open=False, error=None):
+        super().__init__(platform, retry_in, circuit_open, error)
+        self.platform = platform
+        self.retry_in = retry_in
+        self.circuit_open = circuit_open
+        self.error = error
+
+    def __str__(self):
+        reason = self.error or "backing off"
+        return f"{self.platform}: {reason}, retrying in {self.retry_in:.0f}s"
+
+
+class Circuit:
+    '''
+    Failure state of one platform
+    '''
+    __slots__ = ("state", "failures", "retry_at")
+
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.retry_at = 0.0
+
+
+class Breaker:
+    '''
+    Backoff and circuit breaker for every platform. allow() is asked before
+    a request, success()/failure() are told the outcome.
+    '''
+
+    def __init__(self, base=15, cap=600, threshold=4, cooldown=900, rng=None):
+        self.base = base
+        self.cap = cap
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.random = rng or random.Random()
+        self.lock = threading.Lock()
+        self.circuits = {}
+
+    def circuit(self, platform):
+        # Only called with the lock held
+        circuit = self.circuits.get(platform)
+        if circuit is None:
+            circuit = self.circuits[platform] = Circuit()
+        return circuit
+
+    def jitter(self, delay):
+        '''
+        Somewhere between half and all of the delay
+        '''
+        return self.random.uniform(delay / 2, delay)
+
+    def allow(self, platform, now=None):
+        '''
+        Returns 0 if a request can be sent now or the seconds to wait. An open
+        circuit lets a single probe through once the cooldown is over.
+        '''
+        now = now or time.monotonic()
+        with self.lock:
+            circuit = self.circuit(platform)
+            if now < circuit.retry_at:
+                return circuit.retry_at - now
+            if circuit.state == OPEN:
+                circuit.state = HALF_OPEN
+                # Others wait for the probe
+                circuit.retry_at = now + self.base
+                metrics.set("sentient_circuit_state", 0.5, platform=platform)
+            return 0
+
+    def retry_in(self, platform, now=None):
+        '''
+        Seconds until the platform can be requested again, 0 if it can now
+        '''
+        now = now or time.monotonic()
+        with self.lock:
+            circuit = self.circuits.get(platform)
+            if circuit is None:
+                return 0
+            return max(0, circuit.retry_at - now)
+
+    def is_open(self, platform):
+        with self.lock:
+            circuit = self.circuits.get(platform)
+            return circuit is not None and circuit.state != CLOSED
+
+    def success(self, platform):
+        with self.lock:
+            circuit = self.circuit(platform)
+            if circuit.state != CLOSED:
+                metrics.set("sentient_circuit_state", 0, platform=platform)
+            circuit.state = CLOSED
+            circuit.failures = 0
+            circuit.retry_at = 0.0
+
+    def failure(self, platform, now=None):
+        '''
+        Records a failed request, returns the seconds until the next try and
+        whether the circuit is open
+        '''
+        now = now or time.monotonic()
+        with self.lock:
+            circuit = self.circuit(platform)
+            circuit.failures += 1
+            if circuit.state == HALF_OPEN or circuit.failures >= self.threshold:
+                if circuit.state == CLOSED:
+                    metrics.inc("sentient_circuit_opened_total", platform=platform)
+                circuit.state = OPEN
+                delay = self.jitter(self.cooldown)
+                metrics.set("sentient_circuit_state", 1, platform=platform)
+            else:
+                delay = self.jitter(min(self.cap, self.base * 2 ** (circuit.failures - 1)))
+            circuit.retry_at = now + delay
+            return delay, circuit.state == OPEN
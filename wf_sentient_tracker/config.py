@@ -0,0 +1,49 @@
+import os
+import sys
+import threading
+from pathlib import Path
+
+
+def base_path():
+    '''
+    Returns the directory for the config/custom files and creates it if
+    needed. Uses ~/.config/sentient-tracker if ~/.config exists and
+    ~/.sentient-tracker otherwise.
+    '''
+    dot_conf_path = Path.home() / ".config"
+    if dot_conf_path.is_dir():
+        path = dot_conf_path / "sentient-tracker"
+    else:
+        path = Path.home() / ".sentient-tracker"
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def resources_path():
+    '''
+    Returns the directory with the default sounds and icons
+    '''
+    # _MEIPASS is the temp directory used by the .exe
+    if hasattr(sys, "_MEIPASS"):
+        return Path(sys._MEIPASS) / "resources"
+    return Path(__file__).resolve().parent / "resources"
+
+
+def atomic_write(path, data):
+    '''
+    Writes data (str or bytes) to a temporary file next to path and renames
+    it over path, so readers and crashes never see a partial file
+    '''
+    path = str(path)
+    # Unique per process and thread so concurrent writers don't share a temp file
+    temp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temp, "wb" if isinstance(data, bytes) else "w") as f:
+            f.write(data)
+        os.replace(temp, path)
+    except BaseException:
+        try:
+            os.remove(temp)
+        except OSError:
+            pass
+        raise
@@ -0,0 +1,222 @@
+import threading
+import time
+from concurrent.futures import Future
+from .backoff import Breaker, RetryLater
+from .metrics import metrics
+from .worldstate import Cancelled, FetchError
+
+
+class TokenBucket:
+    '''
+    Allows `rate` requests per second on average with bursts of `burst`
+    '''
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def take(self):
+        '''
+        Takes a token, returns False if there is none
+        '''
+        with self.lock:
+            self.refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def wait(self, cancel):
+        '''
+        Takes a token, sleeping until there is one. Returns False if the
+        cancel event was set while waiting.
+        '''
+        while True:
+            with self.lock:
+                self.refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                delay = (1 - self.tokens) / self.rate
+            if cancel.wait(delay):
+                return False
+
+
+class Coordinator:
+    '''
+    Single entry point for all fetches. Triggers for a platform that already
+    has a fetch in flight share it, results younger than max_age are served
+    from memory and the requests to the server are limited by a token bucket.
+    Failing platforms are backed off by the breaker, their requests fail with
+    RetryLater until they may be tried again. With a SharedCache the results
+    of other processes are used too and only one of them fetches at a time.
+    request() returns a Future with the current Snapshot of the platform,
+    in flight fetches can be cancelled.
+    '''
+
+    def __init__(self, fetcher, pool, max_age=10, rate=20 / 60, burst=6, breaker=None,
+                 shared=None):
+        self.fetcher = fetcher
+        self.pool = pool
+        self.max_age = max_age
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = breaker or Breaker()
+        self.shared = shared
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.recent = {}
+        self.stats = {"fetches": 0,
+                      "coalesced": 0,
+                      "cached": 0,
+                      "throttled": 0,
+                      "cancelled": 0,
+                      "backed_off": 0,
+                      "shared": 0}
+
+    def count(self, name):
+        # Only called with the lock held
+        self.stats[name] += 1
+        metrics.inc(f"sentient_{name}_total")
+
+    def request(self, platform):
+        with self.lock:
+            future = self.served(platform)
+            if future is not None:
+                return future
+
+        # A file read, done without the lock so other platforms aren't held up
+        shared = self.shared and self.shared.get(platform)
+        with self.lock:
+            # Something might have been started or fetched while reading
+            future = self.served(platform)
+            if future is not None:
+                return future
+
+            recent = self.recent.get(platform)
+            # Written by a tracker that doesn't track the same sections
+            if shared and shared[0].covers(self.fetcher.sections):
+                value, age = shared
+                self.count("shared")
+                self.recent[platform] = (time.monotonic() - age, value)
+                return done(value)
+
+            retry_in = self.breaker.allow(platform)
+            if retry_in:
+                self.count("backed_off")
+                return failed(RetryLater(platform, retry_in, self.breaker.is_open(platform)))
+
+            if not self.bucket.take():
+                self.count("throttled")
+                if recent is not None:
+                    return done(recent[1])
+                # Nothing to serve, the fetch waits for the next token
+                wait = True
+            else:
+                wait = False
+
+            self.count("fetches")
+            token = threading.Event()
+            future = self.pool.submit(self.fetch, platform, wait, token)
+            future.token = token
+            self.in_flight[platform] = future
+        return future
+
+    def served(self, platform):
+        '''
+        The Future of the fetch in flight or of a recent result, None if
+        there is neither. Only called with the lock held.
+        '''
+        future = self.in_flight.get(platform)
+        if future is not None:
+            self.count("coalesced")
+            return future
+
+        recent = self.recent.get(platform)
+        if recent is not None and time.monotonic() - recent[0] < self.max_age:
+            self.count("cached")
+            return done(recent[1])
+        return None
+
+    def fetch(self, platform, wait, token):
+        try:
+            if wait and not self.bucket.wait(token):
+                raise Cancelled(platform)
+            if self.shared is None:
+                value = self.download(platform, token)
+            else:
+                with self.shared.fetching(platform, token) as waited:
+                    if token.is_set():
+                        raise Cancelled(platform)
+                    # Another process fetched it while this one waited
+                    shared = self.shared.get(platform) if waited else None
+                    if shared and shared[0].covers(self.fetcher.sections):
+                        value = shared[0]
+                        with self.lock:
+                            self.count("shared")
+                    else:
+                        value = self.download(platform, token)
+                        self.shared.put(platform, value)
+            with self.lock:
+                self.recent[platform] = (time.monotonic(), value)
+            return value
+        finally:
+            with self.lock:
+                if getattr(self.in_flight.get(platform), "token", None) is token:
+                    del self.in_flight[platform]
+
+    def download(self, platform, token):
+        try:
+            value = self.fetcher.fetch(platform, token)
+        except Cancelled:
+            raise
+        except FetchError as e:
+            retry_in, circuit_open = self.breaker.failure(platform)
+            raise RetryLater(platform, retry_in, circuit_open, e) from e
+        self.breaker.success(platform)
+        if value is None:
+            value = self.fetcher.last[platform]["value"]
+        return value
+
+    def cancel(self, platform):
+        '''
+        Cancels the fetch of the platform if there is one, its Future raises
+        Cancelled
+        '''
+        with self.lock:
+            future = self.in_flight.pop(platform, None)
+            if future is None:
+                return
+            self.count("cancelled")
+        # Not started yet
+        future.cancel()
+        self.fetcher.cancel(future.token)
+
+    def cancel_all(self):
+        for platform in list(self.in_flight):
+            self.cancel(platform)
+
+
+def done(value):
+    '''
+    A Future that already has its result
+    '''
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+def failed(exception):
+    '''
+    A Future that already failed with the exception
+    '''
+    future = Future()
+    future.set_exception(exception)
+    return future
@@ -0,0 +1,83 @@
+'''
+Background SQLite writer of the history and the archive. Queued items are
+written by one thread with its own connection, everything that piled up in
+one transaction, so the threads that record never wait for the disk.
+'''
+import queue
+import sqlite3
+import threading
+
+
+def connect(path):
+    '''
+    Connection in WAL mode, readers in other threads and processes don't
+    block the writer
+    '''
+    conn = sqlite3.connect(path, timeout=10)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class Writer:
+    '''
+    Calls write(conn, items) in a transaction for the queued items, then
+    committed(conn) if given. Items can't be callables, those are the
+    callbacks of after().
+    '''
+
+    def __init__(self, path, write, name, committed=None):
+        self.path = path
+        self.write = write
+        self.committed = committed
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name=name, daemon=True)
+        self.thread.start()
+
+    def put(self, item):
+        self.queue.put(item)
+
+    def after(self, callback):
+        '''
+        Calls callback in the writer thread once everything queued before
+        it is written
+        '''
+        self.queue.put(callback)
+
+    def close(self, timeout=2):
+        '''
+        Writes what is left in the queue and stops the thread
+        '''
+        self.queue.put(None)
+        self.thread.join(timeout)
+
+    def run(self):
+        conn = connect(self.path)
+        running = True
+        while running:
+            items = [self.queue.get()]
+            # Everything that piled up is written in one transaction
+            while True:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in items:
+                running = False
+                items = [item for item in items if item is not None]
+            callbacks = [item for item in items if callable(item)]
+            items = [item for item in items if not callable(item)]
+            try:
+                if items:
+                    with conn:
+                        self.write(conn, items)
+                if self.committed is not None:
+                    self.committed(conn)
+            except sqlite3.Error as e:
+                print(e)
+            for callback in callbacks:
+                try:
+                    callback()
+                except Exception as e:
+                    print(f"{self.thread.name} callback failed: {e!r}")
+        conn.close()
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+'''
+Tracker without any GUI. Checks the world state and prints the spawns and
+despawns, can also log them to a file and run a command for each one.
+Doesn't import Qt so it can run on machines without a display.
+'''
+import argparse
+import json
+import logging
+import math
+import signal
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .archive import Archive
+from .backoff import RetryLater
+from .config import base_path
+from .coordinator import Coordinator
+from .history import History
+from .hub import Hub, serve
+from . import metrics as metrics_module
+from .metrics import metrics, LAG_BUCKETS
+from .notify import CommandSink, Dispatcher, WebhookSink, describe
+from . import profiling
+from .schedule import PollScheduler
+from .shared import SharedCache
+from .snapshot import SECTIONS, describe_item
+from .tracker import PLATFORMS, Tracker
+from .worldstate import Fetcher, size_text
+
+
+log = logging.getLogger("sentient-tracker")
+
+
+def terminate(signum, frame):
+    # SIGTERM (systemd, docker stop) shuts down like Ctrl-C
+    raise KeyboardInterrupt
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(
+        prog="sentient-tracker-headless",
+        description="Warframe sentient anomaly tracker without a GUI")
+    parser.add_argument("-p", "--platform", action="append", choices=PLATFORMS,
+                        help="platform to track, can be used multiple times (default: PC)")
+    parser.add_argument("-i", "--interval", type=int,
+                        help="fixed seconds between checks instead of the adaptive schedule")
+    parser.add_argument("--hook", action="append", default=[],
+                        help="command to run for every event, gets SENTIENT_* environment variables")
+    parser.add_argument("--webhook", action="append", default=[],
+                        help="URL the events are POSTed to as JSON")
+    parser.add_argument("--hook-timeout", type=float, default=10,
+                        help="seconds before a hook command or webhook is given up on (default: 10)")
+    parser.add_argument("--log", help="also append the events to this file")
+    parser.add_argument("--history", nargs="?", const="",
+                        help="record the events in a SQLite file (default: history.sqlite3 "
+                             "in the config directory)")
+    parser.add_argument("--snapshots", metavar="FILE",
+                        help="append every check to FILE as JSON lines for "
+                             "python -m wf_sentient_tracker.replay")
+    parser.add_argument("--archive", nargs="?", const="",
+                        help="keep the raw responses in a SQLite file (default: archive.sqlite3 "
+                             "in the config directory), see python -m wf_sentient_tracker.archive")
+    parser.add_argument("--archive-days", type=float, default=7,
+                        help="days the archived responses are kept (default: 7)")
+    parser.add_argument("--archive-megabytes", type=float, default=200,
+                        help="size limit of the archive (default: 200)")
+    parser.add_argument("--section", action="append", default=[],
+                        choices=[name for name in SECTIONS if name != "anomaly"],
+                        help="also track these world state sections and print what's new in them")
+    parser.add_argument("--url", help="world state URL with {} for the platform suffix "
+                                      "(default: $SENTIENT_TRACKER_URL or content.warframe.com)")
+    parser.add_argument("--metrics-port", type=int,
+                        help="serve Prometheus metrics on localhost:PORT/metrics")
+    parser.add_argument("--metrics-file", help="write Prometheus metrics to this file every 15s")
+    parser.add_argument("--shared-cache", type=float, default=15, metavar="SECONDS",
+                        help="reuse results of other trackers on this machine younger than "
+                             "SECONDS, 0 to disable (default: 15)")
+    parser.add_argument("--serve", type=int, metavar="PORT",
+                        help="also run a hub on PORT that pushes the states to trackers "
+                             "with the \"hub\" setting")
+    parser.add_argument("--bind", default="127.0.0.1",
+                        help="address of the hub (default: 127.0.0.1, 0.0.0.0 for the LAN)")
+    parser.add_argument("--profile", nargs="?", const="1", metavar="SPEC",
+                        help="profile the tracker and write reports to the profile directory in "
+                             "the config directory, see SENTIENT_PROFILE in the README")
+    parser.add_argument("--once", action="store_true",
+                        help="check once, print the state and exit")
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_args(args)
+    platforms = args.platform or ["PC"]
+
+    logging.basicConfig(stream=sys.stdout,
+                        level=logging.INFO,
+                        format="%(asctime)s %(message)s",
+                        datefmt="%Y-%m-%d %H:%M:%S")
+    if args.log:
+        handler = logging.FileHandler(args.log)
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        log.addHandler(handler)
+
+    try:
+        profiling.from_environment(base_path() / "profile", args.profile)
+    except ValueError as e:
+        sys.exit(f"Profiling: {e}")
+    if args.metrics_port:
+        metrics_module.serve(args.metrics_port)
+    if args.metrics_file:
+        metrics_module.write_periodically(args.metrics_file)
+
+    fetcher = Fetcher(args.section)
+    if args.url:
+        fetcher.base_url = args.url
+    tracker = Tracker()
+    scheduler = PollScheduler()
+    shared = None
+    if args.shared_cache:
+        shared = SharedCache(base_path() / "cache", args.shared_cache)
+    pool = ThreadPoolExecutor(max_workers=len(platforms))
+    # Every check is a new request, only the shared cache is used
+    coordinator = Coordinator(fetcher, pool, max_age=0, rate=len(platforms),
+                              burst=len(platforms), shared=shared)
+    hub = None
+    if args.serve:
+        hub = Hub(platforms)
+        serve(hub, args.serve, args.bind)
+        log.info("Hub running on http://%s:%d", args.bind, args.serve)
+    dispatcher = Dispatcher([WebhookSink(url, args.hook_timeout) for url in args.webhook])
+    for command in args.hook:
+        try:
+            dispatcher.add(CommandSink(command, args.hook_timeout))
+        except ValueError as e:
+            log.warning("Skipping the hook %r: %s", command, e)
+    snapshots = open(args.snapshots, "a") if args.snapshots else None
+    archive = None
+    if args.archive is not None:
+        archive = Archive(args.archive or base_path() / "archive.sqlite3", args.archive_days,
+                          args.archive_megabytes * 1e6)
+        fetcher.archive = archive
+    history = None
+    predictor = None
+    if args.history is not None:
+        history = History(args.history or base_path() / "history.sqlite3")
+        from . import predict
+        if predict.available():
+            predictor = predict.Predictor(history)
+
+    # Last snapshot of every platform
+    previous = {}
+    signal.signal(signal.SIGTERM, terminate)
+    try:
+        while True:
+            futures = [(platform, coordinator.request(platform)) for platform in platforms]
+            for platform, future in futures:
+                try:
+                    snapshot = future.result()
+                except RetryLater as e:
+                    # Without an error it's still backed off and was already reported
+                    snapshot = None if e.error is None else e
+                received = time.monotonic()
+                if snapshots is not None and snapshot is not None:
+                    data = {"tmp": None} if isinstance(snapshot, Exception) else snapshot.to_dict()
+                    snapshots.write(json.dumps({"time": time.time(), "platform": platform,
+                                                **data}) + "\n")
+                    snapshots.flush()
+                if isinstance(snapshot, RetryLater):
+                    if snapshot.circuit_open:
+                        log.warning("%s: server unavailable (%s), pausing for %ds",
+                                    platform, snapshot.error, snapshot.retry_in)
+                    else:
+                        log.warning("%s: connection error (%s), retrying in %ds",
+                                    platform, snapshot.error, snapshot.retry_in)
+                    fetcher.forget(platform)
+                    tracker.reset(platform)
+                    scheduler.forget(platform)
+                    previous.pop(platform, None)
+                    if hub is not None:
+                        hub.publish_error(platform, snapshot.retry_in, snapshot.circuit_open)
+                    continue
+                if snapshot is None:
+                    continue
+                if hub is not None:
+                    hub.publish(platform, snapshot)
+
+                # Everything is new on the first check
+                if platform in previous:
+                    for section, item in snapshot.added(previous[platform]):
+                        log.info("%s: %s", platform, describe_item(section, item))
+                previous[platform] = snapshot
+
+                scheduler.observe(platform, snapshot.node is not None)
+                event = tracker.update(platform, snapshot.node)
+                if event is None:
+                    continue
+                log.info(describe(event))
+                if history is not None:
+                    history.record(event)
+                if predictor is not None and event.kind != "none":
+                    # So the refit sees the event
+                    history.flush()
+                    predictor.refit(platform)
+                    prediction = predictor.predict(platform,
+                                                   tracker.spawns[platform],
+                                                   tracker.despawns[platform],
+                                                   event.node)
+                    if prediction is not None:
+                        scheduler.predict(platform, prediction.start, prediction.end)
+                        log.info("%s: %s", platform, predict.describe(prediction))
+                dispatcher.dispatch(event, received)
+                if event.kind != "none":
+                    metrics.observe("sentient_detection_lag_seconds", time.monotonic() - received,
+                                    LAG_BUCKETS, platform=platform, kind=event.kind)
+
+            if args.once:
+                break
+            if args.interval:
+                interval = args.interval
+            else:
+                interval = scheduler.next_interval(platforms)
+            # Failed platforms are retried when their backoff is over
+            retries = [retry for retry in map(coordinator.breaker.retry_in, platforms) if retry]
+            if retries:
+                interval = min(interval, math.ceil(min(retries)))
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Another SIGTERM ends it right away
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        pool.shutdown(wait=False)
+        for platform in platforms:
+            bandwidth = fetcher.bandwidth[platform]
+            if bandwidth["decoded"]:
+                log.info("%s: %s downloaded (%s decoded)", platform,
+                         size_text(bandwidth["wire"]), size_text(bandwidth["decoded"]))
+        if history is not None:
+            history.close()
+        if archive is not None:
+            archive.close()
+        if snapshots is not None:
+            snapshots.close()
+        dispatcher.close()
+        profiling.stop()
+
+
+if __name__ == "__main__":
+    main()
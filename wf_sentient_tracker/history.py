@@ -0,0 +1,143 @@
+import threading
+from datetime import datetime, timedelta
+from .dbwriter import Writer, connect
+from .tracker import Event
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    platform TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    node INTEGER,
+    time REAL NOT NULL,
+    observed INTEGER NOT NULL,
+    duration REAL
+);
+CREATE INDEX IF NOT EXISTS events_platform ON events (platform, kind, time);
+CREATE INDEX IF NOT EXISTS events_node ON events (node, kind, time);
+'''
+
+
+class History:
+    '''
+    SQLite store of every spawn and despawn with the full time and duration.
+    Writes are done by a background thread so recording never blocks, reads
+    can be done from any thread.
+    '''
+
+    def __init__(self, path):
+        self.path = str(path)
+        conn = self.connect()
+        conn.executescript(SCHEMA)
+        conn.close()
+        self.writer = Writer(self.path, self.write, "history")
+
+    def connect(self):
+        return connect(self.path)
+
+    def record(self, event):
+        '''
+        Queues a spawn/despawn Event to be written, other events are ignored
+        '''
+        if event.kind in ("spawn", "despawn"):
+            self.writer.put(event)
+
+    def after(self, callback):
+        '''
+        Calls callback in the writer thread once everything recorded before
+        it is written, so reads done by it see the new events
+        '''
+        self.writer.after(callback)
+
+    def flush(self, timeout=None):
+        '''
+        Waits until everything recorded before is written
+        '''
+        written = threading.Event()
+        self.after(written.set)
+        written.wait(timeout)
+
+    def close(self, timeout=2):
+        '''
+        Writes what is left in the queue and stops the writer
+        '''
+        self.writer.close(timeout)
+
+    def write(self, conn, events):
+        conn.executemany(
+            "INSERT INTO events (platform, kind, node, time, observed, duration) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [(event.platform,
+              event.kind,
+              event.node,
+              event.time.timestamp(),
+              int(event.observed),
+              event.duration.total_seconds() if event.duration is not None else None)
+             for event in events])
+
+    def raw(self, sql, params=()):
+        conn = self.connect()
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    def query(self, sql, params=()):
+        rows = self.raw(sql, params)
+        return [Event(platform,
+                      kind,
+                      node,
+                      datetime.fromtimestamp(time),
+                      bool(observed),
+                      timedelta(seconds=duration) if duration is not None else None)
+                for platform, kind, node, time, observed, duration in rows]
+
+    def events(self, platform=None, kind=None, node=None, start=None, end=None, limit=None):
+        '''
+        Returns the matching events, oldest first. start and end are datetimes.
+        '''
+        where = []
+        params = []
+        for column, value in (("platform", platform), ("kind", kind), ("node", node)):
+            if value is not None:
+                where.append(f"{column} = ?")
+                params.append(value)
+        if start is not None:
+            where.append("time >= ?")
+            params.append(start.timestamp())
+        if end is not None:
+            where.append("time < ?")
+            params.append(end.timestamp())
+
+        sql = "SELECT platform, kind, node, time, observed, duration FROM events"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        if limit is not None:
+            # The newest ones are wanted, reversed again below
+            sql += " ORDER BY time DESC LIMIT ?"
+            params.append(limit)
+            return self.query(sql, params)[::-1]
+        sql += " ORDER BY time"
+        return self.query(sql, params)
+
+    def last_spawns(self, platform, count=10):
+        '''
+        The last spawns on the platform, oldest first
+        '''
+        return self.events(platform=platform, kind="spawn", limit=count)
+
+    def spawns_at(self, node, days=30, platform=None):
+        '''
+        The spawns at the node in the last days
+        '''
+        start = datetime.now() - timedelta(days=days)
+        return self.events(platform=platform, kind="spawn", node=node, start=start)
+
+    def columns(self, platform):
+        '''
+        All the events of the platform as (time, is_spawn, node, observed)
+        tuples, oldest first. Cheaper than events() for bulk processing.
+        '''
+        return self.raw("SELECT time, kind = 'spawn', node, observed FROM events "
+                        "WHERE platform = ? ORDER BY time", (platform,))
@@ -0,0 +1,215 @@
+'''
+Fan-out hub. One tracker polls the world state and pushes the snapshot
+of every platform to any number of subscribed trackers as Server-Sent
+Events, so a shared host or LAN only polls upstream once per platform.
+
+    GET /events   event stream, starts with the known state of every platform
+    GET /state    the known states as JSON
+
+Events are "tmp" with {"platform", "tmp", "time"} and "fissures"/"alerts"
+if the hub tracks them (Snapshot.to_dict) and "error" with
+{"platform", "retry_in", "circuit_open"} when the hub can't reach the server.
+The stream starts with "platforms" {"platforms": [PLATFORM, ...]}, the
+platforms the hub checks.
+'''
+import json
+import queue
+import threading
+import time
+from .metrics import metrics
+from .worldstate import abort
+
+
+# Comment lines are sent this often so dead connections are noticed
+KEEPALIVE = 15
+# Events buffered per subscriber, slower subscribers are dropped
+QUEUE_SIZE = 64
+
+
+def event_text(event, data, event_id=None):
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(data, separators=(',', ':'))}")
+    return "\n".join(lines) + "\n\n"
+
+
+class Hub:
+    '''
+    Keeps the last state of every platform and the queues of the subscribers.
+    platforms are the ones that are checked.
+    '''
+
+    def __init__(self, platforms=()):
+        self.platforms = list(platforms)
+        self.lock = threading.Lock()
+        self.states = {}
+        self.snapshots = {}
+        self.errors = {}
+        self.subscribers = set()
+        self.sequence = 0
+
+    def subscribe(self):
+        '''
+        Returns a new subscriber queue that already has the known states
+        '''
+        subscriber = queue.Queue(QUEUE_SIZE)
+        with self.lock:
+            subscriber.put_nowait(event_text("platforms", {"platforms": self.platforms}))
+            for platform, data in self.states.items():
+                subscriber.put_nowait(event_text("tmp", data))
+            for platform, data in self.errors.items():
+                subscriber.put_nowait(event_text("error", data))
+            self.subscribers.add(subscriber)
+            metrics.set("sentient_hub_subscribers", len(self.subscribers))
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+            metrics.set("sentient_hub_subscribers", len(self.subscribers))
+
+    def broadcast(self, event, data):
+        # Only called with the lock held
+        self.sequence += 1
+        text = event_text(event, data, self.sequence)
+        for subscriber in list(self.subscribers):
+            try:
+                subscriber.put_nowait(text)
+            except queue.Full:
+                # The handler sees None and closes the connection
+                self.subscribers.discard(subscriber)
+                metrics.inc("sentient_hub_dropped_total")
+                with subscriber.mutex:
+                    subscriber.queue.clear()
+                subscriber.put_nowait(None)
+        metrics.inc("sentient_hub_events_total", event=event)
+
+    def publish(self, platform, snapshot):
+        '''
+        Sends a changed Snapshot of the platform to every subscriber
+        '''
+        data = {"platform": platform, **snapshot.to_dict(), "time": time.time()}
+        with self.lock:
+            self.errors.pop(platform, None)
+            if self.snapshots.get(platform) == snapshot:
+                return
+            self.snapshots[platform] = snapshot
+            self.states[platform] = data
+            self.broadcast("tmp", data)
+
+    def publish_error(self, platform, retry_in, circuit_open=False):
+        '''
+        Tells the subscribers that the platform couldn't be checked, they
+        forget its state like after their own errors
+        '''
+        data = {"platform": platform, "retry_in": retry_in, "circuit_open": circuit_open}
+        with self.lock:
+            self.states.pop(platform, None)
+            self.snapshots.pop(platform, None)
+            self.errors[platform] = data
+            self.broadcast("error", data)
+
+    def snapshot(self):
+        with self.lock:
+            return {"platforms": self.platforms,
+                    "states": list(self.states.values()),
+                    "errors": list(self.errors.values())}
+
+
+def serve(hub, port, host="127.0.0.1"):
+    '''
+    Serves the hub in a daemon thread, returns the server
+    '''
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            path = self.path.split("?")[0]
+            if path == "/state":
+                body = json.dumps(hub.snapshot()).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            elif path == "/events":
+                self.stream()
+            else:
+                self.send_error(404)
+
+        def stream(self):
+            # Chunked so clients get every event as soon as it's written
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            subscriber = hub.subscribe()
+            try:
+                while True:
+                    try:
+                        text = subscriber.get(timeout=KEEPALIVE)
+                    except queue.Empty:
+                        text = ":\n\n"
+                    if text is None:
+                        break
+                    data = text.encode()
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                    self.wfile.flush()
+                self.wfile.write(b"0\r\n\r\n")
+            except OSError:
+                pass
+            finally:
+                hub.unsubscribe(subscriber)
+                self.close_connection = True
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="hub", daemon=True).start()
+    return server
+
+
+class Subscription:
+    '''
+    Connection to a hub's event stream. events() yields (event, data) until
+    the connection ends, close() stops it from another thread.
+    '''
+
+    def __init__(self, url, session):
+        self.url = url.rstrip("/") + "/events"
+        self.session = session
+        self.response = None
+        self.closed = False
+
+    def events(self):
+        self.response = self.session.get(self.url, stream=True, timeout=(3.05, KEEPALIVE * 3))
+        if self.closed:
+            abort(self.response)
+        self.response.raise_for_status()
+        event = "message"
+        data = []
+        for line in self.response.iter_lines(decode_unicode=True):
+            if line:
+                field, _, value = line.partition(":")
+                value = value[1:] if value.startswith(" ") else value
+                if field == "event":
+                    event = value
+                elif field == "data":
+                    data.append(value)
+                continue
+            # An empty line ends the event
+            if data:
+                yield event, json.loads("\n".join(data))
+            event = "message"
+            data = []
+
+    def close(self):
+        self.closed = True
+        if self.response is not None:
+            abort(self.response)
@@ -1,47 +1,95 @@
 #!/usr/bin/env python3
-import requests
 import json
+import math
 import sys
 import os
 import subprocess
-from pathlib import Path
-from datetime import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from .ui import Ui_MainWidget
+from .config import atomic_write, base_path, resources_path
+from .worldstate import Fetcher, FetchError, Cancelled, size_text
+from .archive import Archive
+from .backoff import RetryLater
+from .coordinator import Coordinator
+from .hub import Subscription
+from .schedule import PollScheduler
+from .shared import SharedCache
+from .snapshot import Snapshot, summary
+from .sounds import SoundError, prepare
+from .tracker import Tracker, node_name
+from .history import History
+from . import metrics as metrics_module
+from . import profiling
+from .metrics import metrics, LAG_BUCKETS
+from .notify import CallbackSink, CommandSink, Dispatcher, LogSink, WebhookSink
 from PyQt5.QtWidgets import (
     QApplication, QWidget,
     QSystemTrayIcon, QMessageBox,
     QMenu, QAction, QStyle)
-from PyQt5.QtMultimedia import QSound
-from PyQt5.QtCore import QObject, QThread, pyqtSlot, pyqtSignal, QTimer
+from PyQt5.QtCore import (
+    QObject, QThread, QUrl, QFileSystemWatcher,
+    pyqtSlot, pyqtSignal, QTimer)
 from PyQt5.QtGui import QIcon
 
 
+def file_stamp(path):
+    '''
+    Modification time and size of the file or None if it doesn't exist
+    '''
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
 class MainWindow(QWidget):
     get_data_signal = pyqtSignal()
     change_platform_signal = pyqtSignal(str)
+    all_platforms_signal = pyqtSignal(bool)
+    adaptive_signal = pyqtSignal(bool)
+    prediction_signal = pyqtSignal(str, object, object)
+    limits_signal = pyqtSignal(float, float, int, float)
+    hub_signal = pyqtSignal(str)
+    sections_signal = pyqtSignal(object)
     quit_signal = pyqtSignal()
+    # Name, path of the prepared sound, load_sounds() call it's from
+    sound_prepared = pyqtSignal(str, str, int)
+    # Platform, Prediction or None, from the history's writer thread
+    prediction_ready = pyqtSignal(str, object)
 
     def __init__(self):
         super(MainWindow, self).__init__()
         self.tray_close_shown = False
         self.current_platform = "PC"
-        self.nodes = {505: "Ruse War Field",
-                      510: "Gian Point",
-                      550: "Nsu Grid",
-                      551: "Ganalen's Grave",
-                      552: "Rya",
-                      553: "Flexa",
-                      554: "H-2 Cloud",
-                      555: "R-9 Cloud"}
-        self.last_state = {"PC": None,
-                           "PS4": None,
-                           "XB1": None}
-        self.time_stamps = {"PC": {"spawn": None,
-                                   "despawn": None},
-                            "PS4": {"spawn": None,
-                                    "despawn": None},
-                            "XB1": {"spawn": None,
-                                    "despawn": None}}
+        self.all_platforms = False
+        self.adaptive = True
+        self.tracker = Tracker()
+        self.switch_started = None
+        self.predictor = None
+        self.predictions = {}
+        # Latest Snapshot of every platform
+        self.snapshots = {}
+        # Tracked world state sections besides the anomaly
+        self.sections = []
+        # platform: (time.monotonic() of the next try, circuit open)
+        self.retries = {}
+        self.hub = ""
+        # Platforms the hub checks, None until it said
+        self.hub_platforms = None
+        self.limits = None
+        self.notify = None
+        self.notify_sinks = []
+        # Edited settings that are only used after a restart, kept when saving
+        self.restart_settings = {}
+        # Settings changes made by load_config aren't saved again
+        self.applying = False
+        # The sound and the tray message are inline, they only start
+        # something in Qt. load_config adds the log, hooks and webhooks.
+        self.dispatcher = Dispatcher([CallbackSink("sound", self.notify_sound),
+                                      CallbackSink("desktop", self.notify_desktop)])
 
         # Set up the user interface from Designer.
         self.ui = Ui_MainWidget()
@@ -56,6 +104,8 @@ class MainWindow(QWidget):
         self.ui.DirectoryButton.clicked.connect(self.open_directory)
 
         self.handle_files()
+        self.watch_files()
+        self.history = History(self.base_path / "history.sqlite3")
         self.setWindowIcon(self.icon)
 
         self.TrayIcon = QSystemTrayIcon(self)
@@ -72,69 +122,330 @@ class MainWindow(QWidget):
         tray_menu.addAction(quit_action)
         self.TrayIcon.setContextMenu(tray_menu)
 
+        # UI changes are saved a second after the last one
+        self.save_timer = QTimer(self)
+        self.save_timer.setSingleShot(True)
+        self.save_timer.setInterval(1000)
+        self.save_timer.timeout.connect(self.save_settings)
+        for checkbox in (self.ui.SoundCheckbox, self.ui.MessagesCheckbox,
+                         self.ui.TrayCheckbox, self.ui.TrayhideCheckbox):
+            checkbox.stateChanged.connect(self.settings_changed)
+        self.ui.PlatformCombobox.currentTextChanged.connect(self.settings_changed)
+
+        # Counts down the "retrying in" text
+        self.retry_timer = QTimer(self)
+        self.retry_timer.setInterval(1000)
+        self.retry_timer.timeout.connect(self.show_retry)
+
         # Worker set up and signal connection
         self.worker_thread = QThread(parent=self)
         self.worker = Worker()
         self.worker.result.connect(self.use_data)
+        self.worker.retrying.connect(self.use_retry)
+        self.worker.hub_platforms.connect(self.use_hub_platforms)
+        self.worker.schedule_changed.connect(self.ui.CheckButton.setToolTip)
         self.worker.moveToThread(self.worker_thread)
         self.worker_thread.started.connect(self.worker.start_worker)
         self.get_data_signal.connect(self.worker.get_data)
         self.change_platform_signal.connect(self.worker.set_platform)
+        self.all_platforms_signal.connect(self.worker.set_all_platforms)
+        self.adaptive_signal.connect(self.worker.set_adaptive)
+        self.prediction_signal.connect(self.worker.set_prediction)
+        self.prediction_ready.connect(self.use_prediction)
+        self.limits_signal.connect(self.worker.set_limits)
+        self.hub_signal.connect(self.worker.set_hub)
+        self.sections_signal.connect(self.worker.set_sections)
         self.ui.CheckButton.clicked.connect(self.worker.get_data)
         self.quit_signal.connect(self.worker.stop_worker)
-        self.worker_thread.start()
 
         self.load_config()
 
+        # The sounds and the first check wait until the window is shown
+        QTimer.singleShot(0, self.worker_thread.start)
+        QTimer.singleShot(0, self.load_sounds)
+        QTimer.singleShot(0, self.load_predictor)
+
+    def read_settings(self):
+        '''
+        Returns the settings from the configuration file, None if it can't
+        be read
+        '''
+        if not self.conf_path.is_file():
+            return {}
+        try:
+            with open(self.conf_path) as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"{self.conf_path}: {e}")
+            return None
+
     def load_config(self):
         '''
         Loads the configuration file and changes states if not default
         '''
-        if self.conf_path.is_file():
-            with open(self.conf_path) as f:
-                settings = json.load(f)
-        else:
-            settings = {}
-
-        if not settings.get("sounds", True):
-            self.ui.SoundCheckbox.setChecked(False)
-        if not settings.get("messages", True):
-            self.ui.MessagesCheckbox.setChecked(False)
-        if not settings.get("hide", True):
-            self.ui.TrayhideCheckbox.setChecked(False)
-        if settings.get("hide_shown", False):
-            self.tray_close_shown = True
-        if not settings.get("tray", True):
-            self.ui.TrayCheckbox.setChecked(False)
-        else:
+        settings = self.read_settings() or {}
+        # Subscribe to a hub instead of checking, see hub.py
+        self.hub = settings.get("hub", "")
+        if self.hub:
+            self.hub_signal.emit(self.hub)
+            self.ui.CheckButton.setEnabled(False)
+            self.ui.CheckButton.setToolTip(f"The states are pushed by {self.hub}")
+        self.metrics_port = settings.get("metrics_port", 0)
+        if self.metrics_port:
+            try:
+                metrics_module.serve(self.metrics_port)
+            except OSError as e:
+                print(e)
+        self.metrics_file = settings.get("metrics_file", "")
+        if self.metrics_file:
+            metrics_module.write_periodically(self.base_path / self.metrics_file)
+        # Raw responses, see archive.py
+        self.archive_days = settings.get("archive_days", 0)
+        self.archive_megabytes = settings.get("archive_megabytes", 200)
+        self.archive = None
+        archive = None
+        if self.archive_days:
+            archive = (self.base_path / "archive.sqlite3", self.archive_days,
+                       self.archive_megabytes * 1e6)
+        # Downloads and parsing in a child process, see remote.py
+        self.fetch_process = settings.get("fetch_process", False)
+        self.remote = None
+        if self.fetch_process:
+            from .remote import FetchProcess, RemoteFetcher
+            # The child keeps the archive
+            self.remote = FetchProcess(extra_sections=settings.get("sections", []),
+                                       archive=archive)
+            # The worker thread isn't running yet
+            self.worker.fetcher = self.worker.coordinator.fetcher = RemoteFetcher(self.remote)
+            # A crashed process is started again before the next check
+            self.supervise_timer = QTimer(self)
+            self.supervise_timer.setInterval(5000)
+            self.supervise_timer.timeout.connect(self.remote.check)
+            self.supervise_timer.start()
+        elif archive is not None:
+            self.archive = Archive(*archive)
+            self.worker.fetcher.archive = self.archive
+        self.apply_settings(settings)
+        if self.ui.TrayCheckbox.isChecked():
             self.TrayIcon.show()
 
         platform = settings.get("platform", "PC")
         if platform == "PC":
             self.get_data_signal.emit()
         else:
+            self.applying = True
             self.ui.PlatformCombobox.setCurrentText(platform)
+            self.applying = False
 
-    def handle_files(self):
+    def apply_settings(self, settings):
         '''
-        Deals with the paths for the files
+        Changes the states that differ from the settings, used at the start
+        and when settings.json is edited
         '''
-        # _MEIPASS is the temp directory used by the .exe
-        if hasattr(sys, "_MEIPASS"):
-            defualt_path = Path(sys._MEIPASS) / "resources"
-        else:
-            defualt_path = Path(__file__).resolve().parent / "resources"
+        self.applying = True
+        self.ui.SoundCheckbox.setChecked(settings.get("sounds", True))
+        self.ui.MessagesCheckbox.setChecked(settings.get("messages", True))
+        self.ui.TrayhideCheckbox.setChecked(settings.get("hide", True))
+        self.ui.TrayCheckbox.setChecked(settings.get("tray", True))
+        self.tray_close_shown = settings.get("hide_shown", False)
+        all_platforms = settings.get("all_platforms", False)
+        if all_platforms != self.all_platforms:
+            self.all_platforms = all_platforms
+            self.all_platforms_signal.emit(all_platforms)
+        sections = settings.get("sections", [])
+        if sections != self.sections:
+            self.sections = sections
+            self.sections_signal.emit(tuple(sections))
+        adaptive = settings.get("adaptive_polling", True)
+        if adaptive != self.adaptive:
+            self.adaptive = adaptive
+            self.adaptive_signal.emit(adaptive)
 
-        # Determines the base path for the config/custom files
-        dot_conf_path = Path.home() / ".config"
-        if dot_conf_path.is_dir():
-            self.base_path = dot_conf_path / "sentient-tracker"
-        else:
-            self.base_path = Path.home() / ".sentient-tracker"
+        limits = {"cache_seconds": settings.get("cache_seconds", 10),
+                  "requests_per_minute": settings.get("requests_per_minute", 20),
+                  "burst": settings.get("burst", 6),
+                  "shared_cache_seconds": settings.get("shared_cache_seconds", 15)}
+        if limits != self.limits:
+            self.limits = limits
+            self.limits_signal.emit(limits["cache_seconds"],
+                                    limits["requests_per_minute"],
+                                    limits["burst"],
+                                    limits["shared_cache_seconds"])
+        notify = {"event_log": settings.get("event_log", ""),
+                  "hooks": settings.get("hooks", []),
+                  "webhooks": settings.get("webhooks", []),
+                  "notify_timeout": settings.get("notify_timeout", 10)}
+        if notify != self.notify:
+            self.set_sinks(notify)
+        self.applying = False
 
+    def set_sinks(self, notify):
+        '''
+        Replaces the log, hook and webhook sinks of the dispatcher
+        '''
+        for sink in self.notify_sinks:
+            self.dispatcher.remove(sink)
+        self.notify = notify
+        timeout = notify["notify_timeout"]
+        self.notify_sinks = []
+        if notify["event_log"]:
+            self.notify_sinks.append(LogSink(self.base_path / notify["event_log"], timeout))
+        for command in notify["hooks"]:
+            try:
+                self.notify_sinks.append(CommandSink(command, timeout))
+            except ValueError as e:
+                print(f"Skipping the hook {command!r}: {e}")
+        for url in notify["webhooks"]:
+            self.notify_sinks.append(WebhookSink(url, timeout))
+        for sink in self.notify_sinks:
+            self.dispatcher.add(sink)
+
+    def settings(self):
+        '''
+        The current settings as they are saved in settings.json
+        '''
+        return {"sounds": self.ui.SoundCheckbox.isChecked(),
+                "messages": self.ui.MessagesCheckbox.isChecked(),
+                "tray": self.ui.TrayCheckbox.isChecked(),
+                "hide": self.ui.TrayhideCheckbox.isChecked(),
+                "hide_shown": self.tray_close_shown,
+                "all_platforms": self.all_platforms,
+                "adaptive_polling": self.adaptive,
+                "sections": self.sections,
+                **self.limits,
+                "metrics_port": self.metrics_port,
+                "metrics_file": self.metrics_file,
+                "archive_days": self.archive_days,
+                "archive_megabytes": self.archive_megabytes,
+                "fetch_process": self.fetch_process,
+                "hub": self.hub,
+                **self.notify,
+                "platform": self.ui.PlatformCombobox.currentText(),
+                **self.restart_settings}
+
+    @pyqtSlot()
+    def settings_changed(self):
+        if not self.applying:
+            self.save_timer.start()
+
+    @pyqtSlot()
+    def save_settings(self):
+        '''
+        Writes the settings to a temporary file and renames it, so a crash or
+        the file watcher never see a partial file
+        '''
         self.base_path.mkdir(parents=True, exist_ok=True)
+        try:
+            atomic_write(self.conf_path, json.dumps(self.settings(), indent=4))
+        except OSError as e:
+            print(e)
+            return
+        # Not reloaded when the watcher sees it
+        self.file_stamps[self.conf_path] = file_stamp(self.conf_path)
+
+    def watch_files(self):
+        '''
+        Watches the config directory so edits of settings.json and new or
+        changed custom sounds are used right away. The files are watched as
+        well because editors that write in place don't change the directory.
+        '''
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self.files_changed)
+        self.watcher.fileChanged.connect(self.files_changed)
+        # Saving a file can cause several events
+        self.reload_timer = QTimer(self)
+        self.reload_timer.setSingleShot(True)
+        self.reload_timer.setInterval(200)
+        self.reload_timer.timeout.connect(self.reload_files)
+        self.file_stamps = {path: file_stamp(path) for path in self.watched_files()}
+        self.watch()
+
+    def watched_files(self):
+        return [self.conf_path, self.base_path / "spawn.wav", self.base_path / "despawn.wav"]
+
+    def watch(self):
+        '''
+        Adds the directory and the files that exist to the watcher, replaced
+        files have to be added again
+        '''
+        paths = [str(self.base_path)] + [str(path) for path in self.watched_files()
+                                         if path.is_file()]
+        watched = set(self.watcher.directories() + self.watcher.files())
+        missing = [path for path in paths if path not in watched]
+        if missing:
+            self.watcher.addPaths(missing)
+
+    @pyqtSlot(str)
+    def files_changed(self, path):
+        self.reload_timer.start()
+
+    @pyqtSlot()
+    def reload_files(self):
+        '''
+        Applies the files in the config directory that changed since the
+        last time
+        '''
+        self.watch()
+        stamps = {path: file_stamp(path) for path in self.watched_files()}
+        changed = {path for path, stamp in stamps.items() if stamp != self.file_stamps.get(path)}
+        self.file_stamps = stamps
+        if not changed:
+            return
+
+        if self.conf_path in changed:
+            settings = self.read_settings()
+            if settings is not None:
+                print("settings.json changed")
+                self.apply_settings(settings)
+                platform = settings.get("platform", "PC")
+                if platform != self.ui.PlatformCombobox.currentText():
+                    self.applying = True
+                    self.ui.PlatformCombobox.setCurrentText(platform)
+                    self.applying = False
+                for key, value in (("hub", self.hub), ("metrics_port", self.metrics_port),
+                                   ("metrics_file", self.metrics_file),
+                                   ("archive_days", self.archive_days),
+                                   ("archive_megabytes", self.archive_megabytes),
+                                   ("fetch_process", self.fetch_process)):
+                    self.restart_settings.pop(key, None)
+                    if settings.get(key, value) != value:
+                        print(f"{key} is used after a restart")
+                        self.restart_settings[key] = settings[key]
+        if changed - {self.conf_path}:
+            print("Custom sounds changed")
+            self.find_sounds()
+            # The old sounds are played until the new ones are ready
+            self.load_sounds()
+
+    def handle_files(self):
+        '''
+        Deals with the paths for the files
+        '''
+        defualt_path = resources_path()
+        self.base_path = base_path()
         self.conf_path = self.base_path / "settings.json"
 
+        icon_file = f"{defualt_path / 'icon.png'}"
+        self.default_sound_files = {"spawn": f"{defualt_path / 'spawn.wav'}",
+                                    "despawn": f"{defualt_path / 'despawn.wav'}"}
+        self.find_sounds()
+        self.sounds = {}
+        # name: (time.monotonic() of play(), time of the check or None)
+        self.sound_started = {}
+        # Sounds played before they were ready, played when they are
+        self.waiting_sounds = set()
+        # Increased by every load_sounds() so older results are dropped
+        self.sounds_loaded = 0
+        # Big WAVs take a while to normalize, it's done in this thread
+        self.sound_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sounds")
+        self.sound_prepared.connect(self.use_sound)
+        self.icon = QIcon(icon_file)
+
+    def find_sounds(self):
+        '''
+        Uses the custom sounds in the config directory if there are any
+        '''
+        defualt_path = resources_path()
         spawn_path = self.base_path / "spawn.wav"
         if spawn_path.is_file():
             spawn_sound = f"{spawn_path}"
@@ -147,10 +458,118 @@ class MainWindow(QWidget):
         else:
             despawn_sound = f"{defualt_path / 'despawn.wav'}"
 
-        icon_file = f"{defualt_path / 'icon.png'}"
-        self.sounds = {"spawn": QSound(spawn_sound),
-                       "despawn": QSound(despawn_sound)}
-        self.icon = QIcon(icon_file)
+        self.sound_files = {"spawn": spawn_sound,
+                            "despawn": despawn_sound}
+
+    @pyqtSlot()
+    def load_sounds(self):
+        '''
+        Prepares the sounds in the background, use_sound() creates them
+        when they are ready
+        '''
+        self.sounds_loaded += 1
+        for name, path in self.sound_files.items():
+            self.sound_pool.submit(self.prepare_sound, name, path, self.sounds_loaded)
+
+    def prepare_sound(self, name, path, loaded):
+        '''
+        Runs in the sound thread
+        '''
+        cache = self.base_path / "cache"
+        try:
+            path = prepare(path, cache)
+        except SoundError as e:
+            print(f"{path}: {e}, using the default sound")
+            try:
+                path = prepare(self.default_sound_files[name], cache)
+            except SoundError as e:
+                print(e)
+                path = self.default_sound_files[name]
+        self.sound_prepared.emit(name, str(path), loaded)
+
+    @pyqtSlot(str, str, int)
+    def use_sound(self, name, path, loaded):
+        '''
+        Creates the sound from the prepared file. QtMultimedia is only
+        imported here because it is slow to load. QSoundEffect decodes the
+        sound once and keeps it in memory so playing it starts right away.
+        '''
+        if loaded != self.sounds_loaded:
+            return
+        from PyQt5.QtMultimedia import QSoundEffect
+        sound = QSoundEffect(self)
+        sound.setSource(QUrl.fromLocalFile(path))
+        sound.playingChanged.connect(lambda name=name: self.sound_playing(name))
+        old = self.sounds.get(name)
+        self.sounds[name] = sound
+        if old is not None:
+            old.deleteLater()
+        if name in self.waiting_sounds:
+            self.waiting_sounds.discard(name)
+            sound.play()
+
+    def sound_playing(self, name):
+        '''
+        Records how long it took from play() and from the check to the sound
+        being audible
+        '''
+        if not self.sounds[name].isPlaying() or name not in self.sound_started:
+            return
+        started, received = self.sound_started.pop(name)
+        now = time.monotonic()
+        metrics.observe("sentient_alert_seconds", now - started, LAG_BUCKETS, sound=name)
+        if received is not None:
+            metrics.observe("sentient_alert_lag_seconds", now - received, LAG_BUCKETS,
+                            sound=name)
+
+    @pyqtSlot()
+    def load_predictor(self):
+        '''
+        Sets up the spawn predictions if numpy is installed
+        '''
+        from . import predict
+        if not predict.available():
+            return
+        self.predictor = predict.Predictor(self.history)
+        for platform in self.tracker.states:
+            self.update_prediction(platform)
+
+    def update_prediction(self, platform, node=None):
+        '''
+        Refits and predicts the next spawn of the platform in the history's
+        writer thread once the events recorded so far are written, the
+        result comes back through prediction_ready
+        '''
+        if self.predictor is None:
+            return
+        predictor = self.predictor
+        spawn = self.tracker.spawns[platform]
+        despawn = self.tracker.despawns[platform]
+
+        def refit():
+            predictor.refit(platform)
+            self.prediction_ready.emit(platform,
+                                       predictor.predict(platform, spawn, despawn, node))
+        self.history.after(refit)
+
+    @pyqtSlot(str, object)
+    def use_prediction(self, platform, prediction):
+        '''
+        Shows the prediction and passes it to the worker
+        '''
+        self.predictions[platform] = prediction
+        if prediction is not None:
+            self.prediction_signal.emit(platform, prediction.start, prediction.end)
+        if (platform == self.current_platform and platform not in self.retries
+                and self.tracker.states[platform] is not None):
+            self.update_text(platform)
+
+    def play_sound(self, name, received=None):
+        self.sound_started[name] = (time.monotonic(), received)
+        if name in self.sounds:
+            self.sounds[name].play()
+        else:
+            self.waiting_sounds.add(name)
 
     @pyqtSlot()
     def open_directory(self):
@@ -175,92 +594,169 @@ class MainWindow(QWidget):
 
     @pyqtSlot(str)
     def platform_change(self, platform):
-        self.last_state[self.current_platform] = None
+        self.switch_started = time.monotonic()
         self.change_platform_signal.emit(platform)
-        self.get_data_signal.emit()
+        if not self.all_platforms and not self.hub:
+            self.tracker.reset(self.current_platform)
+            self.current_platform = platform
+            self.get_data_signal.emit()
+            return
+
+        # Every platform is already tracked so the known state can be shown
         self.current_platform = platform
+        if not self.hub_tracks(platform):
+            self.show_not_tracked()
+        elif platform in self.retries:
+            self.show_retry()
+        elif self.tracker.states[platform] is None:
+            self.ui.StatusLabel.setText("Checking...")
+            self.get_data_signal.emit()
+        else:
+            self.update_text(platform)
+
+    def hub_tracks(self, platform):
+        return not self.hub or self.hub_platforms is None or platform in self.hub_platforms
+
+    def show_not_tracked(self):
+        self.ui.StatusLabel.setText("Not tracked by the hub")
+        self.TrayIcon.setToolTip(f"{self.current_platform} isn't tracked by the hub")
+
+    @pyqtSlot(object)
+    def use_hub_platforms(self, platforms):
+        '''
+        The hub said which platforms it checks, the others won't get a state
+        '''
+        self.hub_platforms = set(platforms)
+        if not self.hub_tracks(self.current_platform):
+            self.show_not_tracked()
 
     @pyqtSlot()
     def play_spawn(self):
-        self.sounds["spawn"].play()
+        self.play_sound("spawn")
 
     @pyqtSlot()
     def play_despawn(self):
-        self.sounds["despawn"].play()
+        self.play_sound("despawn")
 
-    @pyqtSlot(str)
-    def use_data(self, data):
+    @pyqtSlot(str, object, float)
+    def use_data(self, platform, snapshot, received):
         '''
-        Deals with the data from the world state
+        Deals with the Snapshot from the world state, None if the check
+        failed. Only the currently selected platform updates the labels and
+        notifies, others are tracked silently. received is the
+        time.monotonic() of the check.
         '''
-        platform = self.ui.PlatformCombobox.currentText()
-        state = self.last_state[platform]
-        if data == "Error":
-            self.ui.StatusLabel.setText("Connection error")
-            self.TrayIcon.setToolTip("Connection error")
-            self.last_state[platform] = None
+        shown = platform == self.current_platform
+        if snapshot is None:
+            self.tracker.reset(platform)
+            self.snapshots.pop(platform, None)
+            if shown:
+                self.ui.StatusLabel.setText("Connection error")
+                self.TrayIcon.setToolTip("Connection error")
             return
-        planet = json.loads(data)
 
-        if planet and not state:
-            code = planet["sfn"]
-
-            if self.ui.SoundCheckbox.isChecked():
-                self.sounds["spawn"].play()
+        self.retries.pop(platform, None)
+        self.snapshots[platform] = snapshot
+        event = self.tracker.update(platform, snapshot.node)
+        if event is None:
+            # Only the other sections changed
+            if shown and self.tracker.states[platform] is not None:
+                self.update_text(platform)
+            return
+        # Before the slower history and prediction updates
+        self.dispatcher.dispatch(event, received)
+        self.history.record(event)
+        if event.kind != "none":
+            self.update_prediction(platform, event.node)
+        if not shown:
+            return
 
-            if self.ui.MessagesCheckbox.isChecked():
-                self.TrayIcon.showMessage(
-                    "Sentient anomaly tracker",
-                    f"Anomaly present at {self.nodes[code]}",
-                    self.icon,
-                    10000)
+        if event.kind != "none":
+            metrics.observe("sentient_detection_lag_seconds", time.monotonic() - received,
+                            LAG_BUCKETS, platform=platform, kind=event.kind)
+        self.update_text(platform)
 
-            if state is False:
-                time = datetime.now().strftime("%H:%M:%S")
-                self.time_stamps[platform]["spawn"] = time
-            self.last_state[platform] = True
-            self.update_text(platform, planet)
+    def notify_sound(self, events, received):
+        for event, checked in zip(events, received):
+            if (event.platform == self.current_platform and event.kind != "none"
+                    and self.ui.SoundCheckbox.isChecked()):
+                self.play_sound(event.kind, checked)
 
-        elif not planet and state:
-            time = datetime.now().strftime("%H:%M:%S")
-            self.time_stamps[platform]["despawn"] = time
+    def notify_desktop(self, events, received):
+        for event in events:
+            if event.platform != self.current_platform or not self.ui.MessagesCheckbox.isChecked():
+                continue
+            if event.kind == "spawn":
+                message = f"Anomaly present at {node_name(event.node)}"
+                duration = 10000
+            elif event.kind == "despawn":
+                message = "Anomaly despawned"
+                duration = 2000
+            else:
+                message = "No anomaly"
+                duration = 2000
+            self.TrayIcon.showMessage(
+                "Sentient anomaly tracker",
+                message,
+                self.icon,
+                duration)
 
-            if self.ui.SoundCheckbox.isChecked():
-                self.sounds["despawn"].play()
+    @pyqtSlot(str, float, bool)
+    def use_retry(self, platform, retry_in, circuit_open):
+        '''
+        The check of the platform failed or was backed off, the next try is in
+        retry_in seconds
+        '''
+        self.tracker.reset(platform)
+        self.retries[platform] = (time.monotonic() + retry_in, circuit_open)
+        if platform == self.current_platform:
+            self.show_retry()
 
-            if self.ui.MessagesCheckbox.isChecked():
-                self.TrayIcon.showMessage(
-                    "Sentient anomaly tracker",
-                    "Anomaly despawned",
-                    self.icon,
-                    2000)
-            self.last_state[platform] = False
-            self.update_text(platform, planet)
+    @pyqtSlot()
+    def show_retry(self):
+        '''
+        Shows when the current platform is tried again
+        '''
+        retry = self.retries.get(self.current_platform)
+        if retry is None:
+            self.retry_timer.stop()
+            return
+        retry_at, circuit_open = retry
+        if circuit_open:
+            text = "Server unavailable"
+        else:
+            text = "Connection error"
 
-        elif not planet and state is None:
-            if self.ui.MessagesCheckbox.isChecked():
-                self.TrayIcon.showMessage(
-                    "Sentient anomaly tracker",
-                    "No anomaly",
-                    self.icon,
-                    2000)
-            self.last_state[platform] = False
+        remaining = math.ceil(retry_at - time.monotonic())
+        if remaining <= 0:
+            text = f"{text}, retrying now"
+            self.retry_timer.stop()
+        elif remaining < 120:
+            text = f"{text}, retrying in {remaining}s"
+            self.retry_timer.start()
+        else:
+            text = f"{text}, retrying in {remaining // 60}min"
+            self.retry_timer.start()
+        self.ui.StatusLabel.setText(text)
+        self.TrayIcon.setToolTip(text)
 
-    def update_text(self, platform, planet):
+    def update_text(self, platform):
         '''
         Updates the labels and tool tips
         '''
-        spawn_stamp = self.time_stamps[platform]["spawn"]
-        despawn_stamp = self.time_stamps[platform]["despawn"]
-        state = self.last_state[platform]
+        spawn_time = self.tracker.spawns[platform]
+        despawn_time = self.tracker.despawns[platform]
+        spawn_stamp = spawn_time and spawn_time.strftime("%H:%M:%S")
+        despawn_stamp = despawn_time and despawn_time.strftime("%H:%M:%S")
+        state = self.tracker.states[platform]
 
         if state:
-            code = planet["sfn"]
-            status_str = f"Anomaly at {self.nodes[code]}"
+            name = node_name(self.tracker.nodes[platform])
+            status_str = f"Anomaly at {name}"
             if spawn_stamp is None:
-                tool_tip = f"Anomaly at {self.nodes[code]}"
+                tool_tip = f"Anomaly at {name}"
             else:
-                tool_tip = f"Anomaly at {self.nodes[code]} since {spawn_stamp}"
+                tool_tip = f"Anomaly at {name} since {spawn_stamp}"
         else:
             status_str = "No anomaly currently present"
             if despawn_stamp is None:
@@ -268,6 +764,14 @@ class MainWindow(QWidget):
             else:
                 tool_tip = f"No anomaly since {despawn_stamp}"
 
+        prediction = self.predictions.get(platform)
+        if prediction is not None and not state:
+            from .predict import describe
+            prediction_str = describe(prediction)
+            tool_tip = f"{tool_tip}\n{prediction_str}"
+        else:
+            prediction_str = ""
+
         if spawn_stamp:
             spawn_str = spawn_stamp
         else:
@@ -280,8 +784,19 @@ class MainWindow(QWidget):
 
         self.ui.SpawnLabel.setText(spawn_str)
         self.ui.DespawnLabel.setText(despawn_str)
+        snapshot = self.snapshots.get(platform)
+        sections = snapshot and summary(snapshot)
+        if sections:
+            tool_tip = f"{tool_tip}\n{sections}"
+
         self.TrayIcon.setToolTip(tool_tip)
         self.ui.StatusLabel.setText(status_str)
+        self.ui.StatusLabel.setToolTip("\n".join(filter(None, (prediction_str, sections))))
+
+        if self.switch_started is not None and platform == self.current_platform:
+            metrics.observe("sentient_switch_seconds", time.monotonic() - self.switch_started,
+                            LAG_BUCKETS)
+            self.switch_started = None
 
     @pyqtSlot()
     def quit_save(self):
@@ -289,39 +804,24 @@ class MainWindow(QWidget):
         Gets the current settings from the UI and saves them to the config
         file then stops the QThread with the worker and closes the app
         '''
+        started = time.monotonic()
         self.quit_signal.emit()
+        # The worker cancels its requests so this doesn't take long
+        self.worker_thread.wait(2000)
+        metrics.set("sentient_shutdown_seconds", round(time.monotonic() - started, 4))
+        self.history.close()
+        if self.archive is not None:
+            self.archive.close()
+        if self.remote is not None:
+            self.remote.close()
+        self.sound_pool.shutdown(wait=False, cancel_futures=True)
+        self.dispatcher.close()
 
-        if self.ui.SoundCheckbox.checkState() == 2:
-            sounds = True
-        else:
-            sounds = False
-
-        if self.ui.MessagesCheckbox.checkState() == 2:
-            messages = True
-        else:
-            messages = False
-
-        if self.ui.TrayCheckbox.checkState() == 2:
-            tray = True
-        else:
-            tray = False
-
-        if self.ui.TrayhideCheckbox.checkState() == 2:
-            hide = True
-        else:
-            hide = False
-
-        platform = self.ui.PlatformCombobox.currentText()
-        settings = {"sounds": sounds,
-                    "messages": messages,
-                    "tray": tray,
-                    "hide": hide,
-                    "hide_shown": self.tray_close_shown,
-                    "platform": platform}
-
-        self.base_path.mkdir(parents=True, exist_ok=True)
-        with open(self.conf_path, "w") as f:
-            json.dump(settings, f, indent=4)
+        self.save_timer.stop()
+        self.save_settings()
+        if self.metrics_file:
+            metrics_module.write_file(self.base_path / self.metrics_file)
+        profiling.stop()
 
         QApplication.quit()
 
@@ -353,6 +853,7 @@ class MainWindow(QWidget):
                     self.icon,
                     2000)
                 self.tray_close_shown = True
+                self.settings_changed()
         else:
             self.quit_save()
 
@@ -366,18 +867,37 @@ class MainWindow(QWidget):
 
 class Worker(QObject):
     '''
-    Worker that lives in a QThread and checks the API every 60s
+    Worker that lives in a QThread and checks the API. The time between
+    checks comes from the PollScheduler or is a fixed 60s. The requests run
+    in a thread pool so the worker never blocks and stale requests can be
+    cancelled.
     '''
-    result = pyqtSignal(str)
+    # Platform, Snapshot or None if the check failed, time of the check
+    result = pyqtSignal(str, object, float)
+    # Platform, seconds until the next try and whether the circuit is open
+    retrying = pyqtSignal(str, float, bool)
+    # The platforms the hub checks
+    hub_platforms = pyqtSignal(object)
+    schedule_changed = pyqtSignal(str)
+    # Finished requests from the pool threads back to the worker thread
+    fetched = pyqtSignal(str, object, float)
 
     def __init__(self):
         super().__init__()
-        self.session = requests.Session()
-        self.base_url = "http://content{}.warframe.com/dynamic/worldState.php"
+        self.fetcher = Fetcher()
+        self.pool = ThreadPoolExecutor(max_workers=len(self.fetcher.platforms))
+        self.coordinator = Coordinator(self.fetcher, self.pool,
+                                       shared=SharedCache(base_path() / "cache"))
+        # Last value sent to the window for every platform
+        self.sent = {}
         self.current_platform = "PC"
-        self.platforms = {"PC": "",
-                          "PS4": ".ps4",
-                          "XB1": ".xb1"}
+        self.all_platforms = False
+        self.adaptive = True
+        self.scheduler = PollScheduler()
+        self.fetched.connect(self.handle_result)
+        self.hub_url = ""
+        self.subscription = None
+        self.stopped = threading.Event()
 
     @pyqtSlot(str)
     def set_platform(self, platform):
@@ -385,13 +905,75 @@ class Worker(QObject):
         Changes the currently selected platform. Uses slots to avoid any
         problems with threads.
         '''
+        # The window resets the state so the value has to be sent again
+        self.sent.pop(platform, None)
+        if not self.all_platforms and platform != self.current_platform:
+            self.coordinator.cancel(self.current_platform)
+            self.scheduler.forget(self.current_platform)
         self.current_platform = platform
 
+    @pyqtSlot(bool)
+    def set_all_platforms(self, value):
+        '''
+        Switches between checking only the current platform and all of them
+        '''
+        self.all_platforms = value
+
+    @pyqtSlot(bool)
+    def set_adaptive(self, value):
+        '''
+        Switches between the adaptive schedule and a fixed 60s interval
+        '''
+        self.adaptive = value
+
+    @pyqtSlot(float, float, int, float)
+    def set_limits(self, cache_seconds, requests_per_minute, burst, shared_cache_seconds):
+        '''
+        Sets how long results are reused and how many requests can be made
+        '''
+        self.coordinator.max_age = cache_seconds
+        self.coordinator.bucket.rate = requests_per_minute / 60
+        self.coordinator.bucket.burst = burst
+        if shared_cache_seconds and self.coordinator.shared is None:
+            self.coordinator.shared = SharedCache(base_path() / "cache", shared_cache_seconds)
+        elif shared_cache_seconds:
+            self.coordinator.shared.ttl = shared_cache_seconds
+        else:
+            self.coordinator.shared = None
+
+    @pyqtSlot(object)
+    def set_sections(self, sections):
+        '''
+        Changes the tracked world state sections besides the anomaly, the
+        next checks get the whole snapshots
+        '''
+        self.fetcher.set_sections(sections)
+        with self.coordinator.lock:
+            self.coordinator.recent.clear()
+        self.sent.clear()
+
+    @pyqtSlot(str)
+    def set_hub(self, url):
+        '''
+        Gets the states pushed by the hub at url instead of checking
+        '''
+        self.hub_url = url
+        self.timer.stop()
+        self.pool.submit(self.listen)
+
+    @pyqtSlot(str, object, object)
+    def set_prediction(self, platform, start, end):
+        '''
+        Passes the predicted spawn window to the scheduler
+        '''
+        self.scheduler.predict(platform, start, end)
+
     @pyqtSlot()
     def start_worker(self):
         '''
         Creates and starts the worker
         '''
+        profiling.thread_started("worker")
         self.timer = QTimer()
         self.timer.setInterval(60000)
         self.timer.timeout.connect(self.get_data)
@@ -400,27 +982,150 @@ class Worker(QObject):
     @pyqtSlot()
     def stop_worker(self):
         self.timer.stop()
+        self.stopped.set()
+        if self.subscription is not None:
+            self.subscription.close()
+        self.coordinator.cancel_all()
+        self.pool.shutdown(wait=False, cancel_futures=True)
         self.thread().quit()
 
+    def platforms(self):
+        '''
+        The platforms that are checked
+        '''
+        if self.all_platforms:
+            return list(self.fetcher.platforms)
+        return [self.current_platform]
+
     @pyqtSlot()
     def get_data(self):
         '''
-        Gets the data and emits a signal
+        Starts the requests, handle_result emits a signal for every changed
+        result. When all platforms are checked the requests are done at the
+        same time.
         '''
-        url = self.base_url.format(self.platforms[self.current_platform])
+        if self.hub_url:
+            return
+        for platform in self.platforms():
+            future = self.coordinator.request(platform)
+            # The time is used for the detection lag
+            future.add_done_callback(
+                lambda future, platform=platform:
+                    self.fetched.emit(platform, future, time.monotonic()))
+        self.reschedule()
+
+    @pyqtSlot(str, object, float)
+    def handle_result(self, platform, future, received):
+        '''
+        Emits the result of a finished request if it changed
+        '''
+        if future.cancelled():
+            return
         try:
-            r = self.session.get(url, timeout=5)
-            r.raise_for_status()
-        except requests.exceptions.RequestException as e:
+            snapshot = future.result()
+        except Cancelled:
+            return
+        except RetryLater as e:
             print(e)
-            self.result.emit("Error")
+            self.sent.pop(platform, None)
+            self.scheduler.forget(platform)
+            self.retrying.emit(platform, e.retry_in, e.circuit_open)
+            self.reschedule()
+        except FetchError as e:
+            print(e)
+            self.sent.pop(platform, None)
+            self.scheduler.forget(platform)
+            self.result.emit(platform, None, received)
         else:
-            worldstate = r.json()
-            spawn = worldstate["Tmp"]
-            self.result.emit(spawn)
+            if snapshot == self.sent.get(platform):
+                return
+            self.sent[platform] = snapshot
+            self.scheduler.observe(platform, snapshot.node is not None)
+            self.result.emit(platform, snapshot, received)
+            self.reschedule()
+
+    def listen(self):
+        '''
+        Runs in the pool and emits the states pushed by the hub. Reconnects
+        with the breaker's backoff when the connection fails.
+        '''
+        breaker = self.coordinator.breaker
+        while not self.stopped.is_set():
+            self.subscription = Subscription(self.hub_url, self.fetcher.session)
+            try:
+                for event, data in self.subscription.events():
+                    breaker.success("hub")
+                    if event == "tmp":
+                        self.result.emit(data["platform"], Snapshot.from_dict(data),
+                                         time.monotonic())
+                    elif event == "error":
+                        self.retrying.emit(data["platform"], data["retry_in"],
+                                           data["circuit_open"])
+                    elif event == "platforms":
+                        self.hub_platforms.emit(data["platforms"])
+                error = "connection closed"
+            except (OSError, ValueError) as e:
+                # requests' exceptions are OSErrors
+                error = e
+            if self.stopped.is_set():
+                break
+
+            retry_in, circuit_open = breaker.failure("hub")
+            print(f"Hub: {error}, retrying in {retry_in:.0f}s")
+            for platform in self.fetcher.platforms:
+                self.retrying.emit(platform, retry_in, circuit_open)
+            self.stopped.wait(retry_in)
+
+    def reschedule(self):
+        '''
+        Restarts the timer with the interval for the checked platforms
+        '''
+        platforms = self.platforms()
+        breaker = self.coordinator.breaker
+        retries = [breaker.retry_in(platform) for platform in platforms]
+        # Backed off platforms are checked again when they are allowed to
+        waiting = [retry for retry in retries if retry]
+        platforms = [platform for platform, retry in zip(platforms, retries) if not retry]
+
+        tool_tip = []
+        if not platforms:
+            interval = None
+        elif self.adaptive:
+            interval = self.scheduler.next_interval(platforms)
+            tool_tip.append(self.scheduler.describe(platforms))
+        else:
+            interval = 60
+        if waiting:
+            interval = min(math.ceil(min(waiting)), interval or math.inf)
+        self.timer.start(interval * 1000)
+
+        for platform in self.platforms():
+            bandwidth = self.fetcher.bandwidth[platform]
+            if bandwidth["decoded"]:
+                tool_tip.append(f"{platform}: {size_text(bandwidth['wire'])} downloaded "
+                                f"({size_text(bandwidth['decoded'])} decoded)")
+        self.schedule_changed.emit("\n".join(tool_tip))
 
 
 def main():
+    if getattr(sys, "frozen", False):
+        # The fetch process of the .exe, see remote.py
+        import multiprocessing
+        multiprocessing.freeze_support()
+    # --profile[=SPEC] is the same as SENTIENT_PROFILE=SPEC
+    spec = None
+    for arg in sys.argv[1:]:
+        if arg == "--profile" or arg.startswith("--profile="):
+            spec = arg.partition("=")[2] or "1"
+            sys.argv.remove(arg)
+            break
+    try:
+        profiler = profiling.from_environment(base_path() / "profile", spec)
+    except ValueError as e:
+        sys.exit(f"Profiling: {e}")
+    if profiler is not None:
+        profiler.wrap(MainWindow, ("update_text", "reload_files", "save_settings"))
+        profiler.wrap(Worker, ("reschedule",))
     app = QApplication(sys.argv)
     mainwindow = MainWindow()
     mainwindow.show()
@@ -0,0 +1,198 @@
+'''
+Counters, gauges and histograms of the tracker in the Prometheus text
+format. They can be served on localhost or written to a file periodically.
+'''
+import bisect
+import threading
+import time
+from .config import atomic_write
+
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (1024, 16384, 65536, 262144, 524288, 1048576, 4194304)
+PARSE_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1)
+LAG_BUCKETS = (0.001, 0.01, 0.05, 0.1, 0.5, 1, 5)
+
+HELP = {
+    "sentient_request_seconds": "Time of the world state requests",
+    "sentient_response_bytes": "Decoded bytes read per world state response",
+    "sentient_wire_bytes": "Bytes on the wire per world state response",
+    "sentient_wire_bytes_total": "Body bytes received for the world state, compressed",
+    "sentient_decoded_bytes_total": "Body bytes of the world state after decompression",
+    "sentient_encoding_total": "World state responses by content encoding",
+    "sentient_parse_seconds": "Time spent extracting the Tmp value",
+    "sentient_errors_total": "Failed checks by error type",
+    "sentient_last_success_timestamp_seconds": "Unix time of the last successful check",
+    "sentient_seconds_since_last_success": "Seconds since the last successful check",
+    "sentient_detection_lag_seconds": "Time from the check that saw a change to the notification",
+    "sentient_alert_seconds": "Time from starting an alert sound to it playing",
+    "sentient_alert_lag_seconds": "Time from the check that saw a change to its alert sound playing",
+    "sentient_notification_seconds": "Time from the check to the notification being delivered by a sink",
+    "sentient_notifications_total": "Notifications by sink and result",
+    "sentient_switch_seconds": "Time from a platform change to its status being shown",
+    "sentient_shutdown_seconds": "Time the worker took to stop when quitting",
+    "sentient_circuit_state": "Circuit breaker state, 0 closed, 0.5 half-open, 1 open",
+    "sentient_circuit_opened_total": "Times the circuit breaker opened",
+    "sentient_slow_slots_total": "Qt slots slower than the profiling threshold",
+    "sentient_fetch_process_restarts_total": "Times the fetch process was started again",
+}
+
+
+def labels_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    '''
+    Thread safe collection of metrics. Labels are passed as keyword arguments.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        '''
+        Sets a gauge, value can be a function called when rendering
+        '''
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.gauges[key] = value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def render(self):
+        '''
+        Returns everything in the Prometheus text format
+        '''
+        lines = []
+        described = set()
+
+        def describe(name, kind):
+            if name not in described:
+                described.add(name)
+                if name in HELP:
+                    lines.append(f"# HELP {name} {HELP[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        with self.lock:
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items(), key=lambda item: item[0])
+            histograms = sorted(((key, (histogram.buckets, list(histogram.counts),
+                                        histogram.sum, histogram.count))
+                                 for key, histogram in self.histograms.items()),
+                                key=lambda item: item[0])
+
+        for (name, labels), value in counters:
+            describe(name, "counter")
+            lines.append(f"{name}{labels_text(labels)} {value}")
+        for (name, labels), value in gauges:
+            if callable(value):
+                value = value()
+            if value is None:
+                continue
+            describe(name, "gauge")
+            lines.append(f"{name}{labels_text(labels)} {value}")
+        for (name, labels), (buckets, counts, total, count) in histograms:
+            describe(name, "histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                bucket_labels = labels + (("le", bound),)
+                lines.append(f"{name}_bucket{labels_text(bucket_labels)} {cumulative}")
+            lines.append(f"{name}_sum{labels_text(labels)} {total}")
+            lines.append(f"{name}_count{labels_text(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def success(self, platform):
+        '''
+        Records a successful check of the platform
+        '''
+        now = time.time()
+        self.set("sentient_last_success_timestamp_seconds", now, platform=platform)
+        self.set("sentient_seconds_since_last_success",
+                 lambda: round(time.time() - now, 3),
+                 platform=platform)
+
+
+# Shared by everything in the process
+metrics = Metrics()
+
+
+def serve(port, host="127.0.0.1"):
+    '''
+    Serves /metrics on localhost in a daemon thread, returns the server
+    '''
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+
+def write_file(path):
+    '''
+    Writes the metrics to the file, replaced atomically so readers never see
+    a partial file
+    '''
+    atomic_write(path, metrics.render())
+
+
+def write_periodically(path, interval=15):
+    '''
+    Writes the metrics file every interval seconds from a daemon thread
+    '''
+    def run():
+        while True:
+            try:
+                write_file(path)
+            except OSError as e:
+                print(e)
+            time.sleep(interval)
+    threading.Thread(target=run, name="metrics-file", daemon=True).start()
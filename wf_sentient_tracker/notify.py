@@ -0,0 +1,274 @@
+'''
+Notification pipeline. Every spawn/despawn event is handed to the
+Dispatcher which passes it to all its sinks. Sinks that can block (commands,
+webhooks, log files) run in their own thread with a bounded queue, deliver
+in batches and have a timeout, so a slow one can't hold up the others or
+the window. Inline sinks (the tray message and the sound in the window)
+are called right away because they only start something in Qt.
+'''
+import os
+import queue
+import shlex
+import subprocess
+import threading
+import time
+from .metrics import metrics, LAG_BUCKETS
+from .tracker import node_name
+
+
+def describe(event):
+    '''
+    Text for an event
+    '''
+    if event.kind == "spawn":
+        return f"{event.platform}: anomaly present at {node_name(event.node)}"
+    elif event.kind == "despawn":
+        if event.duration is None:
+            return f"{event.platform}: anomaly despawned"
+        minutes = round(event.duration.total_seconds() / 60)
+        return f"{event.platform}: anomaly despawned after {minutes}min"
+    return f"{event.platform}: no anomaly"
+
+
+def event_dict(event):
+    return {"platform": event.platform,
+            "kind": event.kind,
+            "node": event.node,
+            "node_name": None if event.node is None else node_name(event.node),
+            "time": event.time.isoformat(timespec="seconds"),
+            "observed": event.observed,
+            "duration": None if event.duration is None else event.duration.total_seconds()}
+
+
+def event_env(event):
+    '''
+    Environment of the hook commands
+    '''
+    return dict(os.environ,
+                SENTIENT_EVENT=event.kind,
+                SENTIENT_PLATFORM=event.platform,
+                SENTIENT_NODE="" if event.node is None else str(event.node),
+                SENTIENT_NODE_NAME="" if event.node is None else node_name(event.node),
+                SENTIENT_TIME=event.time.isoformat(timespec="seconds"),
+                SENTIENT_OBSERVED="1" if event.observed else "0")
+
+
+class Sink:
+    '''
+    Receives the events. deliver() gets a list of events and the
+    time.monotonic() of their checks and raises on failure. Inline sinks are called by dispatch() directly, the others get
+    a thread, a queue of queue_size events and at most batch events per call.
+    Only the events of the kinds are passed, None is all of them.
+    '''
+    inline = False
+    queue_size = 32
+    batch = 16
+    kinds = ("spawn", "despawn")
+
+    def __init__(self, name, timeout=5):
+        self.name = name
+        self.timeout = timeout
+
+    def deliver(self, events, received):
+        raise NotImplementedError
+
+
+class CallbackSink(Sink):
+    '''
+    Calls function(events, received), inline by default. Gets every event.
+    '''
+    kinds = None
+
+    def __init__(self, name, function, inline=True, timeout=5):
+        super().__init__(name, timeout)
+        self.function = function
+        self.inline = inline
+
+    def deliver(self, events, received):
+        self.function(events, received)
+
+
+class LogSink(Sink):
+    '''
+    Appends a line for every event to a file
+    '''
+
+    def __init__(self, path, timeout=5):
+        super().__init__("log", timeout)
+        self.path = path
+
+    def deliver(self, events, received):
+        stamp = time.strftime("%Y-%m-%d %H:%M:%S")
+        with open(self.path, "a") as f:
+            f.write("".join(f"{stamp} {describe(event)}\n" for event in events))
+
+
+class CommandSink(Sink):
+    '''
+    Runs a command for every event with the SENTIENT_* environment
+    variables, it's killed after the timeout. Raises ValueError if the
+    command is empty or can't be split.
+    '''
+    # So a command that times out only fails its own event
+    batch = 1
+
+    def __init__(self, command, timeout=10):
+        self.args = shlex.split(command)
+        if not self.args:
+            raise ValueError("empty command")
+        super().__init__(f"command:{self.args[0]}", timeout)
+        self.command = command
+
+    def deliver(self, events, received):
+        for event in events:
+            process = subprocess.Popen(self.args, env=event_env(event))
+            try:
+                process.wait(self.timeout)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+                raise
+            if process.returncode:
+                raise OSError(f"exited with {process.returncode}")
+
+
+class WebhookSink(Sink):
+    '''
+    POSTs the batch of events as a JSON list to the URL
+    '''
+
+    def __init__(self, url, timeout=5):
+        super().__init__(f"webhook:{url}", timeout)
+        self.url = url
+        self.session = None
+
+    def deliver(self, events, received):
+        if self.session is None:
+            import requests
+            self.session = requests.Session()
+        response = self.session.post(self.url, json=[event_dict(event) for event in events],
+                                     timeout=self.timeout)
+        response.raise_for_status()
+
+
+class Dispatcher:
+    '''
+    Hands every event to all the sinks and keeps delivery stats per sink
+    '''
+
+    def __init__(self, sinks=()):
+        self.sinks = []
+        # Sink: its queue
+        self.queues = {}
+        self.threads = []
+        self.lock = threading.Lock()
+        self.stats = {}
+        for sink in sinks:
+            self.add(sink)
+
+    def add(self, sink):
+        '''
+        Adds the sink, a number is added to its name if another sink has
+        the same one (two hooks running sh) so the stats stay apart
+        '''
+        names = {other.name for other in self.sinks}
+        name = sink.name
+        number = 1
+        while sink.name in names:
+            number += 1
+            sink.name = f"{name}#{number}"
+        self.sinks.append(sink)
+        self.stats[sink.name] = {"delivered": 0, "failed": 0, "timeouts": 0,
+                                 "dropped": 0, "batches": 0}
+        if not sink.inline:
+            self.queues[sink] = queue.Queue(sink.queue_size)
+            thread = threading.Thread(target=self.run, args=(sink,),
+                                      name=f"notify-{sink.name}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def remove(self, sink):
+        '''
+        Stops passing events to the sink, its thread ends after the batch it's
+        delivering and the queued events are dropped
+        '''
+        self.sinks.remove(sink)
+        sink_queue = self.queues.pop(sink, None)
+        if sink_queue is not None:
+            with sink_queue.mutex:
+                sink_queue.queue.clear()
+            sink_queue.put_nowait(None)
+
+    def count(self, sink, name, amount=1):
+        with self.lock:
+            self.stats[sink.name][name] += amount
+        metrics.inc("sentient_notifications_total", amount, sink=sink.name, result=name)
+
+    def dispatch(self, event, received=None):
+        '''
+        Passes the event to the sinks. received is the time.monotonic() of
+        the check, the latency is measured from it if given.
+        '''
+        item = (event, received or time.monotonic())
+        for sink in self.sinks:
+            if sink.kinds is not None and event.kind not in sink.kinds:
+                continue
+            if sink.inline:
+                self.deliver(sink, [item])
+                continue
+            try:
+                self.queues[sink].put_nowait(item)
+            except queue.Full:
+                self.count(sink, "dropped")
+
+    def deliver(self, sink, items):
+        self.count(sink, "batches")
+        try:
+            sink.deliver([event for event, _ in items], [received for _, received in items])
+        except Exception as e:
+            # subprocess.TimeoutExpired, requests' Timeout and ReadTimeout...
+            if "Timeout" in type(e).__name__:
+                print(f"Notification {sink.name} timed out: {e}")
+                self.count(sink, "timeouts", len(items))
+            else:
+                print(f"Notification {sink.name} failed: {e}")
+                self.count(sink, "failed", len(items))
+            return
+        now = time.monotonic()
+        for _, received in items:
+            metrics.observe("sentient_notification_seconds", now - received, LAG_BUCKETS,
+                            sink=sink.name)
+        self.count(sink, "delivered", len(items))
+
+    def run(self, sink):
+        sink_queue = self.queues[sink]
+        while True:
+            item = sink_queue.get()
+            if item is None:
+                return
+            items = [item]
+            # Everything that piled up while the last batch was delivered
+            while len(items) < sink.batch:
+                try:
+                    item = sink_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self.deliver(sink, items)
+                    return
+                items.append(item)
+            self.deliver(sink, items)
+
+    def close(self, timeout=2):
+        '''
+        Lets the threaded sinks finish what they have, waits up to timeout
+        seconds in total
+        '''
+        deadline = time.monotonic() + timeout
+        for sink_queue in self.queues.values():
+            try:
+                sink_queue.put(None, timeout=max(0, deadline - time.monotonic()))
+            except queue.Full:
+                pass
+        for thread in self.threads:
+            thread.join(max(0, deadline - time.monotonic()))
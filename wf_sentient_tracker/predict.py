@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+'''
+Predicts the next spawn window and node from the recorded history. Needs
+numpy (pip install wf-sentient-tracker[predict]), available() is False
+without it.
+
+Run as a module to check the predictions against the recorded history:
+
+    python -m wf_sentient_tracker.predict --evaluate
+'''
+import argparse
+import json
+from collections import namedtuple
+from datetime import datetime
+from .tracker import PLATFORMS, node_name
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# Longer intervals mean the tracker wasn't running in between
+MAX_INTERVAL = 6 * 3600
+# Less intervals than this aren't enough for a window
+MIN_SAMPLES = 3
+# Less spawns after a node than this fall back to the overall frequency
+MIN_TRANSITIONS = 5
+QUANTILES = (5, 50, 95)
+
+Prediction = namedtuple("Prediction", ["start", "end", "expected", "node", "chance", "samples"])
+
+
+def available():
+    return np is not None
+
+
+class Model:
+    '''
+    Interval distributions and node frequencies of one platform
+    '''
+    __slots__ = ("spawn_to_spawn", "despawn_to_spawn", "codes", "counts",
+                 "transitions", "last_spawn", "last_despawn", "last_node")
+
+
+def intervals(spawn_times, despawn_times):
+    '''
+    Returns the spawn to spawn and despawn to spawn intervals in seconds.
+    Both arrays have to be sorted.
+    '''
+    spawn_to_spawn = np.diff(spawn_times)
+    spawn_to_spawn = spawn_to_spawn[(spawn_to_spawn > 0) & (spawn_to_spawn < MAX_INTERVAL)]
+
+    previous = np.searchsorted(despawn_times, spawn_times) - 1
+    valid = previous >= 0
+    despawn_to_spawn = spawn_times[valid] - despawn_times[previous[valid]]
+    despawn_to_spawn = despawn_to_spawn[despawn_to_spawn < MAX_INTERVAL]
+    return spawn_to_spawn, despawn_to_spawn
+
+
+def quantiles(values):
+    if len(values) < MIN_SAMPLES:
+        return None
+    return tuple(np.percentile(values, QUANTILES)) + (len(values),)
+
+
+def fit(rows):
+    '''
+    Fits a Model to (time, is_spawn, node, observed) rows sorted by time,
+    see History.columns. Returns None if there are no rows.
+    '''
+    if not rows:
+        return None
+    data = np.array(rows, dtype=float)
+    times = data[:, 0]
+    spawns = data[:, 1] == 1
+    observed = data[:, 3] == 1
+
+    spawn_times = times[spawns & observed]
+    despawn_times = times[~spawns]
+    spawn_to_spawn, despawn_to_spawn = intervals(spawn_times, despawn_times)
+
+    spawn_nodes = data[spawns, 2]
+    spawn_nodes = spawn_nodes[~np.isnan(spawn_nodes)].astype(int)
+    codes, index, counts = np.unique(spawn_nodes, return_inverse=True, return_counts=True)
+    size = len(codes)
+    transitions = np.bincount(index[:-1] * size + index[1:],
+                              minlength=size * size).reshape(size, size)
+
+    model = Model()
+    model.spawn_to_spawn = quantiles(spawn_to_spawn)
+    model.despawn_to_spawn = quantiles(despawn_to_spawn)
+    model.codes = codes
+    model.counts = counts
+    model.transitions = transitions
+    model.last_spawn = spawn_times[-1] if len(spawn_times) else None
+    model.last_despawn = despawn_times[-1] if len(despawn_times) else None
+    model.last_node = int(spawn_nodes[-1]) if len(spawn_nodes) else None
+    return model
+
+
+def likely_node(model, last_node):
+    '''
+    Returns the most likely next node and its chance
+    '''
+    if not len(model.codes):
+        return None, None
+    counts = model.counts
+    if last_node is not None:
+        row = np.searchsorted(model.codes, last_node)
+        if row < len(model.codes) and model.codes[row] == last_node \
+                and model.transitions[row].sum() >= MIN_TRANSITIONS:
+            counts = model.transitions[row]
+    best = int(np.argmax(counts))
+    return int(model.codes[best]), float(counts[best] / counts.sum())
+
+
+def predict(model, spawn=None, despawn=None, node=None):
+    '''
+    Predicts the next spawn. spawn/despawn are the last known datetimes and
+    node the last node, they override what's in the model when newer.
+    '''
+    if model is None:
+        return None
+    last_spawn = model.last_spawn
+    if spawn is not None and (last_spawn is None or spawn.timestamp() > last_spawn):
+        last_spawn = spawn.timestamp()
+    last_despawn = model.last_despawn
+    if despawn is not None and (last_despawn is None or despawn.timestamp() > last_despawn):
+        last_despawn = despawn.timestamp()
+    if node is None:
+        node = model.last_node
+
+    if last_despawn is not None and model.despawn_to_spawn is not None \
+            and (last_spawn is None or last_despawn >= last_spawn):
+        base = last_despawn
+        low, middle, high, samples = model.despawn_to_spawn
+    elif last_spawn is not None and model.spawn_to_spawn is not None:
+        base = last_spawn
+        low, middle, high, samples = model.spawn_to_spawn
+    else:
+        return None
+
+    code, chance = likely_node(model, node)
+    return Prediction(datetime.fromtimestamp(base + low),
+                      datetime.fromtimestamp(base + high),
+                      datetime.fromtimestamp(base + middle),
+                      code,
+                      chance,
+                      samples)
+
+
+def describe(prediction):
+    '''
+    Short text for the labels
+    '''
+    text = f"Next spawn {prediction.start:%H:%M} - {prediction.end:%H:%M}"
+    if prediction.node is not None:
+        text += f" (likely {node_name(prediction.node)}, {prediction.chance:.0%})"
+    return text
+
+
+class Predictor:
+    '''
+    Keeps a fitted Model for every platform of a History
+    '''
+
+    def __init__(self, history):
+        self.history = history
+        self.models = {}
+
+    def refit(self, platform):
+        self.models[platform] = fit(self.history.columns(platform))
+
+    def predict(self, platform, spawn=None, despawn=None, node=None):
+        if platform not in self.models:
+            self.refit(platform)
+        return predict(self.models[platform], spawn, despawn, node)
+
+
+def evaluate(rows, split=0.5):
+    '''
+    Fits a model to the first part of the rows and checks its predictions
+    for every observed spawn in the rest. Returns a dict with the results.
+    '''
+    if not rows:
+        return None
+    data = np.array(rows, dtype=float)
+    cut = int(len(data) * split)
+    model = fit(rows[:cut])
+    if model is None or model.despawn_to_spawn is None:
+        return None
+    low, middle, high, _ = model.despawn_to_spawn
+
+    times = data[:, 0]
+    spawns = data[:, 1] == 1
+    observed = data[:, 3] == 1
+    test = np.arange(len(data)) >= cut
+
+    # Every tested spawn is predicted from the despawn before it
+    despawn_times = times[~spawns]
+    spawn_times = times[spawns & observed & test]
+    previous = np.searchsorted(despawn_times, spawn_times) - 1
+    valid = previous >= 0
+    spawn_times = spawn_times[valid]
+    base = despawn_times[previous[valid]]
+    keep = spawn_times - base < MAX_INTERVAL
+    spawn_times = spawn_times[keep]
+    base = base[keep]
+    if not len(spawn_times):
+        return None
+
+    error = (spawn_times - (base + middle)) / 60
+    inside = (spawn_times >= base + low) & (spawn_times <= base + high)
+
+    # Node predictions from the node of the previous spawn, the guess only
+    # depends on the previous node so it's looked up from a table
+    nodes = data[spawns, 2]
+    in_test = test[spawns][1:]
+    previous_nodes = nodes[:-1][in_test]
+    actual = nodes[1:][in_test]
+    known = ~np.isnan(previous_nodes) & ~np.isnan(actual)
+    previous_nodes = previous_nodes[known].astype(int)
+    actual = actual[known].astype(int)
+    seen = np.unique(previous_nodes)
+    guesses = np.array([likely_node(model, int(code))[0] for code in seen])
+    hits = guesses[np.searchsorted(seen, previous_nodes)] == actual if len(seen) else None
+
+    return {"spawns": int(len(spawn_times)),
+            "mean_abs_error_min": round(float(np.mean(np.abs(error))), 2),
+            "median_abs_error_min": round(float(np.median(np.abs(error))), 2),
+            "mean_error_min": round(float(np.mean(error)), 2),
+            "window_coverage": round(float(np.mean(inside)), 3),
+            "window_width_min": round(float(high - low) / 60, 1),
+            "node_accuracy": round(float(np.mean(hits)), 3) if hits is not None else None}
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m wf_sentient_tracker.predict",
+        description="Spawn predictions from the recorded history")
+    parser.add_argument("--history", help="history file (default: history.sqlite3 in the config directory)")
+    parser.add_argument("-p", "--platform", action="append", choices=PLATFORMS)
+    parser.add_argument("--evaluate", action="store_true",
+                        help="check the predictions against the recorded history")
+    parser.add_argument("--split", type=float, default=0.5,
+                        help="part of the history used for fitting when evaluating")
+    args = parser.parse_args(args)
+
+    if not available():
+        parser.error("numpy is needed for predictions")
+
+    from .config import base_path
+    from .history import History
+    history = History(args.history or base_path() / "history.sqlite3")
+    platforms = args.platform or PLATFORMS
+
+    report = {}
+    for platform in platforms:
+        if args.evaluate:
+            report[platform] = evaluate(history.columns(platform), args.split)
+        else:
+            prediction = Predictor(history).predict(platform)
+            report[platform] = prediction and {
+                "start": prediction.start.isoformat(timespec="seconds"),
+                "end": prediction.end.isoformat(timespec="seconds"),
+                "expected": prediction.expected.isoformat(timespec="seconds"),
+                "node": prediction.node and node_name(prediction.node),
+                "chance": prediction.chance,
+                "samples": prediction.samples}
+    history.close()
+    print(json.dumps(report, indent=4))
+
+
+if __name__ == "__main__":
+    main()
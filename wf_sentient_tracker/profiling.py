@@ -0,0 +1,271 @@
+'''
+Opt-in profiling for when a tracker gets sluggish. Turned on with the
+SENTIENT_PROFILE environment variable or --profile, otherwise nothing here
+is used. The value is a comma separated list of:
+
+    sample[=MS]     samples the stacks of all threads every MS (5) ms
+    cprofile        cProfile of every thread (the window, the worker and the
+                    request threads)
+    memory[=S]      tracemalloc snapshot every S (60) seconds
+    slow[=MS]       warns about Qt slots taking longer than MS (50) ms
+
+"1" is sample,memory,slow. The reports are written to the profile
+directory in the config directory when the tracker quits:
+
+    *-stacks.txt    sampled stacks in the folded format of flamegraph.pl
+                    and speedscope, one line per thread and stack
+    *-THREAD.pstats cProfile stats (python -m pstats), with a .txt summary
+    *-memory.txt    biggest allocations and their growth since the start
+    *-slow.txt      slots that were slow, with their times
+'''
+import cProfile
+import functools
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from .metrics import metrics
+
+
+DEFAULTS = {"sample": 5, "cprofile": True, "memory": 60, "slow": 50}
+# The running Profiler, None if profiling is off
+active = None
+
+
+def options(spec):
+    '''
+    Parses the SENTIENT_PROFILE value into {name: value}
+    '''
+    if spec.strip().lower() in ("1", "on", "yes", "true"):
+        spec = "sample,memory,slow"
+    result = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, value = item.partition("=")
+        if name not in DEFAULTS:
+            raise ValueError(f"unknown profiling option {name!r}")
+        result[name] = float(value) if value else DEFAULTS[name]
+    return result
+
+
+def from_environment(directory, spec=None):
+    '''
+    Starts the Profiler asked for by spec or SENTIENT_PROFILE, returns None
+    if profiling is off
+    '''
+    global active
+    spec = spec if spec is not None else os.environ.get("SENTIENT_PROFILE", "")
+    if not spec:
+        return None
+    active = Profiler(directory, **options(spec))
+    active.start()
+    return active
+
+
+def thread_started(name):
+    '''
+    Called by threads that aren't started by the threading module (QThread)
+    so they are named and profiled
+    '''
+    if active is not None:
+        active.thread_started(name)
+
+
+def stop():
+    if active is not None:
+        active.stop()
+
+
+class Profiler:
+    def __init__(self, directory, sample=None, cprofile=False, memory=None, slow=None):
+        self.directory = directory
+        self.sample_interval = sample and sample / 1000
+        self.cprofile = cprofile
+        self.memory_interval = memory
+        self.slow = slow and slow / 1000
+        self.prefix = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        # Thread ident: name
+        self.names = {}
+        self.stacks = Counter()
+        self.profiles = {}
+        self.slot_profiles = {}
+        self.local = threading.local()
+        self.slow_calls = []
+        self.memory_baseline = None
+        self.threads = []
+
+    def path(self, suffix):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        return self.directory / f"{self.prefix}-{suffix}"
+
+    def start(self):
+        self.profile_thread(threading.current_thread().name)
+        if self.memory_interval:
+            import tracemalloc
+            tracemalloc.start(10)
+            self.memory_baseline = tracemalloc.take_snapshot()
+            self.run(self.watch_memory, "profile-memory")
+        if self.sample_interval:
+            self.run(self.sample, "profile-sample")
+        if self.cprofile:
+            # Threads started from now on get their own profile
+            threading.setprofile(self.profile_new_thread)
+        print(f"Profiling, the reports are written to {self.directory}")
+
+    def run(self, target, name):
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def profile_thread(self, name):
+        ident = threading.get_ident()
+        with self.lock:
+            self.names[ident] = name
+        if self.cprofile and ident not in self.profiles:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Python 3.12+ only allows one cProfile at a time
+                return None
+            with self.lock:
+                self.profiles[ident] = profile
+        return self.profiles.get(ident)
+
+    def thread_started(self, name):
+        # Qt drops the Python thread state of its threads between calls so
+        # their profile is enabled again in every wrapped slot
+        profile = self.profile_thread(name)
+        if profile is not None:
+            self.slot_profiles[threading.get_ident()] = profile
+
+    def profile_new_thread(self, frame, event, arg):
+        # Installed in every new thread by threading.setprofile, replaced by
+        # the thread's cProfile on the first call
+        sys.setprofile(None)
+        self.profile_thread(threading.current_thread().name)
+
+    def wrap(self, cls, names=()):
+        '''
+        Times the Qt slots of cls and the methods in names, calls slower than
+        the threshold are reported. Has to be done before cls is used.
+        '''
+        if not self.slow and not self.cprofile:
+            return
+        for name, function in list(vars(cls).items()):
+            if callable(function) and (name in names or hasattr(function, "__pyqtSignature__")):
+                setattr(cls, name, self.timed(function, f"{cls.__name__}.{name}"))
+
+    def timed(self, function, name):
+        # functools.wraps copies __pyqtSignature__ so it stays a slot
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            profile = self.slot_profiles.get(threading.get_ident())
+            depth = getattr(self.local, "depth", 0)
+            if profile is not None and not depth:
+                profile.enable()
+            self.local.depth = depth + 1
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                took = time.perf_counter() - started
+                self.local.depth = depth
+                if profile is not None and not depth:
+                    profile.disable()
+                if self.slow and took > self.slow:
+                    self.slow_slot(name, took)
+        return timed
+
+    def slow_slot(self, name, took):
+        thread = self.names.get(threading.get_ident(), "?")
+        print(f"Slow slot: {name} took {took * 1000:.1f}ms in {thread}")
+        metrics.inc("sentient_slow_slots_total", slot=name)
+        with self.lock:
+            self.slow_calls.append((time.time(), thread, name, took))
+
+    def sample(self):
+        own = threading.get_ident()
+        while not self.stopped.wait(self.sample_interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            names.update(self.names)
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:"
+                                 f"{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, f"thread-{ident}"))
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def watch_memory(self):
+        while not self.stopped.wait(self.memory_interval):
+            self.write_memory()
+
+    def write_memory(self):
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            return
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"{time.strftime('%H:%M:%S')} traced {current / 1024:.0f} KiB, "
+                 f"peak {peak / 1024:.0f} KiB",
+                 "Biggest:"]
+        lines += [f"    {stat}" for stat in snapshot.statistics("lineno")[:15]]
+        lines.append("Growth since the start:")
+        lines += [f"    {stat}" for stat in
+                  snapshot.compare_to(self.memory_baseline, "lineno")[:15]]
+        with open(self.path("memory.txt"), "a") as f:
+            f.write("\n".join(lines) + "\n\n")
+
+    def stop(self):
+        '''
+        Stops profiling and writes the reports
+        '''
+        global active
+        if self.stopped.is_set():
+            return
+        self.stopped.set()
+        threading.setprofile(None)
+        for thread in self.threads:
+            thread.join(1)
+
+        if self.stacks:
+            with open(self.path("stacks.txt"), "w") as f:
+                for stack, count in self.stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+        if self.memory_baseline is not None:
+            import tracemalloc
+            self.write_memory()
+            tracemalloc.stop()
+        if self.slow_calls:
+            with open(self.path("slow.txt"), "w") as f:
+                for when, thread, name, took in self.slow_calls:
+                    f.write(f"{time.strftime('%H:%M:%S', time.localtime(when))} {thread} "
+                            f"{name} {took * 1000:.1f}ms\n")
+        own = threading.get_ident()
+        # Only the current thread's profile can be disabled from here, the
+        # others are read while they run
+        seen = Counter()
+        for ident, profile in self.profiles.items():
+            name = self.names.get(ident, str(ident)).replace(" ", "_")
+            seen[name] += 1
+            if seen[name] > 1:
+                name = f"{name}-{seen[name]}"
+            if ident == own:
+                profile.disable()
+            profile.snapshot_stats()
+            path = self.path(f"{name}.pstats")
+            with open(path, "wb") as f:
+                marshal.dump(profile.stats, f)
+            with open(path.with_suffix(".txt"), "w") as f:
+                pstats.Stats(str(path), stream=f).sort_stats("cumulative").print_stats(40)
+        print(f"Profiling reports written to {self.directory}")
+        active = None
@@ -0,0 +1,359 @@
+'''
+Runs the downloads, decompression and parsing in a child process so they
+don't share the GIL with the window ("fetch_process" setting). The worker
+uses a RemoteFetcher, it has the interface of the Fetcher and passes the
+fetches to a Fetcher in the child. Requests and results go through a pipe
+as small JSON messages, the world state never leaves the child and a
+Snapshot is a few hundred bytes.
+
+The window supervises the process with FetchProcess.check(), a crashed
+child is started again. A request that takes longer than the timeout gets
+the child killed, so a hung request can't hold up anything.
+
+Messages to the child:
+    {"op": "fetch", "id": ID, "platform": PLATFORM}
+    {"op": "cancel", "id": ID}
+    {"op": "forget", "platform": PLATFORM}
+    {"op": "sections", "extra": [SECTION, ...]}
+Replies:
+    {"id": ID, "value": Snapshot.to_dict() or None if unchanged,
+     "bandwidth": Fetcher.bandwidth, "stats": Fetcher.stats}
+    {"id": ID, "error": TEXT, ...} or {"id": ID, "cancelled": true, ...}
+'''
+import itertools
+import json
+import multiprocessing
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .metrics import metrics
+from .snapshot import Snapshot
+from .worldstate import Cancelled, Fetcher, FetchError
+
+
+def encode(message):
+    return json.dumps(message, separators=(",", ":")).encode()
+
+
+def serve(connection, base_url, extra_sections, archive):
+    '''
+    Main function of the child, fetches until the pipe is closed. archive
+    is None or the arguments of archive.Archive.
+    '''
+    Fetcher.base_url = base_url
+    fetcher = Fetcher(extra_sections)
+    if archive is not None:
+        from .archive import Archive
+        fetcher.archive = Archive(*archive)
+    pool = ThreadPoolExecutor(max_workers=len(fetcher.platforms))
+    lock = threading.Lock()
+    # Request id: cancel token
+    tokens = {}
+
+    def fetch(request, platform, token):
+        try:
+            value = fetcher.fetch(platform, token)
+        except Cancelled:
+            reply = {"cancelled": True}
+        except Exception as e:
+            # FetchError, anything else would leave the request waiting
+            reply = {"error": str(e) if isinstance(e, FetchError) else repr(e)}
+        else:
+            reply = {"value": None if value is None else value.to_dict()}
+        finally:
+            tokens.pop(request, None)
+        # The counters are sent in the order they are taken
+        with lock:
+            with fetcher.lock:
+                reply.update(id=request, bandwidth=fetcher.bandwidth, stats=fetcher.stats)
+                data = encode(reply)
+            try:
+                connection.send_bytes(data)
+            except OSError:
+                pass
+
+    while True:
+        try:
+            message = json.loads(connection.recv_bytes())
+        except (EOFError, OSError):
+            break
+        op = message["op"]
+        if op == "fetch":
+            token = tokens[message["id"]] = threading.Event()
+            pool.submit(fetch, message["id"], message["platform"], token)
+        elif op == "cancel":
+            token = tokens.get(message["id"])
+            if token is not None:
+                fetcher.cancel(token)
+        elif op == "forget":
+            fetcher.forget(message["platform"])
+        elif op == "sections":
+            fetcher.set_sections(message["extra"])
+
+    for token in list(tokens.values()):
+        fetcher.cancel(token)
+    pool.shutdown(wait=False, cancel_futures=True)
+    if fetcher.archive is not None:
+        fetcher.archive.close()
+
+
+class Request(threading.Event):
+    '''
+    A fetch waiting for its reply
+    '''
+
+    def __init__(self, process):
+        super().__init__()
+        self.process = process
+        self.reply = None
+
+
+class FetchProcess:
+    '''
+    The child process and the pipe to it. Started by the first message if
+    it isn't running.
+    '''
+
+    def __init__(self, base_url=None, extra_sections=(), archive=None):
+        self.base_url = base_url or Fetcher.base_url
+        self.extra_sections = tuple(extra_sections)
+        self.archive = archive
+        self.lock = threading.Lock()
+        self.process = None
+        self.connection = None
+        self.ids = itertools.count()
+        self.pending = {}
+        self.restarts = 0
+        self.closed = False
+
+    def start(self):
+        with self.lock:
+            self._start()
+
+    def _start(self):
+        if self.closed:
+            raise FetchError("the fetch process was closed")
+        # Not forked, the window's process has Qt's threads
+        context = multiprocessing.get_context("spawn")
+        connection, child = context.Pipe()
+        process = context.Process(target=serve, name="sentient-fetch", daemon=True,
+                                  args=(child, self.base_url, self.extra_sections,
+                                        self.archive))
+        try:
+            process.start()
+        except (OSError, RuntimeError, EOFError) as e:
+            # Tried again by the next message
+            connection.close()
+            raise FetchError(f"the fetch process didn't start: {e!r}") from e
+        finally:
+            child.close()
+        if self.process is not None:
+            self.restarts += 1
+            metrics.inc("sentient_fetch_process_restarts_total")
+        self.process = process
+        self.connection = connection
+        threading.Thread(target=self.read, args=(process, connection),
+                         name="fetch-process", daemon=True).start()
+
+    def alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def check(self):
+        '''
+        Starts the process again if it died, returns whether it was
+        '''
+        with self.lock:
+            if self.process is None or self.process.is_alive():
+                return False
+            print(f"Fetch process exited with {self.process.exitcode}, restarting")
+            try:
+                self._start()
+            except FetchError as e:
+                print(e)
+                return False
+            return True
+
+    def kill(self, reason):
+        '''
+        Kills the process, its requests fail and the next message starts a
+        new one
+        '''
+        with self.lock:
+            if self.process is None or not self.process.is_alive():
+                return
+            print(f"Killing the fetch process: {reason}")
+            self.process.kill()
+            # So alive() is False right away
+            self.process.join(1)
+
+    def send(self, message):
+        with self.lock:
+            self._send(message)
+
+    def _send(self, message):
+        if not self.alive():
+            self._start()
+        try:
+            self.connection.send_bytes(encode(message))
+        except OSError as e:
+            raise FetchError(f"fetch process: {e}") from e
+
+    def fetch(self, platform):
+        '''
+        Sends a fetch, returns its id and the Request that gets the reply
+        '''
+        request_id = next(self.ids)
+        with self.lock:
+            if not self.alive():
+                self._start()
+            request = self.pending[request_id] = Request(self.process)
+            try:
+                self._send({"op": "fetch", "id": request_id, "platform": platform})
+            except FetchError:
+                self.pending.pop(request_id, None)
+                raise
+        return request_id, request
+
+    def read(self, process, connection):
+        '''
+        Hands the replies of the process to their requests, fails the
+        remaining ones when it ends
+        '''
+        while True:
+            try:
+                reply = json.loads(connection.recv_bytes())
+            except (EOFError, OSError):
+                break
+            request = self.pending.pop(reply["id"], None)
+            if request is not None:
+                request.reply = reply
+                request.set()
+        connection.close()
+        for request_id, request in list(self.pending.items()):
+            if request.process is process:
+                self.pending.pop(request_id, None)
+                request.set()
+
+    def close(self, timeout=1):
+        '''
+        Closes the pipe which ends the child, kills it if it doesn't end in
+        time
+        '''
+        with self.lock:
+            self.closed = True
+            process, self.process = self.process, None
+        if process is None:
+            return
+        self.connection.close()
+        process.join(timeout)
+        if process.is_alive():
+            process.kill()
+
+
+class RemoteFetcher(Fetcher):
+    '''
+    Fetcher that lets a FetchProcess do the fetches. bandwidth and stats
+    are the totals of all the processes it had.
+    '''
+
+    def __init__(self, process, extra_sections=(), timeout=30):
+        self.process = None
+        super().__init__(extra_sections)
+        self.process = process
+        self.timeout = timeout
+        # cancel token: (request id, Request)
+        self.requests = {}
+        # Totals of the previous processes and the latest of the current one
+        self.totals = {}
+        self.current = None
+
+    def set_sections(self, extra):
+        super().set_sections(extra)
+        if self.process is not None:
+            self.process.extra_sections = tuple(extra)
+            if self.process.alive():
+                self.process.send({"op": "sections", "extra": list(extra)})
+
+    def forget(self, platform):
+        super().forget(platform)
+        if self.process.alive():
+            self.process.send({"op": "forget", "platform": platform})
+
+    def cancel(self, token):
+        token.set()
+        with self.lock:
+            request = self.requests.get(token)
+        if request is not None:
+            request_id, request = request
+            request.set()
+            if self.process.alive():
+                try:
+                    self.process.send({"op": "cancel", "id": request_id})
+                except FetchError:
+                    pass
+
+    def fetch(self, platform, token=None):
+        token = token or threading.Event()
+        try:
+            request_id, request = self.process.fetch(platform)
+        except (FetchError, OSError, RuntimeError, EOFError) as e:
+            # The process didn't start or the pipe broke, the next fetch
+            # starts it again
+            metrics.inc("sentient_errors_total", platform=platform, type="FetchProcess")
+            if isinstance(e, FetchError):
+                raise
+            raise FetchError(f"{platform}: fetch process: {e!r}") from e
+        with self.lock:
+            self.requests[token] = (request_id, request)
+        try:
+            if not request.wait(self.timeout):
+                self.process.pending.pop(request_id, None)
+                self.process.kill(f"{platform} took more than {self.timeout}s")
+                metrics.inc("sentient_errors_total", platform=platform, type="Timeout")
+                raise FetchError(f"{platform}: no result after {self.timeout}s")
+        finally:
+            with self.lock:
+                self.requests.pop(token, None)
+        if token.is_set():
+            raise Cancelled(platform)
+        reply = request.reply
+        if reply is None:
+            metrics.inc("sentient_errors_total", platform=platform, type="ProcessExited")
+            raise FetchError(f"{platform}: the fetch process exited")
+        self.add_totals(request.process, reply)
+        if reply.get("cancelled"):
+            raise Cancelled(platform)
+        if "error" in reply:
+            metrics.inc("sentient_errors_total", platform=platform, type="FetchError")
+            raise FetchError(reply["error"])
+
+        metrics.success(platform)
+        if reply["value"] is None:
+            if "value" not in self.last[platform]:
+                # The process has a value this side doesn't know
+                self.process.send({"op": "forget", "platform": platform})
+                raise FetchError(f"{platform}: out of sync with the fetch process")
+            return None
+        value = Snapshot.from_dict(reply["value"])
+        if value == self.last[platform].get("value"):
+            # Changed for a new process that didn't know it yet
+            return None
+        self.last[platform] = {"value": value}
+        return value
+
+    def add_totals(self, process, reply):
+        '''
+        Updates bandwidth and stats from the counters of the process
+        '''
+        with self.lock:
+            if process is not self.current:
+                # The counters of a new process start at 0
+                self.current = process
+                self.totals = {"bandwidth": {platform: dict(bandwidth) for platform, bandwidth
+                                             in self.bandwidth.items()},
+                               "stats": dict(self.stats)}
+            for platform, bandwidth in reply["bandwidth"].items():
+                for name, amount in bandwidth.items():
+                    self.bandwidth[platform][name] = \
+                        self.totals["bandwidth"][platform][name] + amount
+            for name, amount in reply["stats"].items():
+                self.stats[name] = self.totals["stats"][name] + amount
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+'''
+Replays checks through the spawn state machine in bulk. Uses the same rules
+as Tracker.update but works on whole numpy arrays, so months of checks take
+a fraction of a second. Needs numpy (pip install wf-sentient-tracker[predict]).
+
+Backtest check intervals against the anomalies in the recorded history
+(or a synthetic one) or replay checks recorded with
+`sentient-tracker-headless --snapshots FILE`:
+
+    python -m wf_sentient_tracker.replay --interval 60 --interval 15 --adaptive
+    python -m wf_sentient_tracker.replay --synthetic 90 --interval 60
+    python -m wf_sentient_tracker.replay --snapshots checks.jsonl
+'''
+import argparse
+import json
+import math
+import random
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+from .schedule import CYCLE, LIFETIME, SPREAD, PollScheduler
+from .tracker import NODES, PLATFORMS, Event
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# Node codes of the checks besides the real nodes
+NONE = -1
+# The check failed, the state is unknown again like after Tracker.reset
+ERROR = -2
+
+KINDS = ("none", "spawn", "despawn")
+
+# Parallel arrays, kinds are indexes into KINDS and durations NaN if unknown
+Events = namedtuple("Events", ["times", "kinds", "nodes", "observed", "durations"])
+
+
+def available():
+    return np is not None
+
+
+def node_code(tmp):
+    '''
+    Node code of a "Tmp" value, None is a failed check
+    '''
+    if tmp is None:
+        return ERROR
+    planet = json.loads(tmp)
+    return planet["sfn"] if planet else NONE
+
+
+def replay(times, nodes):
+    '''
+    Runs the checks of one platform through the state machine. times are
+    sorted seconds and nodes the node codes, NONE or ERROR. Returns the events
+    Tracker.update would have returned one by one.
+    '''
+    times = np.asarray(times, dtype=float)
+    nodes = np.asarray(nodes, dtype=np.int64)
+    valid = nodes != ERROR
+    # The first check and the ones after errors start from an unknown state
+    first = np.ones(len(nodes), dtype=bool)
+    first[1:] = ~valid[:-1]
+    first = first[valid]
+    times = times[valid]
+    nodes = nodes[valid]
+    active = nodes >= 0
+
+    changed = first.copy()
+    changed[1:] |= active[1:] != active[:-1]
+    index = np.flatnonzero(changed)
+    if not len(index):
+        return Events(*(np.empty(0, dtype=dtype) for dtype in (float, int, int, bool, float)))
+
+    event_first = first[index]
+    event_active = active[index]
+    kinds = np.where(event_active, 1, np.where(event_first, 0, 2))
+    despawn = kinds == 2
+    observed = (event_active & ~event_first) | despawn
+    # A despawn is reported with the node of the check before it
+    event_nodes = np.where(despawn, nodes[np.maximum(index - 1, 0)],
+                           np.where(event_active, nodes[index], NONE))
+
+    # The duration is known if the last observed spawn came after the
+    # previous despawn, even across errors like in Tracker
+    event_times = times[index]
+    positions = np.arange(len(index))
+    last_spawn = np.maximum.accumulate(np.where((kinds == 1) & observed, positions, -1))
+    last_despawn = np.maximum.accumulate(np.where(despawn, positions, -1))
+    previous_despawn = np.concatenate(([-1], last_despawn[:-1]))
+    known = despawn & (last_spawn > previous_despawn)
+    durations = np.where(known, event_times - event_times[np.maximum(last_spawn, 0)], np.nan)
+    return Events(event_times, kinds, event_nodes, observed, durations)
+
+
+def to_events(platform, events):
+    '''
+    Turns the arrays into Event tuples
+    '''
+    for when, kind, node, observed, duration in zip(*events):
+        yield Event(platform,
+                    KINDS[kind],
+                    None if node < 0 else int(node),
+                    datetime.fromtimestamp(when),
+                    bool(observed),
+                    None if math.isnan(duration) else timedelta(seconds=float(duration)))
+
+
+def anomalies(rows):
+    '''
+    (start, end, node) arrays of the anomalies in (time, kind, node, observed)
+    history rows sorted by time, only the ones whose spawn and despawn were
+    both seen
+    '''
+    if len(rows) < 2:
+        return np.empty(0), np.empty(0), np.empty(0, dtype=np.int64)
+    times = np.array([row[0] for row in rows], dtype=float)
+    kinds = np.array([row[1] for row in rows])
+    nodes = np.array([NONE if row[2] is None else row[2] for row in rows], dtype=np.int64)
+    observed = np.array([bool(row[3]) for row in rows])
+    complete = np.flatnonzero((kinds[:-1] == "spawn") & observed[:-1] & (kinds[1:] == "despawn"))
+    return times[complete], times[complete + 1], np.maximum(nodes[complete], 0)
+
+
+def synthetic(days, start=0.0, seed=0):
+    '''
+    Anomalies following the cycle from the help window: ~30min long and the
+    next one ~3h (+- 30min) after the last
+    '''
+    rng = np.random.default_rng(seed)
+    cycle = CYCLE.total_seconds()
+    count = int(days * 86400 / cycle) + 1
+    gaps = rng.uniform(cycle - SPREAD.total_seconds(), cycle + SPREAD.total_seconds(), count)
+    starts = start + np.cumsum(gaps)
+    lifetime = LIFETIME.total_seconds()
+    ends = starts + rng.uniform(lifetime * 0.8, lifetime * 1.2, count)
+    nodes = rng.choice(np.array(list(NODES)), count)
+    return starts, ends, nodes
+
+
+def sample(starts, ends, nodes, polls):
+    '''
+    Node codes the checks at the poll times would have seen
+    '''
+    polls = np.asarray(polls, dtype=float)
+    if not len(starts):
+        return np.full(len(polls), NONE, dtype=np.int64)
+    index = np.maximum(np.searchsorted(starts, polls, "right") - 1, 0)
+    inside = (polls >= starts[index]) & (polls < ends[index])
+    return np.where(inside, nodes[index], NONE)
+
+
+def fixed_polls(start, end, interval, errors=0.0, seed=0):
+    '''
+    Check times every interval seconds and a mask of the failed ones
+    '''
+    polls = np.arange(start, end, interval, dtype=float)
+    failed = np.random.default_rng(seed).random(len(polls)) < errors
+    return polls, failed
+
+
+def adaptive_polls(starts, ends, nodes, start, end, scheduler=None, errors=0.0, seed=0):
+    '''
+    Check times picked by the PollScheduler. It reacts to every result so
+    this is a plain loop, about one check per 10us.
+    '''
+    scheduler = scheduler or PollScheduler()
+    rng = random.Random(seed)
+    polls = []
+    failed = []
+    now = start
+    while now < end:
+        when = datetime.fromtimestamp(now)
+        polls.append(now)
+        if errors and rng.random() < errors:
+            failed.append(True)
+            scheduler.forget("replay")
+        else:
+            failed.append(False)
+            index = np.searchsorted(starts, now, "right") - 1
+            active = index >= 0 and now < ends[index]
+            scheduler.observe("replay", bool(active), when)
+        now += scheduler.next_interval(["replay"], when)
+    return np.array(polls), np.array(failed, dtype=bool)
+
+
+def score(starts, ends, events, polls):
+    '''
+    Compares the events with the real anomalies. Delays are in seconds.
+    '''
+    report = {"anomalies": int(len(starts)), "checks": int(len(polls))}
+    if len(polls) > 1:
+        report["checks_per_day"] = round(len(polls) / (polls[-1] - polls[0]) * 86400, 1)
+
+    spawns = events.times[events.kinds == 1]
+    index = np.maximum(np.searchsorted(starts, spawns, "right") - 1, 0)
+    inside = (spawns >= starts[index]) & (spawns < ends[index]) if len(starts) else spawns < 0
+    detected = np.zeros(len(starts), dtype=bool)
+    detected[index[inside]] = True
+    report["detected"] = int(detected.sum())
+    report["missed"] = int(len(starts) - detected.sum())
+
+    observed = inside & events.observed[events.kinds == 1]
+    delays = spawns[observed] - starts[index[observed]]
+    despawns = events.times[events.kinds == 2]
+    index = np.searchsorted(ends, despawns, "right") - 1
+    despawn_delays = despawns[index >= 0] - ends[index[index >= 0]]
+    for name, values in (("spawn_delay", delays), ("despawn_delay", despawn_delays)):
+        if len(values):
+            report[f"{name}_mean"] = round(float(np.mean(values)), 1)
+            report[f"{name}_p95"] = round(float(np.percentile(values, 95)), 1)
+            report[f"{name}_max"] = round(float(np.max(values)), 1)
+    report["notifications"] = int(np.count_nonzero(events.kinds != 0))
+    return report
+
+
+def backtest(starts, ends, nodes, polls, failed):
+    '''
+    Replays the checks at the poll times and scores them
+    '''
+    codes = np.where(failed, ERROR, sample(starts, ends, nodes, polls))
+    began = time.perf_counter()
+    events = replay(polls, codes)
+    took = time.perf_counter() - began
+    report = score(starts, ends, events, polls)
+    report["replay_seconds"] = round(took, 4)
+    return report
+
+
+def load_snapshots(path):
+    '''
+    Reads the JSON lines written by `sentient-tracker-headless --snapshots`.
+    Returns {platform: (times, node codes)}.
+    '''
+    checks = {}
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            check = json.loads(line)
+            times, codes = checks.setdefault(check["platform"], ([], []))
+            times.append(check["time"])
+            codes.append(node_code(check["tmp"]))
+    return {platform: (np.array(times, dtype=float), np.array(codes, dtype=np.int64))
+            for platform, (times, codes) in checks.items()}
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m wf_sentient_tracker.replay",
+        description="Replay checks through the spawn state machine and backtest check intervals")
+    parser.add_argument("--history", help="history file (default: history.sqlite3 in the config directory)")
+    parser.add_argument("-p", "--platform", action="append", choices=PLATFORMS)
+    parser.add_argument("--synthetic", type=float, metavar="DAYS",
+                        help="backtest against DAYS of generated anomalies instead of the history")
+    parser.add_argument("--interval", type=float, action="append", default=[],
+                        help="fixed check interval in seconds to backtest, can be used multiple times")
+    parser.add_argument("--adaptive", action="store_true", help="backtest the adaptive schedule")
+    parser.add_argument("--errors", type=float, default=0.0, help="chance of a check failing")
+    parser.add_argument("--snapshots", help="replay checks recorded by the headless mode and "
+                                            "print the events")
+    args = parser.parse_args(args)
+
+    if not available():
+        parser.error("numpy is needed for replays")
+
+    if args.snapshots:
+        for platform, (times, codes) in load_snapshots(args.snapshots).items():
+            if args.platform and platform not in args.platform:
+                continue
+            for event in to_events(platform, replay(times, codes)):
+                print(json.dumps({"platform": event.platform,
+                                  "kind": event.kind,
+                                  "node": event.node,
+                                  "time": event.time.isoformat(timespec="seconds"),
+                                  "observed": event.observed,
+                                  "duration": event.duration and event.duration.total_seconds()}))
+        return
+
+    if args.synthetic:
+        truth = {"synthetic": synthetic(args.synthetic)}
+    else:
+        from .config import base_path
+        from .history import History
+        history = History(args.history or base_path() / "history.sqlite3")
+        truth = {platform: anomalies(history.raw(
+                     "SELECT time, kind, node, observed FROM events "
+                     "WHERE platform = ? ORDER BY time", (platform,)))
+                 for platform in args.platform or PLATFORMS}
+        history.close()
+
+    intervals = args.interval or ([] if args.adaptive else [60])
+    report = {}
+    for name, (starts, ends, nodes) in truth.items():
+        if not len(starts):
+            report[name] = None
+            continue
+        # From an hour before the first anomaly to an hour after the last
+        start = starts[0] - 3600
+        end = ends[-1] + 3600
+        results = {}
+        for interval in intervals:
+            polls, failed = fixed_polls(start, end, interval, args.errors)
+            results[f"{interval:g}s"] = backtest(starts, ends, nodes, polls, failed)
+        if args.adaptive:
+            polls, failed = adaptive_polls(starts, ends, nodes, start, end, errors=args.errors)
+            results["adaptive"] = backtest(starts, ends, nodes, polls, failed)
+        report[name] = results
+    print(json.dumps(report, indent=4))
+
+
+if __name__ == "__main__":
+    main()
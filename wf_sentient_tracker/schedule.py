@@ -0,0 +1,140 @@
+from datetime import datetime, timedelta
+
+
+# Taken from the help window, an anomaly lasts ~30min and the next one spawns
+# ~3h (+- 30min) later
+LIFETIME = timedelta(minutes=30)
+CYCLE = timedelta(hours=3)
+SPREAD = timedelta(minutes=30)
+
+
+class Phase:
+    '''
+    A stretch of time with the same check interval
+    '''
+    __slots__ = ("start", "end", "interval", "reason")
+
+    def __init__(self, start, end, interval, reason):
+        self.start = start
+        self.end = end
+        self.interval = interval
+        self.reason = reason
+
+    def __repr__(self):
+        end = self.end.strftime("%H:%M:%S") if self.end else "..."
+        return (f"{self.start:%H:%M:%S} - {end} every {self.interval}s "
+                f"({self.reason})")
+
+
+class PollScheduler:
+    '''
+    Decides how long to wait before the next check using the last observed
+    spawn and despawn. Checks rarely when a spawn can't happen, often inside
+    the predicted spawn window and backs off while an anomaly is active.
+    '''
+
+    def __init__(self, default=60, idle=600, window=15, active=300):
+        self.default = default
+        self.idle = idle
+        self.window = window
+        self.active = active
+        self.states = {}
+        self.spawns = {}
+        self.despawns = {}
+        self.predictions = {}
+
+    def observe(self, platform, active, now=None):
+        '''
+        Records the state seen by a check
+        '''
+        now = now or datetime.now()
+        previous = self.states.get(platform)
+        if active and previous is False:
+            self.spawns[platform] = now
+        elif not active and previous:
+            self.despawns[platform] = now
+        self.states[platform] = active
+
+    def predict(self, platform, start, end):
+        '''
+        Sets the predicted spawn window (from predict.py) of the platform, it
+        replaces the fixed cycle times
+        '''
+        self.predictions[platform] = (start, end)
+
+    def spawn_window(self, platform):
+        '''
+        Returns the start and end of the next spawn window or None if unknown
+        '''
+        despawn = self.despawns.get(platform)
+        prediction = self.predictions.get(platform)
+        if prediction is not None and (despawn is None or prediction[0] > despawn):
+            # A bit of margin so the edges of the window aren't missed
+            return (prediction[0] - timedelta(minutes=5),
+                    prediction[1] + timedelta(minutes=5))
+        if despawn is not None:
+            # Covers both a 3h spawn to spawn and a 3h despawn to spawn cycle
+            return despawn + CYCLE - SPREAD - LIFETIME, despawn + CYCLE + SPREAD
+        return None
+
+    def forget(self, platform):
+        '''
+        The state is unknown again (errors, platform changes), the known
+        times are kept
+        '''
+        self.states[platform] = None
+
+    def plan(self, platform, now=None):
+        '''
+        Returns the list of phases from now on for the platform
+        '''
+        now = now or datetime.now()
+        state = self.states.get(platform)
+        spawn = self.spawns.get(platform)
+        window = self.spawn_window(platform)
+
+        if state:
+            if spawn is None:
+                return [Phase(now, None, self.active, "active, spawn unknown")]
+            expected = spawn + LIFETIME
+            phases = [Phase(now, expected - timedelta(minutes=5), self.active, "active"),
+                      Phase(expected - timedelta(minutes=5),
+                            expected + timedelta(minutes=15),
+                            self.window,
+                            "despawn window"),
+                      Phase(expected + timedelta(minutes=15), None, self.default, "overdue")]
+        elif state is False and window is not None:
+            start, end = window
+            phases = [Phase(now, start, self.idle, "no spawn possible"),
+                      Phase(start, end, self.window, "spawn window"),
+                      Phase(end, None, self.default, "overdue")]
+        else:
+            return [Phase(now, None, self.default, "unknown")]
+
+        return [phase for phase in phases if phase.end is None or phase.end > now]
+
+    def next_interval(self, platforms, now=None):
+        '''
+        Returns the seconds until the next check, the shortest of all the
+        platforms. Never sleeps past the start of a faster phase.
+        '''
+        now = now or datetime.now()
+        intervals = []
+        for platform in platforms:
+            phase = self.plan(platform, now)[0]
+            interval = phase.interval
+            if phase.end is not None:
+                until_end = (phase.end - now).total_seconds()
+                interval = min(interval, max(until_end, self.window))
+            intervals.append(interval)
+        return int(min(intervals, default=self.default))
+
+    def describe(self, platforms, now=None):
+        '''
+        Human readable schedule for the platforms
+        '''
+        lines = []
+        for platform in platforms:
+            phases = ", ".join(repr(phase) for phase in self.plan(platform, now))
+            lines.append(f"{platform}: {phases}")
+        return "\n".join(lines)
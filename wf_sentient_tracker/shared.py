@@ -0,0 +1,112 @@
+'''
+Latest Snapshot of every platform shared by all the trackers on this
+machine (GUI, headless, several users of one config directory). Every
+platform is a small JSON file that is replaced atomically, so readers never
+see a partial write. A lock file per platform makes sure only one process
+fetches it at a time, the others wait and read its result.
+'''
+import contextlib
+import json
+import time
+from pathlib import Path
+from .config import atomic_write
+from .snapshot import Snapshot
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+
+def try_lock(f):
+    '''
+    Locks the open file without blocking, returns False if it's taken
+    '''
+    try:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+    return True
+
+
+def unlock(f):
+    if fcntl is not None:
+        fcntl.flock(f, fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class SharedCache:
+    '''
+    Values younger than ttl seconds are served from the cache directory
+    '''
+
+    def __init__(self, directory, ttl=15):
+        self.directory = Path(directory)
+        self.ttl = ttl
+
+    def path(self, platform, suffix=".json"):
+        return self.directory / f"{platform}{suffix}"
+
+    def get(self, platform):
+        '''
+        Returns the Snapshot and its age in seconds or None if there is no
+        fresh value
+        '''
+        try:
+            with open(self.path(platform), "rb") as f:
+                entry = json.loads(f.read())
+            age = time.time() - entry["time"]
+            if not 0 <= age < self.ttl:
+                return None
+            return Snapshot.from_dict(entry), age
+        except (OSError, ValueError, KeyError, TypeError):
+            # Written by an older version
+            return None
+
+    def put(self, platform, value):
+        '''
+        Stores the value of a fetch that just finished
+        '''
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            atomic_write(self.path(platform),
+                         json.dumps({**value.to_dict(), "time": time.time()}))
+        except OSError as e:
+            print(e)
+
+    @contextlib.contextmanager
+    def fetching(self, platform, cancel=None, timeout=10):
+        '''
+        Holds the fetch lock of the platform. Yields whether another process
+        had it first, then the cache is worth checking again. Gives up on
+        the lock after timeout seconds or when cancel is set. Without a
+        usable lock file the fetch goes ahead unlocked.
+        '''
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            f = open(self.path(platform, ".lock"), "a+b")
+        except OSError as e:
+            print(e)
+            yield False
+            return
+        waited = False
+        locked = try_lock(f)
+        deadline = time.monotonic() + timeout
+        while not locked and time.monotonic() < deadline:
+            waited = True
+            if cancel is not None and cancel.wait(0.05):
+                break
+            elif cancel is None:
+                time.sleep(0.05)
+            locked = try_lock(f)
+        try:
+            yield waited
+        finally:
+            if locked:
+                unlock(f)
+            f.close()
@@ -0,0 +1,177 @@
+'''
+Typed snapshot of the parts of a world state the trackers use. The worker
+builds it while the response is read (worldstate.extract only decodes the
+sections that are tracked) so the window gets a small object instead of
+JSON to parse again on the GUI thread.
+
+Sections:
+    anomaly     "Tmp", the sentient anomaly, always tracked
+    fissures    "ActiveMissions" and "VoidStorms" (Railjack fissures)
+    alerts      "Alerts"
+'''
+import json
+from collections import namedtuple
+
+
+# World state keys of every section
+SECTIONS = {"anomaly": ("Tmp",),
+            "fissures": ("ActiveMissions", "VoidStorms"),
+            "alerts": ("Alerts",)}
+TIERS = {"VoidT1": "Lith", "VoidT2": "Meso", "VoidT3": "Neo", "VoidT4": "Axi",
+         "VoidT5": "Requiem", "VoidT6": "Omnia"}
+
+# expiry is in seconds since the epoch, node and mission are the world
+# state's codes (SolNode10, MT_EXTERMINATION)
+Fissure = namedtuple("Fissure", ["id", "node", "tier", "mission", "expiry", "hard", "storm"])
+Alert = namedtuple("Alert", ["id", "node", "mission", "faction", "expiry"])
+
+
+def sections(extra=()):
+    '''
+    The anomaly and the extra sections in SECTIONS order
+    '''
+    return tuple(name for name in SECTIONS if name == "anomaly" or name in extra)
+
+
+def keys(names):
+    return tuple(key for name in names for key in SECTIONS[name])
+
+
+def item_id(item):
+    oid = item.get("_id", {})
+    return oid.get("$oid") if isinstance(oid, dict) else str(oid)
+
+
+def date(value):
+    '''
+    Seconds since the epoch of a {"$date": {"$numberLong": ms}} value
+    '''
+    try:
+        return int(value["$date"]["$numberLong"]) / 1000
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def mission_name(code):
+    '''
+    MT_EXTERMINATION -> Extermination
+    '''
+    return (code or "").replace("MT_", "").replace("_", " ").title()
+
+
+def fissures(missions, storms):
+    items = [Fissure(item_id(item), item.get("Node"), item.get("Modifier"),
+                     item.get("MissionType"), date(item.get("Expiry")),
+                     bool(item.get("Hard", False)), False)
+             for item in missions or ()]
+    items += [Fissure(item_id(item), item.get("Node"), item.get("ActiveMissionTier"),
+                      item.get("MissionType"), date(item.get("Expiry")), False, True)
+              for item in storms or ()]
+    return tuple(items)
+
+
+def alerts(values):
+    items = []
+    for item in values or ():
+        info = item.get("MissionInfo", {})
+        items.append(Alert(item_id(item), info.get("location", item.get("Node")),
+                           info.get("missionType", item.get("MissionType")),
+                           info.get("faction"), date(item.get("Expiry"))))
+    return tuple(items)
+
+
+def anomaly_node(tmp):
+    '''
+    Node code of the "Tmp" value or None without an anomaly
+    '''
+    planet = json.loads(tmp) if isinstance(tmp, str) else tmp
+    return planet["sfn"] if planet else None
+
+
+class Snapshot(namedtuple("Snapshot", ["node", "fissures", "alerts"])):
+    '''
+    node is the anomaly's node code or None, fissures and alerts are tuples
+    or None when the section isn't tracked
+    '''
+    __slots__ = ()
+
+    @classmethod
+    def parse(cls, values, names):
+        '''
+        Builds the snapshot from the decoded world state values of the
+        sections
+        '''
+        return cls(anomaly_node(values["Tmp"]),
+                   fissures(values.get("ActiveMissions"), values.get("VoidStorms"))
+                   if "fissures" in names else None,
+                   alerts(values.get("Alerts")) if "alerts" in names else None)
+
+    def covers(self, names):
+        '''
+        Whether the snapshot has all the sections
+        '''
+        return all(name == "anomaly" or getattr(self, name) is not None for name in names)
+
+    def added(self, previous):
+        '''
+        (section, item) of the fissures and alerts that weren't in the
+        previous snapshot
+        '''
+        items = []
+        for name in ("fissures", "alerts"):
+            current = getattr(self, name)
+            if not current:
+                continue
+            known = getattr(previous, name, None) or ()
+            known = {item.id for item in known}
+            items += [(name, item) for item in current if item.id not in known]
+        return items
+
+    @property
+    def tmp(self):
+        '''
+        The "Tmp" value as it's sent by the server
+        '''
+        return "[]" if self.node is None else json.dumps({"sfn": self.node})
+
+    def to_dict(self):
+        '''
+        JSON version for the shared cache, the hub and the snapshots files
+        '''
+        data = {"tmp": self.tmp}
+        for name in ("fissures", "alerts"):
+            if getattr(self, name) is not None:
+                data[name] = [list(item) for item in getattr(self, name)]
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(anomaly_node(data["tmp"]),
+                   tuple(Fissure(*item) for item in data["fissures"])
+                   if "fissures" in data else None,
+                   tuple(Alert(*item) for item in data["alerts"])
+                   if "alerts" in data else None)
+
+
+def describe_item(section, item):
+    '''
+    Text for a new fissure or alert
+    '''
+    if section == "fissures":
+        tier = TIERS.get(item.tier, item.tier)
+        kind = "Void Storm" if item.storm else "Steel Path fissure" if item.hard else "fissure"
+        return f"{tier} {mission_name(item.mission)} {kind} at {item.node}".replace("  ", " ")
+    return f"alert: {mission_name(item.mission)} at {item.node}"
+
+
+def summary(snapshot):
+    '''
+    Short text with the counts of the tracked sections, empty if only the
+    anomaly is tracked
+    '''
+    parts = []
+    if snapshot.fissures is not None:
+        parts.append(f"{len(snapshot.fissures)} fissures")
+    if snapshot.alerts is not None:
+        parts.append(f"{len(snapshot.alerts)} alerts")
+    return ", ".join(parts)
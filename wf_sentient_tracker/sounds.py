@@ -0,0 +1,125 @@
+'''
+Checks and normalizes the alert sounds once so they can be preloaded by
+QSoundEffect. Any PCM WAV is turned into 16-bit mono/stereo without the
+silence at the start, no longer than MAX_SECONDS and with the same peak
+volume. The results are kept in the cache directory by the hash of the
+source file.
+'''
+import hashlib
+import io
+import sys
+import wave
+from array import array
+from pathlib import Path
+from .config import atomic_write
+
+
+MAX_SECONDS = 10
+# Peak volume of the normalized sounds, part of full scale
+TARGET_PEAK = 0.7
+# Leading samples quieter than this are cut
+SILENCE = 0.01
+# Changes when the normalization changes so old files aren't used
+VERSION = 1
+
+
+class SoundError(Exception):
+    '''
+    The file isn't a usable WAV
+    '''
+
+
+def to_16bit(data, width):
+    '''
+    Little endian PCM samples of any width as 16-bit samples
+    '''
+    if width == 1:
+        # 8-bit WAVs are unsigned
+        return array("h", ((sample - 128) << 8 for sample in data))
+    if width > 2:
+        # Keep the two most significant bytes of every sample
+        high = bytearray(len(data) // width * 2)
+        high[0::2] = data[width - 2::width]
+        high[1::2] = data[width - 1::width]
+        data = high
+    samples = array("h", bytes(data))
+    if sys.byteorder == "big":
+        samples.byteswap()
+    return samples
+
+
+def read(path):
+    '''
+    Returns the 16-bit samples, channels and frame rate of a WAV
+    '''
+    try:
+        with wave.open(str(path), "rb") as f:
+            channels = f.getnchannels()
+            width = f.getsampwidth()
+            rate = f.getframerate()
+            data = f.readframes(min(f.getnframes(), MAX_SECONDS * rate))
+    except (wave.Error, EOFError) as e:
+        raise SoundError(f"not a PCM WAV file ({e})") from e
+    if channels not in (1, 2):
+        raise SoundError(f"{channels} channels, only mono and stereo are supported")
+    if not 8000 <= rate <= 192000:
+        raise SoundError(f"unsupported frame rate {rate}")
+    if width not in (1, 2, 3, 4):
+        raise SoundError(f"unsupported sample width {width * 8} bits")
+    return to_16bit(data, width), channels, rate
+
+
+def normalize(samples, channels):
+    '''
+    Cuts the leading silence and scales the samples to TARGET_PEAK
+    '''
+    threshold = int(32767 * SILENCE)
+    start = next((i for i, sample in enumerate(samples) if abs(sample) > threshold), None)
+    if start is None:
+        raise SoundError("the sound is silent")
+    samples = samples[start - start % channels:]
+
+    peak = max(max(samples), -min(samples))
+    gain = TARGET_PEAK * 32767 / peak
+    if abs(gain - 1) > 0.05:
+        samples = array("h", (int(sample * gain) for sample in samples))
+    return samples
+
+
+def prepare(path, directory):
+    '''
+    Returns the path of the normalized version of the WAV at path, creates it
+    in directory if needed. Raises SoundError if the file can't be used.
+    '''
+    path = Path(path)
+    try:
+        source = path.read_bytes()
+    except OSError as e:
+        raise SoundError(e) from e
+    key = hashlib.blake2b(source + bytes([VERSION]), digest_size=8).hexdigest()
+    target = Path(directory) / f"{path.stem}-{key}.wav"
+    if target.is_file():
+        return target
+
+    samples, channels, rate = read(path)
+    samples = normalize(samples, channels)
+    if sys.byteorder == "big":
+        samples.byteswap()
+    try:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        data = io.BytesIO()
+        with wave.open(data, "wb") as f:
+            f.setnchannels(channels)
+            f.setsampwidth(2)
+            f.setframerate(rate)
+            f.writeframes(samples.tobytes())
+        atomic_write(target, data.getvalue())
+        # Versions of replaced custom sounds
+        for old in target.parent.glob(f"{path.stem}-*.wav"):
+            if old != target:
+                old.unlink()
+    except OSError as e:
+        # Not worth failing over, the original can still be played
+        print(e)
+        return path
+    return target
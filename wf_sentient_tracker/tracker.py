@@ -0,0 +1,81 @@
+from collections import namedtuple
+from datetime import datetime
+
+
+PLATFORMS = ("PC", "PS4", "XB1")
+NODES = {505: "Ruse War Field",
+         510: "Gian Point",
+         550: "Nsu Grid",
+         551: "Ganalen's Grave",
+         552: "Rya",
+         553: "Flexa",
+         554: "H-2 Cloud",
+         555: "R-9 Cloud"}
+
+# kind is "spawn", "despawn" or "none" (first check without an anomaly).
+# observed is True when the change happened between two checks so the time
+# is the real spawn/despawn time.
+Event = namedtuple("Event", ["platform", "kind", "node", "time", "observed", "duration"])
+
+
+def node_name(code):
+    '''
+    Returns the name of the node or the code if it isn't known
+    '''
+    return NODES.get(code, f"node {code}")
+
+
+class Tracker:
+    '''
+    Spawn/despawn state machine for all platforms. The state of a platform is
+    None when unknown, True when an anomaly is present and False otherwise.
+    '''
+
+    def __init__(self, platforms=PLATFORMS):
+        self.states = {platform: None for platform in platforms}
+        # Node of the anomaly at the last check
+        self.nodes = {platform: None for platform in platforms}
+        self.spawns = {platform: None for platform in platforms}
+        self.despawns = {platform: None for platform in platforms}
+
+    def reset(self, platform):
+        '''
+        Makes the state unknown, the known times are kept
+        '''
+        self.states[platform] = None
+
+    def update(self, platform, node, now=None):
+        '''
+        Takes the anomaly's node of a check (None without an anomaly) and
+        returns the Event it caused or None if nothing changed
+        '''
+        now = now or datetime.now()
+        state = self.states[platform]
+        previous = self.nodes[platform]
+        self.nodes[platform] = node
+        present = node is not None
+
+        if present and not state:
+            observed = state is False
+            if observed:
+                self.spawns[platform] = now
+            self.states[platform] = True
+            return Event(platform, "spawn", node, now, observed, None)
+
+        elif not present and state:
+            spawn = self.spawns[platform]
+            last = self.despawns[platform]
+            # Only known if the spawn of this anomaly was seen
+            if spawn is not None and (last is None or spawn > last):
+                duration = now - spawn
+            else:
+                duration = None
+            self.despawns[platform] = now
+            self.states[platform] = False
+            return Event(platform, "despawn", previous, now, True, duration)
+
+        elif not present and state is None:
+            self.states[platform] = False
+            return Event(platform, "none", None, now, False, None)
+
+        return None
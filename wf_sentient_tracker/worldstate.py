@@ -0,0 +1,464 @@
+import hashlib
+import json
+import os
+import re
+import socket
+import threading
+import time
+from .metrics import metrics, PARSE_BUCKETS, SIZE_BUCKETS
+from .snapshot import Snapshot, keys, sections
+
+
+_decoder = json.JSONDecoder()
+_key_patterns = {}
+# Best first, brotli and zstd only when the brotli/zstandard packages are
+# installed (pip install wf-sentient-tracker[compression])
+ENCODINGS = ("zstd", "br", "gzip", "deflate")
+# The rest of the body is read when it's at most this big so the connection
+# can be used again, a bigger rest costs more than a new connection
+DRAIN_BYTES = 64 * 1024
+
+
+class FetchError(Exception):
+    '''
+    The world state couldn't be downloaded or read
+    '''
+
+
+class Cancelled(FetchError):
+    '''
+    The fetch was cancelled before it finished
+    '''
+
+
+def abort(response):
+    '''
+    Shuts down the socket of a response so a read blocked in another thread
+    returns right away
+    '''
+    raw = response.raw
+    connection = getattr(raw, "connection", None) or getattr(raw, "_connection", None)
+    sock = getattr(connection, "sock", None)
+    if sock is None:
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+def accept_encoding():
+    '''
+    Accept-Encoding header with the encodings urllib3 can decode here, in
+    order of preference
+    '''
+    from urllib3.util.request import ACCEPT_ENCODING
+    available = [encoding.strip() for encoding in ACCEPT_ENCODING.split(",")]
+    encodings = [encoding for encoding in ENCODINGS if encoding in available]
+    return ", ".join(f"{encoding};q={1 - i / 10:g}" for i, encoding in enumerate(encodings))
+
+
+def size_text(size):
+    '''
+    Human readable byte count
+    '''
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
+
+
+def extract(chunks, keys=("Tmp",), required=("Tmp",)):
+    '''
+    Finds the values of the top level keys in a stream of worldstate chunks
+    without decoding the rest of the payload, see scan(). Missing keys are
+    left out. If the scan fails or one of the required keys isn't found the
+    layout changed, then the rest of the body is read and parsed as a whole.
+    '''
+    chunks = iter(chunks)
+    # The chunks read so far, for the full parse
+    seen = []
+
+    def read():
+        for chunk in chunks:
+            seen.append(chunk)
+            yield chunk
+
+    try:
+        values = scan(read(), keys)
+        if all(key in values for key in required if key in keys):
+            return values
+    except ValueError:
+        pass
+    document = json.loads(b"".join(seen) + b"".join(chunks))
+    if not isinstance(document, dict):
+        raise ValueError("the world state isn't a JSON object")
+    return {key: document[key] for key in keys if key in document}
+
+
+def scan(chunks, keys):
+    '''
+    Finds the values of the top level keys in one pass. Stops consuming the
+    chunks as soon as all the values are complete, missing keys are left
+    out. Only the part of the body that is still needed is kept and every
+    value is decoded once, when its end has arrived. Raises ValueError if
+    the body isn't a JSON object or ends in a value.
+    '''
+    pattern = key_pattern(keys)
+    longest = max(map(len, keys)) + 8
+    chunks = iter(chunks)
+    buffer = bytearray()
+    values = {}
+    # Where the key search goes on and up to where the nesting is known
+    search_from = 0
+    scan = None
+    nesting = Nesting()
+    key = None
+    value_start = None
+    # Position and Nesting reached in the value
+    value_scan = None
+    value_nesting = None
+
+    for chunk in chunks:
+        if not chunk:
+            continue
+        # Everything before the value being read or the scan is done with
+        done = value_start if value_start is not None else scan or 0
+        if done:
+            del buffer[:done]
+            search_from -= done
+            scan -= done
+            if value_start is not None:
+                value_start -= done
+                value_scan -= done
+        buffer += chunk
+
+        if scan is None:
+            scan = _space.match(buffer).end()
+            if scan == len(buffer):
+                scan = None
+                continue
+            if buffer[scan] != ord("{"):
+                raise ValueError("the world state isn't a JSON object")
+
+        while len(values) < len(keys):
+            if key is None:
+                match = pattern.search(buffer, search_from)
+                if match is None:
+                    # The key might be split between two chunks
+                    search_from = max(search_from, len(buffer) - longest)
+                    if search_from > scan:
+                        nesting.feed(buffer[scan:search_from])
+                        scan = search_from
+                    break
+                search_from = match.start() + 1
+                nesting.feed(buffer[scan:match.start()])
+                scan = match.start()
+                if nesting.in_string or nesting.escaped or nesting.depth != 1:
+                    # In a string or a nested object
+                    continue
+                key = match.group(1).decode()
+                value_start = value_scan = match.end()
+
+            end, value_scan, value_nesting = value_end(buffer, value_scan, value_nesting)
+            if end is None:
+                break
+            values.setdefault(key, json.loads(buffer[value_start:end]))
+            # The nesting is back to where it was before the key
+            scan = search_from = end
+            key = value_start = None
+        else:
+            break
+
+    if key is not None:
+        raise ValueError(f"the world state ended in the {key} value")
+    return values
+
+
+_space = re.compile(rb'\s*')
+_string = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"')
+# A bracket followed by the next key, the end of the world state or the
+# end of what has arrived
+_close = re.compile(rb'[\]}](?=\s*(?:,\s*(?:"|\Z)|\}\s*\Z|\Z))')
+_scalar = re.compile(rb'[^,}\]\s]*')
+
+
+class Nesting:
+    '''
+    Follows the nesting depth of a JSON text fed in pieces, without a loop
+    over the strings in Python
+    '''
+
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        # The piece ended with the backslash of an escape
+        self.escaped = False
+
+    def feed(self, data):
+        if self.escaped and data:
+            data = data[1:]
+            self.escaped = False
+        # Backslashes are only in strings, with them gone every quote left
+        # starts or ends one
+        data = data.replace(b"\\\\", b"")
+        if data.endswith(b"\\"):
+            self.escaped = True
+            data = data[:-1]
+        parts = data.replace(b'\\"', b"").split(b'"')
+        outside = b"".join(parts[1 if self.in_string else 0::2])
+        if len(parts) % 2 == 0:
+            self.in_string = not self.in_string
+        self.depth += (outside.count(b"{") + outside.count(b"[")
+                       - outside.count(b"}") - outside.count(b"]"))
+
+
+def value_end(buffer, position, nesting):
+    '''
+    Looks for the end of the JSON value at position. Returns the end or
+    None if it hasn't arrived yet, and the position and Nesting of the value
+    to carry on from with more data.
+    '''
+    if nesting is None:
+        position = _space.match(buffer, position).end()
+        if position == len(buffer):
+            return None, position, None
+        first = buffer[position]
+        if first == ord('"'):
+            match = _string.match(buffer, position)
+            return (match and match.end()), position, None
+        if first not in b"{[":
+            end = _scalar.match(buffer, position).end()
+            return (end if end < len(buffer) else None), position, None
+        nesting = Nesting()
+    # Only the brackets that could end a top level value are checked
+    for match in _close.finditer(buffer, position):
+        nesting.feed(buffer[position:match.end()])
+        position = match.end()
+        if nesting.depth == 0 and not nesting.in_string:
+            return position, position, None
+    nesting.feed(buffer[position:])
+    return None, len(buffer), nesting
+
+
+def key_pattern(keys):
+    pattern = _key_patterns.get(keys)
+    if pattern is None:
+        names = b"|".join(re.escape(key.encode()) for key in keys)
+        pattern = _key_patterns[keys] = re.compile(rb'"(' + names + rb')"\s*:\s*')
+    return pattern
+
+
+def extract_tmp(chunks):
+    '''
+    Only the "Tmp" value
+    '''
+    return extract(chunks)["Tmp"]
+
+
+class Fetcher:
+    '''
+    Gets a Snapshot of the tracked sections of the world state for a
+    platform. Remembers the validators and the digest of the last response
+    for each platform so unchanged world states can be skipped.
+    '''
+    # SENTIENT_TRACKER_URL can point to a local stand-in (benchmarks/standin.py)
+    base_url = os.environ.get("SENTIENT_TRACKER_URL",
+                              "http://content{}.warframe.com/dynamic/worldState.php")
+    platforms = {"PC": "",
+                 "PS4": ".ps4",
+                 "XB1": ".xb1"}
+
+    def __init__(self, extra_sections=()):
+        self._session = None
+        self.set_sections(extra_sections)
+        # Body bytes on the wire and after decoding for every platform
+        self.bandwidth = {platform: {"wire": 0, "decoded": 0} for platform in self.platforms}
+        self.lock = threading.Lock()
+        # archive.Archive that gets the whole responses, they are read to the
+        # end then
+        self.archive = None
+        # Responses being read by cancel token
+        self.responses = {}
+        self.stats = {"polls": 0,
+                      "not_modified": 0,
+                      "unchanged": 0,
+                      "bytes_read": 0,
+                      "bytes_saved": 0}
+
+    @property
+    def session(self):
+        '''
+        The HTTP session, requests is only imported by the first fetch to keep
+        it out of the startup time
+        '''
+        if self._session is None:
+            with self.lock:
+                if self._session is None:
+                    import requests
+                    session = requests.Session()
+                    session.headers["Accept-Encoding"] = accept_encoding()
+                    self._session = session
+        return self._session
+
+    def count(self, name, amount=1):
+        '''
+        Increases one of the counters, fetches can run in several threads
+        '''
+        with self.lock:
+            self.stats[name] += amount
+        metrics.inc(f"sentient_{name}_total", amount)
+
+    def account(self, platform, wire, decoded):
+        '''
+        Adds the body bytes of a poll to the bandwidth of the platform
+        '''
+        with self.lock:
+            bandwidth = self.bandwidth[platform]
+            bandwidth["wire"] += wire
+            bandwidth["decoded"] += decoded
+        metrics.inc("sentient_wire_bytes_total", wire, platform=platform)
+        metrics.inc("sentient_decoded_bytes_total", decoded, platform=platform)
+
+    def set_sections(self, extra):
+        '''
+        Tracks the extra sections besides the anomaly, see snapshot.SECTIONS
+        '''
+        self.sections = sections(extra)
+        self.keys = keys(self.sections)
+        # The last values don't have the new sections
+        self.last = {platform: {} for platform in self.platforms}
+
+    def forget(self, platform):
+        '''
+        Drops what is known about the platform so the next fetch returns the
+        value even if it didn't change
+        '''
+        self.last[platform] = {}
+
+    def cancel(self, token):
+        '''
+        Cancels the fetch using the token (a threading.Event), the response
+        being read is aborted
+        '''
+        token.set()
+        with self.lock:
+            response = self.responses.get(token)
+        if response is not None:
+            abort(response)
+
+    def fetch(self, platform, token=None):
+        '''
+        Returns the Snapshot or None if nothing changed since the last
+        fetch. Raises FetchError on failure and Cancelled if the token was
+        cancelled.
+        '''
+        import requests
+        token = token or threading.Event()
+        try:
+            value = self._fetch(platform, token)
+        except (requests.exceptions.RequestException, ValueError, KeyError, TypeError,
+                AttributeError) as e:
+            if token.is_set():
+                raise Cancelled(platform) from e
+            metrics.inc("sentient_errors_total", platform=platform, type=type(e).__name__)
+            raise FetchError(e) from e
+        finally:
+            with self.lock:
+                self.responses.pop(token, None)
+        metrics.success(platform)
+        return value
+
+    def _fetch(self, platform, token):
+        last = self.last[platform]
+        headers = {}
+        if "etag" in last:
+            headers["If-None-Match"] = last["etag"]
+        if "modified" in last:
+            headers["If-Modified-Since"] = last["modified"]
+
+        url = self.base_url.format(self.platforms[platform])
+        self.count("polls")
+        start = time.perf_counter()
+        with self.session.get(url, headers=headers, timeout=(3.05, 5), stream=True) as r:
+            with self.lock:
+                self.responses[token] = r
+            if token.is_set():
+                raise Cancelled(platform)
+            if r.status_code == 304 and "value" in last:
+                metrics.observe("sentient_request_seconds", time.perf_counter() - start,
+                                platform=platform)
+                self.count("not_modified")
+                self.count("bytes_saved", last["size"])
+                if self.archive is not None:
+                    self.archive.put(platform, None)
+                return None
+            r.raise_for_status()
+
+            digest = hashlib.blake2b(digest_size=16)
+            size = 0
+            read_time = 0.0
+            body = [] if self.archive is not None else None
+
+            def chunks():
+                nonlocal size, read_time
+                content = r.iter_content(chunk_size=16384)
+                while True:
+                    if token.is_set():
+                        raise Cancelled(platform)
+                    # Time spent waiting for the network isn't parse time
+                    before = time.perf_counter()
+                    chunk = next(content, None)
+                    read_time += time.perf_counter() - before
+                    if chunk is None:
+                        return
+                    digest.update(chunk)
+                    size += len(chunk)
+                    if body is not None:
+                        body.append(chunk)
+                    yield chunk
+
+            headers_received = time.perf_counter()
+            stream = chunks()
+            value = Snapshot.parse(extract(stream, self.keys), self.sections)
+            done = time.perf_counter()
+            # Without a Content-Length (chunked) the rest isn't known and the
+            # connection is closed
+            length = r.headers.get("Content-Length")
+            drain = length is not None and int(length) - r.raw.tell() <= DRAIN_BYTES
+            if body is not None or drain:
+                for _ in stream:
+                    pass
+            # Compressed bytes read so far, a big rest of the body is skipped
+            wire = r.raw.tell()
+            encoding = r.headers.get("Content-Encoding", "identity")
+            etag = r.headers.get("ETag")
+            modified = r.headers.get("Last-Modified")
+            length = int(r.headers.get("Content-Length", size))
+
+        if body is not None:
+            self.archive.put(platform, b"".join(body))
+        self.count("bytes_read", size)
+        self.account(platform, wire, size)
+        metrics.inc("sentient_encoding_total", platform=platform, encoding=encoding)
+        metrics.observe("sentient_request_seconds", done - start, platform=platform)
+        metrics.observe("sentient_response_bytes", size, SIZE_BUCKETS, platform=platform)
+        metrics.observe("sentient_wire_bytes", wire, SIZE_BUCKETS, platform=platform)
+        metrics.observe("sentient_parse_seconds", done - headers_received - read_time,
+                        PARSE_BUCKETS, platform=platform)
+        # The digest only covers the part of the body that was read which
+        # always includes the whole values of the sections
+        digest = digest.digest()
+        unchanged = last.get("digest") == digest or last.get("value") == value
+
+        self.last[platform] = {"value": value, "digest": digest, "size": length}
+        if etag:
+            self.last[platform]["etag"] = etag
+        if modified:
+            self.last[platform]["modified"] = modified
+
+        if unchanged:
+            self.count("unchanged")
+            return None
+        return value